@@ -0,0 +1,166 @@
+# airports.py
+
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from utils import normalize_place
+
+logger = logging.getLogger(__name__)
+
+AIRPORTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'airports.json')
+MAX_COUNTRY_AIRPORTS = 3
+MIN_PREFIX_LENGTH = 4
+# Typos are only corrected between names of FUZZY_MIN_LENGTH letters or more (Milas is not Milan): one edit up to
+# LONG_NAME_LENGTH letters, two edits above it. Anything less certain is a miss and is left to the model.
+FUZZY_MIN_LENGTH = 6
+LONG_NAME_LENGTH = 8
+
+
+class AirportIndex:
+    """
+    Offline index of airports by IATA code, airport name, city and country, in Latin, Hebrew, Cyrillic and Arabic.
+    All names are stored under their normalize_place key, so lookups ignore case, punctuation and script.
+    IATA codes only match exactly, prefixes and typos are only matched against names.
+    """
+
+    def __init__(self, airports, countries):
+        """
+        :param airports: List of [iata, city, country_code, city_aliases, airport_names] rows, most important first.
+        :param countries: Dict of country_code -> list of country names.
+        """
+        city_codes = defaultdict(list)
+        main_codes = defaultdict(list)
+        secondary_codes = defaultdict(list)
+        for iata, city, country, _, _ in airports:
+            # The main airport of each city ranks before the secondary airports of the country
+            (secondary_codes if city in city_codes else main_codes)[country].append(iata)
+            city_codes[city].append(iata)
+        country_codes = {country: main_codes[country] + secondary_codes[country] for country in countries}
+
+        self._iata_codes = {normalize_place(iata): (iata,) for iata, _, _, _, _ in airports}
+        self._codes = {}
+        # Earlier entries win on key collisions: airport names, then cities, then countries
+        for iata, _, _, _, airport_names in airports:
+            for name in airport_names:
+                self._add(name, (iata,))
+        for _, city, _, city_aliases, _ in airports:
+            for name in [city, *city_aliases]:
+                self._add(name, tuple(city_codes[city]))
+        for country, names in countries.items():
+            for name in names:
+                self._add(name, tuple(country_codes[country][:MAX_COUNTRY_AIRPORTS]))
+
+        self._keys_by_initial = defaultdict(list)
+        for key in sorted(self._codes):
+            self._keys_by_initial[key[0]].append(key)
+
+    def _add(self, name, codes):
+        key = normalize_place(name)
+        if key and codes:
+            self._codes.setdefault(key, codes)
+
+    @classmethod
+    def load(cls, path=AIRPORTS_FILE):
+        """
+        Builds the index from the bundled airports dataset.
+        :param path: Path to the JSON dataset.
+        :return: AirportIndex
+        """
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(data['airports'], data['countries'])
+        logger.info("Loaded offline airport index with %s names", len(index))
+        return index
+
+    def __len__(self):
+        return len(self._codes) + len(self._iata_codes)
+
+    def lookup(self, place: str):
+        """
+        Finds the airports for a place by exact name, then by unambiguous prefix, then by fuzzy match.
+        :param place: City, country, airport name or IATA code.
+        :return: IATA codes separated by comma, or None if the place is not in the index.
+        """
+        key = normalize_place(place)
+        if not key:
+            return None
+        codes = (self._iata_codes.get(key) or self._codes.get(key) or self._lookup_prefix(key)
+                 or self._lookup_fuzzy(key))
+        return ",".join(codes) if codes else None
+
+    def _lookup_prefix(self, key):
+        if len(key) < MIN_PREFIX_LENGTH:
+            return None
+        matches = {self._codes[name] for name in self._keys_by_initial[key[0]] if name.startswith(key)}
+        return matches.pop() if len(matches) == 1 else None
+
+    def _lookup_fuzzy(self, key):
+        if len(key) < FUZZY_MIN_LENGTH:
+            return None
+        max_edits = 1 if len(key) <= LONG_NAME_LENGTH else 2
+        # Candidates share the first letter, which keeps the comparison set small
+        best, matches = max_edits, set()
+        for name in self._keys_by_initial[key[0]]:
+            if abs(len(name) - len(key)) > max_edits or len(name) < FUZZY_MIN_LENGTH:
+                continue
+            distance = _edit_distance(key, name, best)
+            if distance > best:
+                continue
+            if distance < best:
+                best, matches = distance, {self._codes[name]}
+            else:
+                matches.add(self._codes[name])
+        # Names equally close to different airports are ambiguous
+        return matches.pop() if len(matches) == 1 else None
+
+
+def _edit_distance(a, b, limit):
+    """
+    Counts the insertions, deletions, substitutions and swaps of adjacent letters turning a into b.
+    :param limit: Distances above it are not needed, the count stops at limit + 1.
+    :return: The edit distance, or limit + 1 if it is larger than limit.
+    """
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return min(current[-1], limit + 1)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_airport_index() -> AirportIndex:
+    """
+    Returns the process-wide airport index, loading it on first use.
+    :return: AirportIndex
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = AirportIndex.load()
+    return _index
+
+
+def lookup_airports(place: str):
+    """
+    This function returns IATA codes of airports for a place using the offline index only.
+    :param place: City, country, airport name or IATA code.
+    :return: IATA codes separated by comma, or None if the place is unknown offline.
+    """
+    try:
+        return get_airport_index().lookup(place)
+    except (OSError, ValueError) as e:
+        logger.error(f"Offline airport index is unavailable: {e}")
+        return None
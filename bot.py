@@ -1,23 +1,52 @@
 # bot.py
 
+import asyncio
 import logging
-import threading
+import re
+import resource
 import time
 from datetime import datetime
+from functools import partial
 from dateutil import parser
 import telebot
+from telebot.async_telebot import AsyncTeleBot
+from telebot import asyncio_helper
+from telebot.asyncio_helper import ApiTelegramException
+import config
 from config import TELEGRAM_TOKEN
-from gemini import get_airports, recommend_attractions_and_tips
-from searchflight import search_details, handle_flight_search, flight_results, handle_booking_search,format_flight_details
+from flights import MAX_FLEX_DAYS, flights_cache
+from gemini import (
+    get_airports_concurrently, recommend_attractions_and_tips, warm_recommendations, get_airport_cache_stats,
+    recommendation_cache
+)
+from searchflight import (
+    search_details, handle_flight_search, flight_results, handle_booking_search, format_flight_details,
+    handle_flight_query_callback, handle_flex_search, cancel_return_prefetch
+)
 from checklist_functions import (
-    show_checklist, ask_to_modify_checklist, handle_modify_checklist_response_callback,
+    show_checklist, handle_modify_checklist_response_callback,
     handle_item_addition, handle_item_deletion, handle_status_change_callback,
-    handle_status_update_selection, user_states, new_checklist, checklist_response_call
+    handle_status_update_selection, handle_item_toggle_callback, user_states, new_checklist, checklist_response_call
 )
-from utils import get_language, set_language, translate
+from utils import get_language, set_language, translate, html_safe_prefix
+from database import close_connection, ensure_indexes, checklist_cache
+from state import StateNamespace, CONVERSATION_STATE_TTL, close_state_store, get_state_stats
+from workers import run_api, run_db, shutdown_workers, long_jobs, QueueFullError
+from dispatcher import UpdateDispatcher
+from outbox import Outbox
+from webhook import run_webhook
 
 # Initialize the bot with your token
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
+bot = AsyncTeleBot(TELEGRAM_TOKEN)
+# Messages and edits go through a rate-limited outbound queue (see outbox.py)
+outbox = Outbox(bot)
+outbox.install()
+# "polling" or "webhook" (see webhook.py)
+BOT_MODE = getattr(config, "BOT_MODE", "polling")
+# Bot API server, e.g. the fake server of fake_telegram.py for local load tests
+TELEGRAM_API_URL = getattr(config, "TELEGRAM_API_URL", None)
+if TELEGRAM_API_URL:
+    asyncio_helper.API_URL = TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
 
 # Setup logging
 logging.basicConfig(
@@ -26,11 +55,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-user_state = {}
+user_state = StateNamespace("user_state", ttl=CONVERSATION_STATE_TTL)
+
+ADMIN_CHAT_IDS = set(getattr(config, "ADMIN_CHAT_IDS", []))
+# Minimal seconds between edits of a streamed recommendation, Telegram throttles frequent edits of one message
+RECOMMENDATION_EDIT_INTERVAL = getattr(config, "RECOMMENDATION_EDIT_INTERVAL", 1.5)
+# "01.08.2024 ±3" searches 3 days before and after the date
+FLEX_DAYS_PATTERN = re.compile(r"\s*(?:±|\+-|\+/-)\s*(\d+)\s*$")
+
+
+async def submit_long_job(chat_id, kind, job):
+    """
+    Queues a long-running job (recommendation, flight search) for the chat and tells the user if it has to wait.
+    :param chat_id: The chat the job belongs to.
+    :param kind: Kind of the job, a chat can have one job of each kind at a time.
+    :param job: Coroutine function without arguments.
+    """
+    try:
+        position = long_jobs.submit(chat_id, kind, job)
+    except QueueFullError as e:
+        logger.warning("Rejected %s job for chat #%s: %s", kind, chat_id, e)
+        bot.send_message(chat_id, translate(chat_id, 'busy_try_later'))
+        return
+    if position is None:
+        bot.send_message(chat_id, translate(chat_id, 'request_in_progress'))
+    elif position > 0:
+        logger.info("Queued %s job for chat #%s at position %s", kind, chat_id, position)
+        bot.send_message(chat_id, translate(chat_id, 'busy_queued').format(position=position))
 
 # Define the /start and /help command handlers
 @bot.message_handler(commands=['start', 'help'])
-def send_welcome(message: telebot.types.Message):
+async def send_welcome(message: telebot.types.Message):
     chat_id = message.chat.id
     markup = telebot.types.ReplyKeyboardMarkup(one_time_keyboard=True)
     markup.add(telebot.types.KeyboardButton('🇺🇲 English'), telebot.types.KeyboardButton('עברית 🇮🇱'), telebot.types.KeyboardButton('🇷🇺 Русский'),telebot.types.KeyboardButton('العربية 🇸🇦'))
@@ -38,7 +93,7 @@ def send_welcome(message: telebot.types.Message):
 
 # Handle language selection
 @bot.message_handler(func=lambda message: message.text in ['🇺🇲 English','🇷🇺 Русский' , 'עברית 🇮🇱','العربية 🇸🇦'])
-def set_user_language(message: telebot.types.Message):
+async def set_user_language(message: telebot.types.Message):
     chat_id = message.chat.id
     if message.text == '🇺🇲 English':
         set_language(chat_id, 'en')
@@ -59,12 +114,13 @@ def set_user_language(message: telebot.types.Message):
         telebot.types.InlineKeyboardButton(translate(chat_id, 'dest_recommend'), callback_data="ask_destination")
     )
     cover_image_path = './assets/cover.webp'
-    with open(cover_image_path, 'rb') as photo:
-        bot.send_photo(chat_id, photo, caption=welcome_message, reply_markup=markup)
+    with open(cover_image_path, 'rb') as cover:
+        photo = cover.read()
+    bot.send_photo(chat_id, photo, caption=welcome_message, reply_markup=markup)
 
 # Define the /checklist command handler
 @bot.message_handler(commands=['checklist'])
-def handle_checklist(message: telebot.types.Message):
+async def handle_checklist(message: telebot.types.Message):
     chat_id = message.chat.id
     lang = get_language(chat_id)
     checklist_prompt = translate(chat_id, 'checklist_prompt')
@@ -83,7 +139,7 @@ def handle_checklist(message: telebot.types.Message):
 
 
 @bot.message_handler(commands=['language'])
-def handle_language(message: telebot.types.Message):
+async def handle_language(message: telebot.types.Message):
     chat_id = message.chat.id
     language_selection_prompt = translate(chat_id, 'language_selection_prompt')
     markup = telebot.types.ReplyKeyboardMarkup(one_time_keyboard=True)
@@ -92,24 +148,75 @@ def handle_language(message: telebot.types.Message):
 
 # Define the /recommendations command handler
 @bot.message_handler(commands=['recommendations'])
-def handle_recommendations(message: telebot.types.Message):
+async def handle_recommendations(message: telebot.types.Message):
     chat_id = message.chat.id
     lang = get_language(chat_id)
     bot.send_message(chat_id, translate(chat_id, 'ask_destination'))
-    bot.register_next_step_handler(message, handle_destination_input)
+    user_state[chat_id] = 'waiting_for_destination'
+
+# Define the /warm_recommendations admin command handler
+@bot.message_handler(commands=['warm_recommendations'], func=lambda message: message.chat.id in ADMIN_CHAT_IDS)
+async def handle_warm_recommendations(message: telebot.types.Message):
+    chat_id = message.chat.id
+    args = message.text.split()[1:]
+    top_n = int(args[0]) if args and args[0].isdigit() else 50
+
+    async def warm():
+        warmed = await run_api(warm_recommendations, top_n)
+        bot.send_message(chat_id, f"Warmed {warmed} recommendations for the top {top_n} destinations.")
+
+    bot.send_message(chat_id, f"Warming recommendations for the top {top_n} destinations...")
+    await submit_long_job(chat_id, "warm_recommendations", warm)
+
+# Define the /stats admin command handler
+@bot.message_handler(commands=['stats'], func=lambda message: message.chat.id in ADMIN_CHAT_IDS)
+async def handle_stats(message: telebot.types.Message):
+    chat_id = message.chat.id
+    state_stats = await run_db(get_state_stats)
+    jobs = long_jobs.stats()
+    lines = [
+        f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB",
+        f"State ({state_stats['backend']}): {state_stats.get('entries', '?')} keys",
+    ]
+    if "bytes" in state_stats:
+        lines.append(f"State size: ~{state_stats['bytes'] // 1024} KB, {state_stats['evictions']} evicted, "
+                     f"{state_stats['expirations']} expired")
+        for namespace, ns in sorted(state_stats["namespaces"].items()):
+            lines.append(f"• {namespace}: {ns['entries']} keys, ~{ns['bytes'] // 1024} KB")
+    if "local" in state_stats:
+        lines.append(f"State in process: {state_stats['local']['size']} keys, "
+                     f"{state_stats['local']['hit_ratio']:.0%} hits, {state_stats['blocking_reads']} blocking reads, "
+                     f"{state_stats['pending_writes']} pending writes, {state_stats['read_errors']} failed reads, "
+                     f"{state_stats['write_errors']} failed writes")
+    airports = get_airport_cache_stats()
+    lines.append(f"Airports: {airports['hit_ratio']:.0%} without the model, {airports['offline_hits']} offline, "
+                 f"{airports['memory_hits']} memory, {airports['persistent_hits']} MongoDB, "
+                 f"{airports['model_calls']} model calls")
+    for cache in (airports["memory"], flights_cache.stats(), checklist_cache.stats(), recommendation_cache.stats()):
+        lines.append(f"Cache {cache['name']}: {cache['size']}/{cache['max_size']} keys, {cache['hit_ratio']:.0%} hits, "
+                     f"{cache['evictions']} evicted, {cache['expirations']} expired")
+    lines.append(f"Jobs: {jobs['running']}/{jobs['workers']} running, {jobs['waiting']} waiting")
+    sends = outbox.stats()
+    lines.append(f"Outbox: {sends['pending']} pending, {sends['sent_per_second']:.1f} sent/s, {sends['sent']} sent, "
+                 f"{sends['coalesced']} coalesced, {sends['retried']} retried, {sends['failed']} failed")
+    lines.append(f"Outbox latency: p50 {sends['latency_p50']:.2f} s, p95 {sends['latency_p95']:.2f} s, "
+                 f"max {sends['latency_max']:.2f} s")
+    bot.send_message(chat_id, "\n".join(lines))
 
 # Define the /searchflight command handler
 @bot.message_handler(commands=['searchflight'])
-def search_flight(message: telebot.types.Message):
+async def search_flight(message: telebot.types.Message):
     chat_id = message.chat.id
     username = message.from_user.username
     logger.info(f"> New flight search at #{chat_id}. username: {username}")
+    # A new search ends the previous one, its return flight prefetches are no longer needed
+    cancel_return_prefetch(chat_id)
     bot.send_message(chat_id,translate(chat_id, 'flight_search_details'))
     user_state[chat_id] = 'waiting_for_flight_details'
 
 # Handle incoming messages for flight search details
 @bot.message_handler(func=lambda message: user_state.get(message.chat.id) in ['waiting_for_flight_details'])
-def handle_message(message: telebot.types.Message):
+async def handle_message(message: telebot.types.Message):
     chat_id = message.chat.id
     username = message.from_user.username
     text = message.text
@@ -124,6 +231,11 @@ def handle_message(message: telebot.types.Message):
 
         departure_city, arrival_city = flight_details[:2]
 
+        flex_match = FLEX_DAYS_PATTERN.search(flight_details[2])
+        flex_days = min(int(flex_match.group(1)), MAX_FLEX_DAYS) if flex_match else 0
+        if flex_match:
+            flight_details[2] = flight_details[2][:flex_match.start()]
+
         try:
             departure_date = parser.parse(flight_details[2], dayfirst=True)
             return_date = parser.parse(flight_details[3], dayfirst=True).strftime('%Y-%m-%d') if len(
@@ -141,53 +253,65 @@ def handle_message(message: telebot.types.Message):
             bot.send_message(chat_id, translate(chat_id, 'departure_date_warning'))
             return
 
-        departure_id, arrival_id = get_airports(departure_city), get_airports(arrival_city)
-
-        if departure_id == "NO_RESULT" or arrival_id == "NO_RESULT":
-            bot.send_message(chat_id,
-                             f"translate(chat_id, 'airport_not_found_warning') {departure_city if departure_id == 'NO_RESULT' else arrival_city}.")
-            return
-
-        search_details[chat_id] = {
-            "departure_city": departure_city,
-            "arrival_city": arrival_city,
-            "departure_id": departure_id,
-            "arrival_id": arrival_id,
-            "departure_date": departure_date.strftime('%Y-%m-%d'),
-            "return_date": return_date,
-            "is_one_way": len(flight_details) == 3
-        }
-        handle_flight_search(bot, chat_id, departure_id, arrival_id, departure_date.strftime('%Y-%m-%d'), return_date)
-
-        user_state[chat_id] = None
+        # Airport lookups may ask the model, they run in the job so other chats of this update lane do not wait
+        await submit_long_job(chat_id, "flights", partial(resolve_and_search_flights, chat_id, departure_city,
+                                                          arrival_city, departure_date.strftime('%Y-%m-%d'),
+                                                          return_date, len(flight_details) == 3, flex_days))
     # else:
     #     bot.send_message(chat_id, "Please use the /help command to see the list of the commands.",
     #                      parse_mode='Markdown')
 
+
+async def resolve_and_search_flights(chat_id, departure_city, arrival_city, departure_date, return_date, is_one_way,
+                                     flex_days):
+    """
+    Resolves the airports of both places and searches the flights, or the dates around them for a flexible search.
+    If a place is not found the chat keeps waiting for flight details.
+    """
+    departure_id, arrival_id = await run_api(get_airports_concurrently, departure_city, arrival_city)
+
+    if departure_id in ("", "NO_RESULT") or arrival_id in ("", "NO_RESULT"):
+        bot.send_message(chat_id,
+                         f"{translate(chat_id, 'airport_not_found_warning')} {departure_city if departure_id in ('', 'NO_RESULT') else arrival_city}.")
+        return
+
+    search_details[chat_id] = {
+        "departure_city": departure_city,
+        "arrival_city": arrival_city,
+        "departure_id": departure_id,
+        "arrival_id": arrival_id,
+        "departure_date": departure_date,
+        "return_date": return_date,
+        "is_one_way": is_one_way
+    }
+    user_state[chat_id] = None
+    if flex_days:
+        await handle_flex_search(bot, chat_id, departure_id, arrival_id, departure_date, return_date, flex_days)
+    else:
+        await handle_flight_search(bot, chat_id, departure_id, arrival_id, departure_date, return_date)
+
 # Define the callback query handler for button presses
 @bot.callback_query_handler(func=lambda call: True)
-def callback_query(call):
+async def callback_query(call):
     chat_id = call.message.chat.id
     lang = get_language(chat_id)
     if call.data == "search_flight":
         # Trigger the search_flight command when the inline button is pressed
-        search_flight(call.message)
+        await search_flight(call.message)
     elif call.data == "checklist":
         # Call checklist_response_call to prompt the user
-        checklist_response_call(bot, chat_id)
+        await checklist_response_call(bot, chat_id)
         # Set user state to indicate waiting for checklist response
         user_states[chat_id] = "waiting_for_checklist_response"
     elif call.data == "show_checklist":
         if user_states.get(chat_id) == "waiting_for_checklist_response":
-            show_checklist(bot, chat_id)
-            ask_to_modify_checklist(bot, chat_id)
+            await show_checklist(bot, chat_id, new_message=True)
             user_states[chat_id] = None  # Reset the state
 
     elif call.data == "start_new_checklist":
         if user_states.get(chat_id) == "waiting_for_checklist_response":
-            new_checklist(bot, call)
-            show_checklist(bot, chat_id)
-            ask_to_modify_checklist(bot, chat_id)
+            checklist = await new_checklist(bot, call)
+            await show_checklist(bot, chat_id, checklist, new_message=True)
             user_states[chat_id] = None  # Reset the state
         else:
             bot.send_message(chat_id, "Alright! If you need anything else, just let me know.")
@@ -195,55 +319,105 @@ def callback_query(call):
         # ask_to_modify_checklist(bot, chat_id)
     elif call.data == "ask_destination":
         bot.send_message(chat_id, translate(chat_id, 'ask_destination'))
-        bot.register_next_step_handler(call.message, handle_destination_input)
+        user_state[chat_id] = 'waiting_for_destination'
     elif call.data in ["add_item", "delete_item", "update_status", "keep_as_is"]:
-        handle_modify_checklist_response_callback(bot, call)
+        await handle_modify_checklist_response_callback(bot, call)
     elif call.data in ["done", "not_done"]:
-        handle_status_change_callback(bot, call)
+        await handle_status_change_callback(bot, call)
+    elif call.data.startswith("toggle:"):
+        await handle_item_toggle_callback(bot, call)
     elif call.data.startswith('flight_'):
-        handle_flight_selection(call)
+        await handle_flight_selection(call)
+    elif call.data.startswith('fq:'):
+        await handle_flight_query_callback(bot, call)
+    elif call.data.startswith('flex:'):
+        await handle_flex_date_selection(call)
 
 
 # Handle the checklist modification response
 @bot.message_handler(func=lambda message: user_states.get(message.chat.id) in ["waiting_for_item", "waiting_for_item_delete"])
-def handle_modify_item(message):
+async def handle_modify_item(message):
     state = user_states.get(message.chat.id)
     if state == "waiting_for_item":
-        handle_item_addition(bot, message)
+        await handle_item_addition(bot, message)
     elif state == "waiting_for_item_delete":
-        handle_item_deletion(bot, message)
+        await handle_item_deletion(bot, message)
 
 # Handle the status update selection
 @bot.message_handler(func=lambda message: user_states.get(message.chat.id) == "waiting_for_status_update")
-def handle_update_status(message):
-    handle_status_update_selection(bot, message)
+async def handle_update_status(message):
+    await handle_status_update_selection(bot, message)
 
 # Handle user input for destination recommendations
-def handle_destination_input(message):
+@bot.message_handler(func=lambda message: user_state.get(message.chat.id) == 'waiting_for_destination')
+async def handle_destination_input(message):
     chat_id = message.chat.id
     lang = get_language(chat_id)
     destination = message.text.strip()
+    user_state[chat_id] = None
     if destination:
-        threading.Thread(target=send_recommendation, args=(chat_id, destination, lang)).start()
+        await submit_long_job(chat_id, "recommendation", partial(send_recommendation, chat_id, destination, lang))
     else:
         bot.send_message(chat_id, translate(chat_id, 'invalid_destination'))
 
     # send_recommendation(chat_id, destination, lang)
 
 
-def send_recommendation(chat_id, destination, lang):
+async def send_recommendation(chat_id, destination, lang):
     logger.info(f"Getting recommendation for {destination!r}")
     t0 = time.perf_counter()
-    message_id = bot.send_message(chat_id, translate(chat_id, 'loading_recommendations')).id
-    recommendations = recommend_attractions_and_tips(destination, lang)
+    message_id = (await bot.send_message(chat_id, translate(chat_id, 'loading_recommendations'))).id
+
+    # The model streams into `streamed` from a worker thread, the message shows a renderable prefix of it
+    streamed = {"text": ""}
+    def on_chunk(text):
+        streamed["text"] = text
+
+    task = asyncio.ensure_future(run_api(recommend_attractions_and_tips, destination, lang, on_chunk))
+    shown = ""
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=RECOMMENDATION_EDIT_INTERVAL)
+        if done:
+            break
+        partial_text = html_safe_prefix(streamed["text"])
+        if partial_text.strip() and partial_text != shown:
+            try:
+                await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=partial_text, parse_mode='HTML')
+                shown = partial_text
+            except ApiTelegramException as e:
+                logger.warning(f"Could not show partial recommendation for {destination!r}: {e}")
+
+    recommendations = task.result()
     t = time.perf_counter() - t0
     logger.info(f"Got recommendation for {destination!r} in {t:.1f} s")
-    bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=recommendations, parse_mode='HTML')
+    if recommendations != shown:
+        bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=recommendations, parse_mode='HTML')
 
 
+# Handle date selection in a price calendar
+async def handle_flex_date_selection(call):
+    """
+    Shows the flights of the date pair chosen in a price calendar, the search is served from the flights cache.
+    """
+    chat_id = call.message.chat.id
+    _, departure_date, return_date = call.data.split(":")
+    search_detail = search_details.get(chat_id)
+    await bot.answer_callback_query(call.id)
+    if not search_detail:
+        bot.send_message(chat_id, translate(chat_id, 'no_search_details'))
+        return
+
+    # Booking and return flight searches use the chosen dates
+    search_detail["departure_date"] = departure_date
+    search_detail["return_date"] = return_date or None
+    search_details[chat_id] = search_detail
+    await submit_long_job(chat_id, "flights", partial(handle_flight_search, bot, chat_id, search_detail["departure_id"],
+                                                      search_detail["arrival_id"], departure_date,
+                                                      return_date or None))
+
 # Handle flight selection
 @bot.callback_query_handler(func=lambda call: call.data.startswith('flight_'))
-def handle_flight_selection(call):
+async def handle_flight_selection(call):
     """
     Handles the flight selection from the inline keyboard and displays flight details, followed by booking options.
     """
@@ -252,11 +426,13 @@ def handle_flight_selection(call):
         data_parts = call.data.split('_')
         flight_index = int(data_parts[1])
 
-        flight_info = flight_results[chat_id][flight_index]['flight']
+        flight = flight_results[chat_id].flights[flight_index]
         search_detail = search_details[chat_id]
         is_one_way = search_detail["is_one_way"]
+        # Tokens of a flight found by one airport pair of a multi-airport search only work with that pair
+        departure_id, arrival_id = flight.route or (search_detail["departure_id"], search_detail["arrival_id"])
 
-        flight_details = format_flight_details(flight_info, chat_id)
+        flight_details = format_flight_details(flight, chat_id)
         bot.send_message(chat_id, flight_details, parse_mode='HTML')
 
         search_type = data_parts[2]
@@ -264,24 +440,29 @@ def handle_flight_selection(call):
 
         if search_type == "depart":
             if is_one_way:
-                token = flight_info.get('booking_token')
+                token = flight.booking_token
                 if token:
-                    handle_booking_search(bot, chat_id, token, is_one_way=True)
+                    await submit_long_job(chat_id, "flights",
+                                          partial(handle_booking_search, bot, chat_id, token, is_one_way=True,
+                                                  route=flight.route))
                 else:
                     logger.error(chat_id, "Booking token not found for this flight.")
                     logger.error("Booking token not found for one-way flight in chat #%s", chat_id)
             else:
-                token = flight_info.get('departure_token')
+                token = flight.departure_token
                 if token:
-                    handle_flight_search(bot, chat_id, search_detail["departure_id"], search_detail["arrival_id"],
-                                         search_detail["departure_date"], search_detail["return_date"], token)
+                    cancel_return_prefetch(chat_id, keep_token=token)
+                    await submit_long_job(chat_id, "flights", partial(
+                        handle_flight_search, bot, chat_id, departure_id, arrival_id,
+                        search_detail["departure_date"], search_detail["return_date"], token))
                 else:
                     logger.error(chat_id, "Departure token not found for this flight.")
                     logger.error("Departure token not found for return flight in chat #%s", chat_id)
         elif search_type == "return":
-            token = flight_info.get('booking_token')
+            token = flight.booking_token
             if token:
-                handle_booking_search(bot, chat_id, token, is_one_way)
+                await submit_long_job(chat_id, "flights", partial(handle_booking_search, bot, chat_id, token, is_one_way,
+                                                                  route=flight.route))
             else:
                 logger.error(chat_id, "Booking token not found for this flight.")
                 logger.error("Booking token not found for return flight in chat #%s", chat_id)
@@ -291,6 +472,19 @@ def handle_flight_selection(call):
 
 # Start the bot
 if __name__ == "__main__":
-    logger.info("* Start polling...")
-    bot.infinity_polling()
+    try:
+        ensure_indexes()
+    except Exception as e:
+        logger.exception("Could not ensure database indexes: %s", e)
+    try:
+        if BOT_MODE == "webhook":
+            run_webhook(bot)
+        else:
+            logger.info("* Start polling...")
+            UpdateDispatcher(bot).install()
+            asyncio.run(bot.infinity_polling())
+    finally:
+        shutdown_workers()
+        close_state_store()
+        close_connection()
     logger.info("* Bye!")
@@ -1,36 +1,37 @@
 # # checklist_functions.py
 
 import logging
-from database import get_or_create_checklist, add_item_to_checklist, delete_item_from_checklist, update_item_status, get_checklists_collection
-from telebot import TeleBot
+import config
+from database import (
+    get_or_create_checklist, add_item_to_checklist, delete_item_from_checklist, update_item_status, reset_checklist,
+    toggle_item_status, item_key
+)
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from state import StateNamespace, CONVERSATION_STATE_TTL
 from utils import translate
+from workers import run_db
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
 # State management for tracking user interactions
-user_states = {}
+user_states = StateNamespace("checklist_states", ttl=CONVERSATION_STATE_TTL)
+# Live checklist mode: one checklist message per chat, edited in place on every change
+LIVE_CHECKLIST = getattr(config, "LIVE_CHECKLIST", True)
+checklist_messages = StateNamespace("checklist_messages", ttl=CONVERSATION_STATE_TTL)
 
-def new_checklist(bot: TeleBot, call):
+async def new_checklist(bot: AsyncTeleBot, call):
+    """Replace the user's checklist with the default items and return the new checklist."""
     chat_id = call.message.chat.id
-    collection = get_checklists_collection()
-    collection.delete_one({"chat_id": chat_id})
-    # Create a new checklist with default items
-    default_items = [
-        {"name": translate(chat_id, "passport"), "status": "❌"},
-        {"name": translate(chat_id, "tickets"), "status": "❌"},
-        {"name": translate(chat_id, "boarding_pass"), "status": "❌"},
-        {"name": translate(chat_id, "hotel_reservation"), "status": "❌"},
-        {"name": translate(chat_id, "travel_insurance"), "status": "❌"}
-    ]
-    new_checklist = {"chat_id": chat_id, "items": default_items}
-    collection.insert_one(new_checklist)
+    checklist = await run_db(reset_checklist, chat_id)
     bot.send_message(chat_id, translate(chat_id, 'confirm_new_checklist'))
-    bot.answer_callback_query(call.id)  # Use call.id here
+    await bot.answer_callback_query(call.id)  # Use call.id here
+    return checklist
 
 
-def checklist_response_call(bot: TeleBot , chat_id):
+async def checklist_response_call(bot: AsyncTeleBot , chat_id):
     markup = InlineKeyboardMarkup(row_width=1)  # Set row width to 1 for vertical layout
     show_checklist_btn = InlineKeyboardButton(translate(chat_id, 'show_checklist'), callback_data="show_checklist")
     new_checklist_btn = InlineKeyboardButton(translate(chat_id, 'start_checklist'), callback_data="start_new_checklist")
@@ -38,9 +39,7 @@ def checklist_response_call(bot: TeleBot , chat_id):
     markup.add(show_checklist_btn, new_checklist_btn, no_thanks_btn)
     bot.send_message(chat_id, translate(chat_id, 'assist_you'), reply_markup=markup)
 
-def show_checklist(bot: TeleBot, chat_id):
-    """Display the user's checklist."""
-    checklist = get_or_create_checklist(chat_id)
+def _checklist_text(chat_id, checklist, notice=None):
     items = ""
     for item in checklist["items"]:
         if isinstance(item, dict) and "name" in item and "status" in item:
@@ -48,19 +47,50 @@ def show_checklist(bot: TeleBot, chat_id):
             items += f"- {icon} {item['name']}\n"
         else:
             logger.error(f"Invalid item format in checklist: {item}")
-    bot.send_message(chat_id, f"{translate(chat_id, 'checklist')}\n{items}")
+    text = (f"{translate(chat_id, 'checklist')}\n{items}\n{translate(chat_id, 'tap_to_toggle')}\n"
+            f"{translate(chat_id, 'modify_checklist_prompt')}")
+    return f"{notice}\n\n{text}" if notice else text
 
-def ask_to_modify_checklist(bot: TeleBot, chat_id):
-    """Prompt the user with options to modify the checklist."""
+def _modify_checklist_markup(chat_id, checklist):
     markup = InlineKeyboardMarkup()
+    # One toggle button per item, the callback carries the item index and a key of its name (64 bytes at most)
+    for index, item in enumerate(checklist["items"]):
+        if isinstance(item, dict) and "name" in item and "status" in item:
+            markup.row(InlineKeyboardButton(f"{item['status']} {item['name']}",
+                                            callback_data=f"toggle:{index}:{item_key(item['name'])}"))
     add_btn = InlineKeyboardButton(f"➕ {translate(chat_id, 'add')}", callback_data="add_item")
     delete_btn = InlineKeyboardButton(f"🗑 {translate(chat_id, 'delete')}", callback_data="delete_item")
-    update_status_btn = InlineKeyboardButton(f"🔄 {translate(chat_id, 'update')}", callback_data="update_status")
     keep_btn = InlineKeyboardButton(f"👌 {translate(chat_id, 'keep_as_is')}", callback_data="keep_as_is")
-    markup.add(add_btn, delete_btn, update_status_btn, keep_btn)
-    bot.send_message(chat_id, translate(chat_id, 'modify_checklist_prompt'), reply_markup=markup)
-
-def handle_modify_checklist_response_callback(bot: TeleBot, call):
+    markup.row(add_btn, delete_btn, keep_btn)
+    return markup
+
+async def show_checklist(bot: AsyncTeleBot, chat_id, checklist=None, notice=None, new_message=False):
+    """
+    Display the user's checklist with the buttons to modify it.
+    In live checklist mode the chat's checklist message is edited in place, one API call instead of new messages.
+    A checklist returned by a mutation can be passed to skip the lookup.
+    :param notice: Line shown above the checklist, e.g. the confirmation of the last change.
+    :param new_message: Send a new checklist message, which becomes the live one.
+    """
+    if checklist is None:
+        checklist = await run_db(get_or_create_checklist, chat_id)
+    text = _checklist_text(chat_id, checklist, notice)
+    markup = _modify_checklist_markup(chat_id, checklist)
+
+    message_id = checklist_messages.get(chat_id) if LIVE_CHECKLIST and not new_message else None
+    if message_id is not None:
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=markup)
+            return
+        except ApiTelegramException as e:
+            if "message is not modified" in str(e):
+                return
+            # Deleted by the user or too old to edit, the new message becomes the live one
+            logger.info(f"Could not edit live checklist of chat #{chat_id}: {e}")
+    message = await bot.send_message(chat_id, text, reply_markup=markup)
+    checklist_messages[chat_id] = message.message_id
+
+async def handle_modify_checklist_response_callback(bot: AsyncTeleBot, call):
     """Handle user's response to modify the checklist."""
     chat_id = call.message.chat.id
     response = call.data
@@ -72,41 +102,37 @@ def handle_modify_checklist_response_callback(bot: TeleBot, call):
         bot.send_message(chat_id, translate(chat_id, 'send_item_delete'))
         user_states[chat_id] = "waiting_for_item_delete"
     elif response == "update_status":
-        show_items_for_status_update(bot, chat_id)
+        await show_items_for_status_update(bot, chat_id)
         user_states[chat_id] = "waiting_for_status_update"
     else:
         bot.send_message(chat_id, translate(chat_id, 'checklist_unchanged'))
-    bot.answer_callback_query(call.id)
+    await bot.answer_callback_query(call.id)
 
-def handle_item_addition(bot: TeleBot, message):
+async def handle_item_addition(bot: AsyncTeleBot, message):
     """Handle the addition of a new item to the checklist."""
     chat_id = message.chat.id
     item = message.text.strip()
     if item:
-        add_item_to_checklist(chat_id, item)
-        bot.send_message(chat_id, f"{translate(chat_id, 'item_added')} '{item}'")
-        show_checklist(bot, chat_id)
-        ask_to_modify_checklist(bot, chat_id)
+        checklist = await run_db(add_item_to_checklist, chat_id, item)
+        await show_checklist(bot, chat_id, checklist, notice=f"{translate(chat_id, 'item_added')} '{item}'")
     else:
         bot.send_message(chat_id, translate(chat_id, 'specify_item_add'))
     user_states[chat_id] = None  # Reset the state
 
-def handle_item_deletion(bot: TeleBot, message):
+async def handle_item_deletion(bot: AsyncTeleBot, message):
     """Handle the deletion of an item from the checklist."""
     chat_id = message.chat.id
     item = message.text.strip()
     if item:
-        delete_item_from_checklist(chat_id, item)
-        bot.send_message(chat_id, f"{translate(chat_id, 'item_removed')} '{item}'")
-        show_checklist(bot, chat_id)
-        ask_to_modify_checklist(bot, chat_id)
+        checklist = await run_db(delete_item_from_checklist, chat_id, item)
+        await show_checklist(bot, chat_id, checklist, notice=f"{translate(chat_id, 'item_removed')} '{item}'")
     else:
         bot.send_message(chat_id, translate(chat_id, 'specify_item_delete'))
     user_states[chat_id] = None  # Reset the state
 
-def show_items_for_status_update(bot: TeleBot, chat_id):
+async def show_items_for_status_update(bot: AsyncTeleBot, chat_id):
     """Show items to the user for status update selection."""
-    checklist = get_or_create_checklist(chat_id)
+    checklist = await run_db(get_or_create_checklist, chat_id)
     markup = ReplyKeyboardMarkup(one_time_keyboard=True)
     for item in checklist["items"]:
         if isinstance(item, dict) and "name" in item and "status" in item:
@@ -114,23 +140,42 @@ def show_items_for_status_update(bot: TeleBot, chat_id):
             markup.add(KeyboardButton(button_text))
     bot.send_message(chat_id, translate(chat_id, 'select_item_update'), reply_markup=markup)
 
-def handle_status_change_callback(bot: TeleBot, call):
+async def handle_status_change_callback(bot: AsyncTeleBot, call):
     """Handle the status change of an item."""
     chat_id = call.message.chat.id
     item_name = user_states[chat_id]["item_name"]
+    checklist = None
+    notice = None
 
     if call.data == 'done':
-        update_item_status(chat_id, item_name, "✅")  # Store the emoji directly
-        bot.send_message(chat_id, f"{translate(chat_id, 'item_marked_done')} '{item_name}'")
+        checklist = await run_db(update_item_status, chat_id, item_name, "✅")  # Store the emoji directly
+        notice = f"{translate(chat_id, 'item_marked_done')} '{item_name}'"
     elif call.data == 'not_done':
-        update_item_status(chat_id, item_name, "❌")  # Store the emoji directly
-        bot.send_message(chat_id, f"{translate(chat_id, 'item_marked_not_done')} '{item_name}'")
+        checklist = await run_db(update_item_status, chat_id, item_name, "❌")  # Store the emoji directly
+        notice = f"{translate(chat_id, 'item_marked_not_done')} '{item_name}'"
 
-    show_checklist(bot, chat_id)
-    ask_to_modify_checklist(bot, chat_id)
+    await show_checklist(bot, chat_id, checklist, notice=notice)
     user_states[chat_id] = None  # Reset the state
 
-def handle_status_update_selection(bot: TeleBot, message):
+async def handle_item_toggle_callback(bot: AsyncTeleBot, call):
+    """Flip the status of the tapped checklist item and update the checklist message it was tapped in."""
+    chat_id = call.message.chat.id
+    _, index, key = call.data.split(":")
+    index = int(index)
+    checklist = await run_db(toggle_item_status, chat_id, index, key)
+    notice = None
+    if checklist is None:
+        # The list changed since the message was rendered, show the current one
+        await bot.answer_callback_query(call.id, translate(chat_id, 'checklist_changed'))
+    else:
+        await bot.answer_callback_query(call.id)
+        item = checklist["items"][index]
+        done = item["status"] == "✅"
+        notice = f"{translate(chat_id, 'item_marked_done' if done else 'item_marked_not_done')} '{item['name']}'"
+    checklist_messages[chat_id] = call.message.message_id
+    await show_checklist(bot, chat_id, checklist, notice=notice)
+
+async def handle_status_update_selection(bot: AsyncTeleBot, message):
     """Handle the user's selection for updating item status."""
     chat_id = message.chat.id
     item_text = message.text.strip()
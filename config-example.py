@@ -4,4 +4,89 @@
 TELEGRAM_TOKEN = 'Telegram token'
 MONGODB_URI = 'MongoDB URI'
 GEMINI_API_KEY = 'Gemini API key'
-GOOGLE_FLIGHTS_API = 'Google flight Api'
\ No newline at end of file
+GOOGLE_FLIGHTS_API = 'Google flight Api'
+
+# Optional MongoDB connection pool settings (defaults are used when omitted)
+MONGODB_MAX_POOL_SIZE = 50
+MONGODB_MIN_POOL_SIZE = 0
+MONGODB_CONNECT_TIMEOUT_MS = 5000
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = 5000
+MONGODB_SOCKET_TIMEOUT_MS = 10000
+MONGODB_MAX_IDLE_TIME_MS = 300000
+
+# Optional in-memory checklist cache settings
+CHECKLIST_CACHE_SIZE = 10000
+CHECKLIST_CACHE_TTL = 600  # seconds
+CHECKLIST_CACHE_ENABLED = True  # defaults to False with STATE_BACKEND = "mongo", other processes' changes are not seen
+
+# Optional airport lookup cache settings
+AIRPORT_CACHE_SIZE = 5000
+AIRPORT_CACHE_TTL = 30 * 24 * 3600  # seconds
+AIRPORT_NEGATIVE_CACHE_TTL = 600  # seconds, for places without airports
+AIRPORT_LOOKUP_WORKERS = 8
+AIRPORT_LOOKUP_TIMEOUT = 20  # seconds
+
+# Optional Google Flights result cache settings
+FLIGHTS_CACHE_SIZE = 1000
+FLIGHTS_CACHE_TTL = 600  # seconds
+FLIGHTS_PAGE_SIZE = 5  # flight buttons per results page
+FLIGHT_SEARCHES_PER_REQUEST = 8  # parallel searches of one flexible-date ("01.08.2024 ±3") or multi-airport search
+FLIGHT_SEARCH_CONCURRENCY = 4  # flexible-date and multi-airport searches running at once without queueing
+FLIGHT_SEARCH_WORKERS = 32  # defaults to FLIGHT_SEARCHES_PER_REQUEST * FLIGHT_SEARCH_CONCURRENCY
+FLEX_SEARCH_TIMEOUT = 30  # seconds per search, once it runs
+MAX_FLEX_DAYS = 3
+FLEX_MAX_SEARCHES = 8  # searches of one flexible-date search, at most FLIGHT_SEARCHES_PER_REQUEST
+MULTI_AIRPORT_MAX_PAIRS = 8  # above it the airports of one side are searched together
+MULTI_AIRPORT_TIMEOUT = 30  # seconds per search, once it runs
+RETURN_PREFETCH_COUNT = 3  # cheapest outbound flights whose return flights are searched in the background, 0 disables
+RETURN_PREFETCH_WORKERS = 4
+
+# Optional sizes of the thread pools running blocking MongoDB and external API calls
+DB_WORKERS = 16
+API_WORKERS = 32
+
+# Optional limits for long-running jobs (recommendations, flight searches)
+LONG_JOB_WORKERS = 8
+LONG_JOB_MAX_QUEUED = 100
+
+# Optional recommendation cache settings
+RECOMMENDATION_CACHE_SIZE = 1000
+RECOMMENDATION_CACHE_TTL = 7 * 24 * 3600  # seconds
+
+# Chat IDs allowed to use admin commands such as /warm_recommendations
+ADMIN_CHAT_IDS = []
+RECOMMENDATION_EDIT_INTERVAL = 1.5  # seconds between edits of a streamed recommendation
+
+# Edit one checklist message per chat in place instead of sending new checklist messages on every change
+LIVE_CHECKLIST = True
+
+# Optional conversation state settings. STATE_BACKEND is "memory", "file" (STATE_FILE_PATH) or "mongo"
+# ("mongo" lets several bot processes share the state)
+STATE_BACKEND = "memory"
+STATE_FILE_PATH = "state.db"
+CONVERSATION_STATE_TTL = 24 * 3600  # seconds
+STATE_MAX_ENTRIES = 50000  # memory backend only, least recently used expiring keys are evicted above it
+STATE_SWEEP_INTERVAL = 60  # seconds between sweeps of expired keys in the memory backend
+STATE_LOCAL_TTL = 60  # mongo backend only, seconds a key is served from the process before it is read again
+STATE_LOCAL_CACHE_SIZE = 50000  # mongo backend only
+STATE_IO_THREADS = 8  # mongo backend only, threads loading and saving state in the background
+FLIGHT_RESULTS_TTL = 6 * 3600  # seconds
+AIRPORT_NAMES_TTL = 30 * 24 * 3600  # seconds
+
+# Optional webhook mode: BOT_MODE = "webhook" serves updates over HTTP instead of long polling
+BOT_MODE = "polling"
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_URL = None  # public HTTPS base URL registered with Telegram on startup, e.g. "https://bot.example.com"
+WEBHOOK_SECRET = None  # secret token Telegram sends with every update
+UPDATE_WORKERS = 32  # lanes handling updates in parallel, each chat always uses the same lane (polling and webhook)
+UPDATE_MAX_QUEUED = 1000
+TELEGRAM_API_URL = None  # e.g. "http://127.0.0.1:8081" for the fake Bot API of fake_telegram.py
+
+# Optional outbound message limits (Telegram allows about 30 messages per second, about 1 per second per chat)
+OUTBOX_GLOBAL_RATE = 30
+OUTBOX_CHAT_RATE = 1
+OUTBOX_CHAT_BURST = 3
+OUTBOX_MAX_RETRIES = 3  # retries after a 429 answer
+OUTBOX_COALESCE = True  # merge consecutive queued plain text messages to one chat that nobody awaits
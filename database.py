@@ -1,18 +1,94 @@
-from config import MONGODB_URI
+# database.py
+
+import io
+import logging
+import pickle
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import certifi
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-import certifi
-
 
+import config
+from cache import TTLCache
+from state import STATE_BACKEND, encode_state_value
 from utils import translate
 
+logger = logging.getLogger(__name__)
+
+# Connection pool settings, overridable from config.py
+MONGODB_MAX_POOL_SIZE = getattr(config, "MONGODB_MAX_POOL_SIZE", 50)
+MONGODB_MIN_POOL_SIZE = getattr(config, "MONGODB_MIN_POOL_SIZE", 0)
+MONGODB_CONNECT_TIMEOUT_MS = getattr(config, "MONGODB_CONNECT_TIMEOUT_MS", 5000)
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = getattr(config, "MONGODB_SERVER_SELECTION_TIMEOUT_MS", 5000)
+MONGODB_SOCKET_TIMEOUT_MS = getattr(config, "MONGODB_SOCKET_TIMEOUT_MS", 10000)
+MONGODB_MAX_IDLE_TIME_MS = getattr(config, "MONGODB_MAX_IDLE_TIME_MS", 300000)
+
+# Write-through cache of checklist documents by chat_id, kept in sync by every mutation below
+CHECKLIST_CACHE_SIZE = getattr(config, "CHECKLIST_CACHE_SIZE", 10000)
+CHECKLIST_CACHE_TTL = getattr(config, "CHECKLIST_CACHE_TTL", 600)
+checklist_cache = TTLCache(max_size=CHECKLIST_CACHE_SIZE, ttl=CHECKLIST_CACHE_TTL, name="checklists")
+# The cache only sees this process's changes. With the shared "mongo" state backend several processes serve the same
+# chats, so it is off by default and every read goes to the database.
+CHECKLIST_CACHE_ENABLED = getattr(config, "CHECKLIST_CACHE_ENABLED", STATE_BACKEND != "mongo")
+
+_client = None
+_client_lock = threading.Lock()
+
+
 def connect() -> MongoClient:
     """
-    This function is connecting to the database, using login and password from bot_secrets file.
+    Returns the process-wide MongoClient, creating it on first use with the URI from config file.
+    The client owns a connection pool and is safe to share between threads, so every caller reuses it.
     :return: MongoClient
     """
-    client = MongoClient(MONGODB_URI, server_api=ServerApi('1'), tls=True, tlsCAFile=certifi.where() )
-    return client
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    config.MONGODB_URI,
+                    server_api=ServerApi('1'),
+                    tls=True,
+                    tlsCAFile=certifi.where(),
+                    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                    minPoolSize=MONGODB_MIN_POOL_SIZE,
+                    connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                    socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+                    maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+                )
+                logger.info("Created MongoDB client (max pool size: %s)", MONGODB_MAX_POOL_SIZE)
+    return _client
+
+
+def close_connection():
+    """
+    Closes the shared MongoClient and its pooled sockets. The next connect() call creates a fresh client.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+            logger.info("Closed MongoDB client")
+
+
+def ping() -> bool:
+    """
+    Checks that MongoDB answers, used by readiness checks.
+    :return: True if the server answered the ping.
+    """
+    try:
+        connect().admin.command("ping")
+        return True
+    except Exception as e:
+        logger.warning("MongoDB ping failed: %s", e)
+        return False
 
 # def test_connection():
 #     try:
@@ -39,52 +115,428 @@ def get_checklists_collection():
     db = client["travel_bot"]
     return db["checklists"]
 
-def get_or_create_checklist(chat_id):
+def get_airport_codes_collection():
+    """
+    Get the collection caching airport code lookups from MongoDB.
+    :return: Collection
+    """
+    client = connect()
+    db = client["travel_bot"]
+    return db["airport_codes"]
+
+def get_recommendations_collection():
+    """
+    Get the collection caching destination recommendations from MongoDB.
+    :return: Collection
+    """
+    client = connect()
+    db = client["travel_bot"]
+    return db["recommendations"]
+
+def get_state_collection():
+    """
+    Get the collection holding conversation state shared by all bot processes from MongoDB.
+    :return: Collection
+    """
+    client = connect()
+    db = client["travel_bot"]
+    return db["state"]
+
+def ensure_indexes() -> bool:
+    """
+    Creates the indexes the bot relies on. Safe to call on every startup, MongoDB skips existing indexes.
+    The unique index on chat_id keeps checklist lookups and upserts fast and prevents duplicate checklists.
+    Each index is created on its own, an index that cannot be created does not keep the others from being created.
+    :return: True if all indexes exist.
+    """
+    indexes = [
+        (get_checklists_collection, "chat_id", {"unique": True, "name": "chat_id_unique"}),
+        (get_airport_codes_collection, "key", {"unique": True, "name": "key_unique"}),
+        # MongoDB removes cached lookups once expires_at has passed
+        (get_airport_codes_collection, "expires_at", {"expireAfterSeconds": 0, "name": "expires_at_ttl"}),
+        # Recommendations keep their request counter after expiring, so they are refreshed instead of removed
+        (get_recommendations_collection, [("key", 1), ("lang", 1)], {"unique": True, "name": "key_lang_unique"}),
+        (get_recommendations_collection, [("requests", -1)], {"name": "requests_desc"}),
+        (get_state_collection, [("namespace", 1), ("key", 1)], {"unique": True, "name": "namespace_key_unique"}),
+        (get_state_collection, "expires_at", {"expireAfterSeconds": 0, "name": "expires_at_ttl"}),
+    ]
+    ok = True
+    for get_collection, keys, options in indexes:
+        collection = get_collection()
+        try:
+            collection.create_index(keys, **options)
+        except DuplicateKeyError as e:
+            ok = False
+            logger.error(f"Could not create index {options['name']} on {collection.name}, the collection has "
+                         f"duplicates. Run 'python database.py migrate' to remove them: {e}")
+        except PyMongoError as e:
+            ok = False
+            logger.error(f"Could not create index {options['name']} on {collection.name}: {e}")
+    if ok:
+        logger.info("Ensured database indexes")
+    return ok
+
+def get_cached_airport_codes(key):
+    """
+    Reads a cached airport lookup.
+    :param key: Normalized place name.
+    :return: The cached codes (possibly "NO_RESULT"), or None if nothing valid is cached.
+    """
+    collection = get_airport_codes_collection()
+    entry = collection.find_one({"key": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+    return entry["codes"] if entry else None
+
+def save_airport_codes(key, codes, ttl):
+    """
+    Caches an airport lookup.
+    :param key: Normalized place name.
+    :param codes: Comma-separated IATA codes or "NO_RESULT".
+    :param ttl: Time to live in seconds.
+    """
+    collection = get_airport_codes_collection()
+    collection.update_one(
+        {"key": key},
+        {"$set": {"codes": codes, "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl)}},
+        upsert=True
+    )
+
+def _is_fresh(entry):
+    expires_at = entry.get("expires_at") if entry else None
+    if expires_at is None:
+        return False
+    if expires_at.tzinfo is None:
+        # PyMongo returns naive datetimes in UTC
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at > datetime.now(timezone.utc)
+
+def get_cached_recommendation(key, lang):
+    """
+    Counts a recommendation request and reads the cached recommendation in the same round-trip.
+    Only destinations with a saved recommendation are counted, unknown ones create no document.
+    :param key: Normalized destination name.
+    :param lang: Language of the recommendation.
+    :return: The cached HTML, or None if nothing fresh is cached.
+    """
+    collection = get_recommendations_collection()
+    entry = collection.find_one_and_update(
+        {"key": key, "lang": lang},
+        {"$inc": {"requests": 1}},
+        projection={"html": 1, "expires_at": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    return entry.get("html") if _is_fresh(entry) else None
+
+def record_recommendation_request(key, lang, count=1):
+    """
+    Counts recommendation requests served from memory.
+    :param key: Normalized destination name.
+    :param lang: Language of the recommendation.
+    :param count: Number of requests.
+    """
+    collection = get_recommendations_collection()
+    collection.update_one({"key": key, "lang": lang}, {"$inc": {"requests": count}})
+
+def save_recommendation(key, lang, destination, html, ttl):
+    """
+    Caches a generated recommendation. The first recommendation of a destination counts the request that generated
+    it, get_cached_recommendation() only counts destinations that are saved already.
+    :param key: Normalized destination name.
+    :param lang: Language of the recommendation.
+    :param destination: Destination as typed by the user, kept for cache warming.
+    :param html: The recommendation text.
+    :param ttl: Time to live in seconds.
+    """
+    collection = get_recommendations_collection()
+    collection.update_one(
+        {"key": key, "lang": lang},
+        {"$set": {"html": html, "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl)},
+         "$setOnInsert": {"destination": destination, "requests": 1}},
+        upsert=True
+    )
+
+def get_top_destinations(limit):
+    """
+    Returns the most requested destinations.
+    :param limit: Number of destinations to return.
+    :return: List of dicts with key, lang, destination and whether the cached recommendation is fresh.
+    """
+    collection = get_recommendations_collection()
+    entries = collection.find({}, {"key": 1, "lang": 1, "destination": 1, "expires_at": 1}).sort("requests", -1).limit(limit)
+    return [{"key": entry["key"], "lang": entry["lang"], "destination": entry.get("destination", entry["key"]),
+             "fresh": _is_fresh(entry)} for entry in entries]
+
+def _normalize_items(items):
+    """
+    Converts legacy string items to the {"name", "status"} format in memory, without writing them back.
+    :param items: The items list as stored in the database.
+    :return: List of item dicts.
+    """
+    return [{"name": item, "status": "❌"} if isinstance(item, str) else item for item in items]
+
+def _cache_checklist(chat_id, checklist):
+    """
+    Normalizes the checklist returned by a database call and stores it in the checklist cache.
+    :param chat_id: The chat ID of the checklist owner.
+    :param checklist: The checklist document, or None if it does not exist.
+    :return: The normalized checklist or None.
+    """
+    if checklist is None:
+        checklist_cache.delete(chat_id)
+        return None
+    checklist["items"] = _normalize_items(checklist.get("items", []))
+    if CHECKLIST_CACHE_ENABLED:
+        checklist_cache.set(chat_id, checklist)
+    return checklist
+
+def get_checklist(chat_id):
+    """
+    Read-only fetch of the checklist for a specific chat_id, served from the checklist cache when possible.
+    :param chat_id: The chat ID of the checklist owner.
+    :return: The checklist document, or None if the chat has no checklist yet.
+    """
+    checklist = checklist_cache.get(chat_id) if CHECKLIST_CACHE_ENABLED else None
+    if checklist is not None:
+        return checklist
     collection = get_checklists_collection()
-    checklist = collection.find_one({"chat_id": chat_id})
+    return _cache_checklist(chat_id, collection.find_one({"chat_id": chat_id}))
+
+def default_checklist_items(chat_id):
+    """
+    Builds the default checklist items in the user's language.
+    :param chat_id: The chat ID of the checklist owner.
+    :return: List of item dicts.
+    """
+    return [
+        {"name": translate(chat_id, "passport"), "status": "❌"},
+        {"name": translate(chat_id, "tickets"), "status": "❌"},
+        {"name": translate(chat_id, "boarding_pass"), "status": "❌"},
+        {"name": translate(chat_id, "hotel_reservation"), "status": "❌"},
+        {"name": translate(chat_id, "travel_insurance"), "status": "❌"}
+    ]
+
+def get_or_create_checklist(chat_id):
+    checklist = get_checklist(chat_id)
     if not checklist:
-        # Default checklist items
-        default_items = [
-            {"name": translate(chat_id, "passport"), "status": "❌"},
-            {"name": translate(chat_id, "tickets"), "status": "❌"},
-            {"name": translate(chat_id, "boarding_pass"), "status": "❌"},
-            {"name": translate(chat_id, "hotel_reservation"), "status": "❌"},
-            {"name": translate(chat_id, "travel_insurance"), "status": "❌"}
-        ]
-        checklist = {"chat_id": chat_id, "items": default_items}
-        collection.insert_one(checklist)
-    else:
-        # Ensure all items are in the correct format
-        for i, item in enumerate(checklist["items"]):
-            if isinstance(item, str):
-                checklist["items"][i] = {"name": item, "status": "❌"}
-        collection.update_one({"chat_id": chat_id}, {"$set": {"items": checklist["items"]}})
+        collection = get_checklists_collection()
+        # Upsert so a concurrent creation for the same chat never produces a second document
+        checklist = collection.find_one_and_update(
+            {"chat_id": chat_id},
+            {"$setOnInsert": {"items": default_checklist_items(chat_id)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        checklist = _cache_checklist(chat_id, checklist)
     return checklist
 
+def reset_checklist(chat_id):
+    """
+    Atomically replaces the checklist of a specific chat_id with the default items, creating it if needed.
+    :param chat_id: The chat ID of the checklist owner.
+    :return: The new checklist.
+    """
+    collection = get_checklists_collection()
+    checklist = collection.find_one_and_replace(
+        {"chat_id": chat_id},
+        {"chat_id": chat_id, "items": default_checklist_items(chat_id)},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return _cache_checklist(chat_id, checklist)
+
+def migrate_legacy_items(batch_size=500) -> int:
+    """
+    One-off migration converting legacy string items to the {"name", "status"} format across all checklists.
+    :param batch_size: Number of updates sent per bulk write.
+    :return: Number of migrated checklists.
+    """
+    collection = get_checklists_collection()
+    migrated = 0
+    requests = []
+    for checklist in collection.find({"items": {"$type": "string"}}, {"items": 1}):
+        # Match on the old items too, so an item added meanwhile is not overwritten
+        requests.append(UpdateOne(
+            {"_id": checklist["_id"], "items": checklist["items"]},
+            {"$set": {"items": _normalize_items(checklist["items"])}}
+        ))
+        if len(requests) >= batch_size:
+            migrated += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        migrated += collection.bulk_write(requests, ordered=False).modified_count
+    logger.info("Migrated legacy items in %s checklists", migrated)
+    return migrated
+
+class _PlainUnpickler(pickle.Unpickler):
+    # Plain values need no classes, refusing them keeps loading from running code
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"{module}.{name} is not loaded")
+
+def migrate_pickled_state(batch_size=500) -> int:
+    """
+    One-off migration of state documents pickled by older versions to the format of encode_state_value().
+    Plain values, e.g. languages and conversation steps, are converted. Values holding objects, e.g. flight results,
+    are removed, the chat searches again.
+    :param batch_size: Number of updates sent per bulk write.
+    :return: Number of converted documents.
+    """
+    collection = get_state_collection()
+    converted = removed = 0
+    requests = []
+    for entry in collection.find({"value": {"$type": "binData"}}, {"value": 1}):
+        try:
+            value = encode_state_value(_PlainUnpickler(io.BytesIO(entry["value"])).load())
+        except (pickle.UnpicklingError, TypeError, ValueError, EOFError) as e:
+            logger.info(f"Removing state {entry['_id']} that cannot be converted: {e}")
+            removed += collection.delete_one({"_id": entry["_id"]}).deleted_count
+            continue
+        requests.append(UpdateOne({"_id": entry["_id"], "value": entry["value"]}, {"$set": {"value": value}}))
+        if len(requests) >= batch_size:
+            converted += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        converted += collection.bulk_write(requests, ordered=False).modified_count
+    logger.info("Converted %s pickled state documents, removed %s", converted, removed)
+    return converted
+
+def remove_duplicate_checklists() -> int:
+    """
+    One-off cleanup of chats with several checklist documents, left by racing inserts before the unique chat_id
+    index existed. The oldest document of each chat is kept, it is the one reads and updates used to find first.
+    :return: Number of removed documents.
+    """
+    collection = get_checklists_collection()
+    removed = 0
+    duplicates = collection.aggregate([
+        {"$group": {"_id": "$chat_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    for duplicate in duplicates:
+        # ObjectIds start with their creation time
+        kept, *stale = sorted(duplicate["ids"])
+        removed += collection.delete_many({"_id": {"$in": stale}}).deleted_count
+        checklist_cache.delete(duplicate["_id"])
+        logger.info(f"Removed duplicate checklists {', '.join(map(str, stale))} of chat_id: {duplicate['_id']}, "
+                    f"kept {kept}")
+    logger.info("Removed %s duplicate checklists", removed)
+    return removed
+
+def remove_counter_only_recommendations() -> int:
+    """
+    One-off cleanup of recommendation documents holding only a request counter, left by requests for destinations
+    that never got a recommendation, e.g. typos.
+    :return: Number of removed documents.
+    """
+    removed = get_recommendations_collection().delete_many({"html": {"$exists": False}}).deleted_count
+    logger.info("Removed %s recommendation counters without a recommendation", removed)
+    return removed
+
 def add_item_to_checklist(chat_id, item_name):
+    """
+    Add an item to the checklist for a specific chat_id and refresh the cached checklist.
+    :param chat_id: The chat ID for which the item is added.
+    :param item_name: The name of the new item.
+    :return: The updated checklist, or None if the chat has no checklist.
+    """
     collection = get_checklists_collection()
     # Add item in correct format
     new_item = {"name": item_name, "status": "❌"}
-    collection.update_one(
+    checklist = collection.find_one_and_update(
         {"chat_id": chat_id},
-        {"$addToSet": {"items": new_item}}
+        {"$addToSet": {"items": new_item}},
+        return_document=ReturnDocument.AFTER
     )
+    return _cache_checklist(chat_id, checklist)
 
 def delete_item_from_checklist(chat_id, item_name):
     """
-    Delete an item from the checklist for a specific chat_id.
+    Delete an item from the checklist for a specific chat_id and refresh the cached checklist.
     :param chat_id: The chat ID for which the item is deleted.
-    :param item: The item to be deleted from the checklist.
+    :param item_name: The name of the item to be deleted from the checklist.
+    :return: The updated checklist, or None if the chat has no checklist.
     """
     collection = get_checklists_collection()
-    collection.update_one(
+    checklist = collection.find_one_and_update(
         {"chat_id": chat_id},
-        {"$pull": {"items": {"name": item_name}}}
+        {"$pull": {"items": {"name": item_name}}},
+        return_document=ReturnDocument.AFTER
     )
+    return _cache_checklist(chat_id, checklist)
 
 def update_item_status(chat_id, item_name, status):
+    """
+    Set the status of a checklist item and refresh the cached checklist.
+    :param chat_id: The chat ID of the checklist owner.
+    :param item_name: The name of the item to update.
+    :param status: The new status, "✅" or "❌".
+    :return: The updated checklist, or None if the item was not found.
+    """
     collection = get_checklists_collection()
-    collection.update_one(
+    checklist = collection.find_one_and_update(
         {"chat_id": chat_id, "items.name": item_name},
-        {"$set": {"items.$.status": status}}
-    )
\ No newline at end of file
+        {"$set": {"items.$.status": status}},
+        return_document=ReturnDocument.AFTER
+    )
+    if checklist is None:
+        # Nothing matched, the cached copy may be stale so the next read goes to the database
+        checklist_cache.delete(chat_id)
+        return None
+    return _cache_checklist(chat_id, checklist)
+
+def item_key(item_name):
+    """
+    Short stable key of an item name, sent with the item index in button callbacks to detect a changed list.
+    :param item_name: The name of the item.
+    :return: 8 hex digits.
+    """
+    return f"{zlib.crc32(item_name.encode('utf-8')):08x}"
+
+def toggle_item_status(chat_id, index, key):
+    """
+    Flip the status of the item at index with a compare-and-set update and refresh the cached checklist.
+    The item is read from the checklist cache, so a toggle is usually a single database round-trip.
+    :param chat_id: The chat ID of the checklist owner.
+    :param index: Position of the item in the checklist.
+    :param key: item_key of the item name, the toggle fails if the item at index has another name.
+    :return: The updated checklist, or None if the item is no longer at index.
+    """
+    collection = get_checklists_collection()
+    checklist = get_checklist(chat_id)
+    for attempt in range(2):
+        items = checklist["items"] if checklist else []
+        if index < len(items) and item_key(items[index]["name"]) == key:
+            item = items[index]
+            updated = collection.find_one_and_update(
+                # Matches only if nobody changed the item since it was read
+                {"chat_id": chat_id, f"items.{index}.name": item["name"], f"items.{index}.status": item["status"]},
+                {"$set": {f"items.{index}.status": "❌" if item["status"] == "✅" else "✅"}},
+                return_document=ReturnDocument.AFTER
+            )
+            if updated is not None:
+                return _cache_checklist(chat_id, updated)
+        if attempt == 0:
+            # The cached copy may be stale, retry once with the stored checklist
+            checklist = _cache_checklist(chat_id, collection.find_one({"chat_id": chat_id}))
+    return None
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(format="[%(levelname)s %(lineno)d] %(message)s", level=logging.INFO)
+    arg_parser = argparse.ArgumentParser(description="Database maintenance commands.")
+    arg_parser.add_argument("command", choices=["migrate", "indexes"],
+                            help="migrate: remove duplicate checklists and recommendation counters without a "
+                                 "recommendation, convert legacy string checklist items and pickled state and "
+                                 "create indexes; indexes: create indexes")
+    args = arg_parser.parse_args()
+    try:
+        if args.command == "migrate":
+            # Duplicates first, the unique chat_id index cannot be created while they exist
+            remove_duplicate_checklists()
+            remove_counter_only_recommendations()
+            migrate_legacy_items()
+            migrate_pickled_state()
+            ensure_indexes()
+        elif args.command == "indexes":
+            ensure_indexes()
+    finally:
+        close_connection()
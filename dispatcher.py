@@ -0,0 +1,166 @@
+# dispatcher.py
+
+import asyncio
+import logging
+
+import config
+from state import preload_state
+
+logger = logging.getLogger(__name__)
+
+# Updates are handled on a fixed number of per-chat ordered lanes behind a bounded queue
+UPDATE_WORKERS = getattr(config, "UPDATE_WORKERS", 32)
+UPDATE_MAX_QUEUED = getattr(config, "UPDATE_MAX_QUEUED", 1000)
+
+
+def update_chat_id(update):
+    """
+    Returns the chat an update belongs to.
+    :param update: telebot Update.
+    :return: The chat ID, the user ID for updates without a chat, or None.
+    """
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message is not None:
+            return message.chat.id
+    if update.callback_query is not None:
+        if update.callback_query.message is not None:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    for query in (update.inline_query, update.chosen_inline_result, update.shipping_query,
+                  update.pre_checkout_query):
+        if query is not None:
+            return query.from_user.id
+    return None
+
+
+class UpdateDispatcher:
+    """
+    Feeds updates to the bot handlers on a fixed number of lanes, each an asyncio queue with one worker.
+    Updates are sharded by chat, so a chat always lands on the same lane and its updates are handled one at a time
+    and in order, while different chats run in parallel on different lanes.
+    Used for both long polling (install()) and webhooks (submit()).
+    """
+
+    def __init__(self, bot, workers=UPDATE_WORKERS, max_queued=UPDATE_MAX_QUEUED):
+        """
+        :param bot: The async Telegram bot instance.
+        :param workers: Number of lanes, i.e. updates handled at the same time.
+        :param max_queued: Number of updates allowed to be queued or running across all lanes.
+        """
+        self.bot = bot
+        self.workers = workers
+        self.max_queued = max_queued
+        # Bound before install() replaces it on the bot
+        self._process_new_updates = bot.process_new_updates
+        self._lanes = []
+        self._tasks = []
+        self._waiting = 0
+        self._space = None
+        self._put_lock = None
+        self.handled = 0
+        self.rejected = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Starts the lane workers, must be called from the running event loop."""
+        if self.running:
+            return
+        self._lanes = [asyncio.Queue() for _ in range(self.workers)]
+        self._space = asyncio.Condition()
+        self._put_lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._worker(lane)) for lane in self._lanes]
+        logger.info("Started update dispatcher with %s lanes", self.workers)
+
+    def install(self):
+        """
+        Routes the updates of the bot's long polling loop through the dispatcher instead of handling each
+        batch in its own task.
+        """
+        self.bot.process_new_updates = self.put_many
+
+    def _lane(self, update):
+        chat_id = update_chat_id(update)
+        return self._lanes[hash(chat_id) % self.workers]
+
+    def submit(self, update) -> bool:
+        """
+        Queues an update without waiting.
+        :param update: telebot Update.
+        :return: False if the queue is full and the update was dropped.
+        """
+        if not self.running:
+            self.start()
+        if self._waiting >= self.max_queued:
+            self.rejected += 1
+            return False
+        self._waiting += 1
+        self._lane(update).put_nowait(update)
+        return True
+
+    async def put_many(self, updates):
+        """
+        Queues updates in order, waiting for free queue slots instead of dropping updates.
+        :param updates: List of telebot Updates.
+        """
+        if not self.running:
+            self.start()
+        # Polling runs each batch in its own task, the FIFO lock keeps batches in the order they were fetched
+        async with self._put_lock:
+            for update in updates:
+                async with self._space:
+                    await self._space.wait_for(lambda: self._waiting < self.max_queued)
+                    self._waiting += 1
+                self._lane(update).put_nowait(update)
+
+    async def _worker(self, lane):
+        while True:
+            update = await lane.get()
+            try:
+                # Handlers read the chat's state synchronously, it is loaded here off the event loop
+                await preload_state(update_chat_id(update))
+                await self._process_new_updates([update])
+                self.handled += 1
+            except Exception as e:
+                self.failed += 1
+                logger.exception("Update %s failed in dispatcher: %s", update.update_id, e)
+            finally:
+                self._waiting -= 1
+                async with self._space:
+                    self._space.notify()
+                lane.task_done()
+
+    def stats(self) -> dict:
+        """
+        Returns the dispatcher counters.
+        :return: Dict with lane, queue and update counts.
+        """
+        return {
+            "workers": self.workers,
+            "waiting": self._waiting,
+            "max_queued": self.max_queued,
+            "busiest_lane": max((lane.qsize() for lane in self._lanes), default=0),
+            "handled": self.handled,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+    async def stop(self, timeout=10):
+        """
+        Waits up to timeout seconds for queued updates, then cancels the workers.
+        :param timeout: Seconds to wait for the queues to drain.
+        """
+        if self._lanes:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(lane.join() for lane in self._lanes)), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Dropped %s queued updates on shutdown", self._waiting)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._lanes = []
+        self._waiting = 0
@@ -0,0 +1,142 @@
+# fake_telegram.py
+
+"""
+Local stand-in for the Telegram Bot API and a load generator for the webhook server.
+
+    python fake_telegram.py server --port 8081          # fake Bot API, set TELEGRAM_API_URL = "http://127.0.0.1:8081"
+    python bot.py                                       # with BOT_MODE = "webhook"
+    python fake_telegram.py load --chats 200 --updates 10
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEBHOOK_URL = "http://127.0.0.1:8080/telegram/webhook"
+LOAD_TEXTS = ["/start", "/checklist", "/language", "/help"]
+
+
+def create_fake_telegram_app(latency=0.05) -> web.Application:
+    """
+    Creates a fake Bot API answering every method with a plausible result after a fixed latency.
+    :param latency: Seconds each call takes.
+    :return: aiohttp Application
+    """
+    message_ids = itertools.count(1)
+    calls = Counter()
+
+    async def handle_method(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await request.post()
+        calls[method] += 1
+        await asyncio.sleep(latency)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake bot", "username": "fake_bot"}
+        elif method in ("sendMessage", "editMessageText", "sendPhoto", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0))
+            result = {"message_id": next(message_ids), "date": int(time.time()), "text": params.get("text", ""),
+                      "chat": {"id": chat_id, "type": "private"}}
+        elif method == "getUpdates":
+            result = []
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_stats(request: web.Request) -> web.Response:
+        return web.json_response(dict(calls))
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle_method)
+    app.router.add_get("/stats", handle_stats)
+    return app
+
+
+def fake_update(update_id, chat_id, text):
+    """
+    Builds a private chat message update.
+    :param update_id: Update ID.
+    :param chat_id: Chat and user ID.
+    :param text: Message text, commands get a bot_command entity.
+    :return: Update as a dictionary.
+    """
+    message = {"message_id": update_id, "date": int(time.time()), "text": text,
+               "chat": {"id": chat_id, "type": "private"},
+               "from": {"id": chat_id, "is_bot": False, "first_name": "Load", "username": f"load{chat_id}"}}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+async def run_load(webhook_url=DEFAULT_WEBHOOK_URL, chats=100, updates=10, concurrency=50, secret=None) -> dict:
+    """
+    Posts updates to the webhook, each chat sends its updates one after another.
+    :param webhook_url: URL of the webhook endpoint.
+    :param chats: Number of simulated chats.
+    :param updates: Updates sent by each chat.
+    :param concurrency: Maximum number of requests in flight.
+    :param secret: Webhook secret token.
+    :return: Dict with request counts, throughput and latency percentiles.
+    """
+    update_ids = itertools.count(1)
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = Counter()
+    latencies = []
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+
+    async def run_chat(session, chat_id):
+        for _ in range(updates):
+            body = json.dumps(fake_update(next(update_ids), chat_id, random.choice(LOAD_TEXTS)))
+            async with semaphore:
+                t0 = time.perf_counter()
+                async with session.post(webhook_url, data=body, headers=headers) as resp:
+                    statuses[resp.status] += 1
+                latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(run_chat(session, 1000 + i) for i in range(chats)))
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "statuses": dict(statuses),
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0.0,
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 1) if latencies else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(format="[%(levelname)s %(lineno)d] %(message)s", level=logging.INFO)
+    arg_parser = argparse.ArgumentParser(description="Fake Telegram Bot API and webhook load generator.")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    server_parser = commands.add_parser("server", help="serve the fake Bot API")
+    server_parser.add_argument("--port", type=int, default=8081)
+    server_parser.add_argument("--latency", type=float, default=0.05, help="seconds per API call")
+    load_parser = commands.add_parser("load", help="post fake updates to the webhook")
+    load_parser.add_argument("--url", default=DEFAULT_WEBHOOK_URL)
+    load_parser.add_argument("--chats", type=int, default=100)
+    load_parser.add_argument("--updates", type=int, default=10, help="updates per chat")
+    load_parser.add_argument("--concurrency", type=int, default=50)
+    load_parser.add_argument("--secret", default=None)
+    args = arg_parser.parse_args()
+
+    if args.command == "server":
+        web.run_app(create_fake_telegram_app(args.latency), host="127.0.0.1", port=args.port)
+    else:
+        print(json.dumps(asyncio.run(run_load(args.url, args.chats, args.updates, args.concurrency, args.secret)),
+                         indent=2))
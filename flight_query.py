@@ -0,0 +1,134 @@
+# flight_query.py
+
+import secrets
+
+from state import register_state_type
+
+# Orders of the flight results, computed once per search
+SORT_KEYS = {
+    "price": lambda flight: (flight.price, flight.total_duration),
+    "duration": lambda flight: (flight.total_duration, flight.price),
+    "stops": lambda flight: (flight.stops, flight.price),
+    "departure": lambda flight: (flight.departure.departure_time, flight.price),
+    "airline": lambda flight: (flight.departure.airline, flight.price),
+}
+SORT_NAMES = tuple(SORT_KEYS)
+# Maximum number of stops, None for any
+STOP_FILTERS = (None, 0, 1)
+# Departure hour windows, [start, end)
+DEPARTURE_WINDOWS = (None, ("morning", 5, 12), ("afternoon", 12, 18), ("evening", 18, 24), ("night", 0, 5))
+# Callback data is limited to 64 bytes, each choice is one base-36 digit
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+MAX_AIRLINES = len(_DIGITS) - 1
+
+
+class FlightQuery:
+    """
+    Sort and filter choices over the results of one search. Each field is an option index, 0 is the default,
+    so a query fits in the callback data of a button as six base-36 digits.
+    """
+
+    __slots__ = ('sort', 'stops', 'price', 'hours', 'airline', 'duration')
+
+    def __init__(self, sort=0, stops=0, price=0, hours=0, airline=0, duration=0):
+        self.sort = sort
+        self.stops = stops
+        self.price = price
+        self.hours = hours
+        self.airline = airline
+        self.duration = duration
+
+    def encode(self) -> str:
+        return "".join(_DIGITS[getattr(self, field)] for field in self.__slots__)
+
+    @classmethod
+    def decode(cls, code):
+        """
+        :param code: Result of encode().
+        :return: FlightQuery
+        :raises ValueError: If the code is malformed.
+        """
+        if len(code) != len(cls.__slots__):
+            raise ValueError(f"Malformed flight query: {code!r}")
+        return cls(*(int(digit, 36) for digit in code))
+
+    def with_option(self, field, value):
+        """Returns a copy of the query with one field changed."""
+        query = FlightQuery(*(getattr(self, name) for name in self.__slots__))
+        setattr(query, field, value)
+        return query
+
+    @property
+    def filtered(self) -> bool:
+        return any(getattr(self, field) for field in self.__slots__[1:])
+
+
+def _ceilings(values):
+    # Quartiles of the values, the highest value itself would filter nothing
+    values = sorted(values)
+    ceilings = sorted({values[len(values) * quarter // 4] for quarter in (1, 2, 3)})
+    return tuple(ceiling for ceiling in ceilings if ceiling < values[-1])
+
+
+@register_state_type
+class FlightResults:
+    """
+    The flights of one search with everything needed to answer FlightQuery choices locally: one index order per
+    sort key, price and duration ceilings and the airlines, all computed once when the search returns.
+    """
+
+    __slots__ = ('search_id', 'flights', 'orders', 'price_ceilings', 'duration_ceilings', 'airlines')
+
+    def __init__(self, flights):
+        """
+        :param flights: Non-empty list of Flight objects.
+        """
+        # Callbacks carry the search ID, so buttons of an older results message do not query newer results
+        self.search_id = secrets.token_hex(3)
+        self.flights = flights
+        self.orders = {name: tuple(sorted(range(len(flights)), key=lambda i: sort_key(flights[i])))
+                       for name, sort_key in SORT_KEYS.items()}
+        self.price_ceilings = _ceilings(flight.price for flight in flights)
+        self.duration_ceilings = _ceilings(flight.total_duration for flight in flights)
+        self.airlines = tuple(sorted({flight.departure.airline for flight in flights}))[:MAX_AIRLINES]
+
+    def options(self, field) -> int:
+        """
+        :param field: A FlightQuery field.
+        :return: Number of options of the field, including the default.
+        """
+        return {
+            "sort": len(SORT_NAMES),
+            "stops": len(STOP_FILTERS),
+            "price": len(self.price_ceilings) + 1,
+            "hours": len(DEPARTURE_WINDOWS),
+            "airline": len(self.airlines) + 1,
+            "duration": len(self.duration_ceilings) + 1,
+        }[field]
+
+    def is_valid(self, query: FlightQuery) -> bool:
+        return all(getattr(query, field) < self.options(field) for field in FlightQuery.__slots__)
+
+    def query(self, query: FlightQuery):
+        """
+        Filters and sorts the flights.
+        :param query: Valid FlightQuery.
+        :return: List of flight indexes in the chosen order.
+        """
+        max_stops = STOP_FILTERS[query.stops]
+        max_price = self.price_ceilings[query.price - 1] if query.price else None
+        window = DEPARTURE_WINDOWS[query.hours]
+        airline = self.airlines[query.airline - 1] if query.airline else None
+        max_duration = self.duration_ceilings[query.duration - 1] if query.duration else None
+
+        def matches(flight):
+            return ((max_stops is None or flight.stops <= max_stops)
+                    and (max_price is None or flight.price <= max_price)
+                    and (window is None or window[1] <= flight.departure.departure_time.hour < window[2])
+                    and (airline is None or flight.departure.airline == airline)
+                    and (max_duration is None or flight.total_duration <= max_duration))
+
+        order = self.orders[SORT_NAMES[query.sort]]
+        if not query.filtered:
+            return list(order)
+        return [i for i in order if matches(self.flights[i])]
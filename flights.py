@@ -1,11 +1,175 @@
 # flights.py
 
+import time
+from datetime import date, datetime, timedelta
+from functools import partial
+
 from serpapi import GoogleSearch
 import config
 import logging
 
+from cache import TTLCache, SingleFlight
+from state import register_state_type
+from workers import FanOutPool
+
 logger = logging.getLogger(__name__)
 
+# Google Flights results are cached briefly, identical concurrent searches share one API call
+FLIGHTS_CACHE_SIZE = getattr(config, "FLIGHTS_CACHE_SIZE", 1000)
+FLIGHTS_CACHE_TTL = getattr(config, "FLIGHTS_CACHE_TTL", 600)
+flights_cache = TTLCache(max_size=FLIGHTS_CACHE_SIZE, ttl=FLIGHTS_CACHE_TTL, name="flights")
+_flights_singleflight = SingleFlight()
+_CACHE_KEY_PARAMS = ("engine", "type", "departure_id", "arrival_id", "outbound_date", "return_date",
+                     "departure_token", "booking_token", "hl", "gl", "currency")
+
+# Flexible-date and multi-airport searches run their searches in parallel on this pool. Each search runs at most
+# FLIGHT_SEARCHES_PER_REQUEST at a time, the pool fits FLIGHT_SEARCH_CONCURRENCY such searches without queueing
+FLIGHT_SEARCHES_PER_REQUEST = getattr(config, "FLIGHT_SEARCHES_PER_REQUEST", 8)
+FLIGHT_SEARCH_CONCURRENCY = getattr(config, "FLIGHT_SEARCH_CONCURRENCY", 4)
+FLIGHT_SEARCH_WORKERS = getattr(config, "FLIGHT_SEARCH_WORKERS", FLIGHT_SEARCHES_PER_REQUEST * FLIGHT_SEARCH_CONCURRENCY)
+flight_searches = FanOutPool("flight searches", FLIGHT_SEARCH_WORKERS, per_run=FLIGHT_SEARCHES_PER_REQUEST)
+FLEX_SEARCH_TIMEOUT = getattr(config, "FLEX_SEARCH_TIMEOUT", 30)
+MAX_FLEX_DAYS = getattr(config, "MAX_FLEX_DAYS", 3)
+# Searches of one flexible-date search over all dates and airport pairs, above it airports are searched together.
+# At most one round of the search's share of the pool by default
+FLEX_MAX_SEARCHES = getattr(config, "FLEX_MAX_SEARCHES", FLIGHT_SEARCHES_PER_REQUEST)
+# Places with several airports are searched one airport pair at a time, above MULTI_AIRPORT_MAX_PAIRS pairs the
+# airports of one side are searched together
+MULTI_AIRPORT_MAX_PAIRS = getattr(config, "MULTI_AIRPORT_MAX_PAIRS", FLIGHT_SEARCHES_PER_REQUEST)
+MULTI_AIRPORT_TIMEOUT = getattr(config, "MULTI_AIRPORT_TIMEOUT", 30)
+
+# Return flights of likely outbound choices are searched ahead of time on a small pool of their own,
+# so speculative searches never delay searches users wait for
+RETURN_PREFETCH_WORKERS = getattr(config, "RETURN_PREFETCH_WORKERS", 4)
+return_prefetches = FanOutPool("return prefetches", RETURN_PREFETCH_WORKERS)
+
+
+_TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+
+@register_state_type
+class Segment:
+    """One leg of a flight, parsed from a SerpAPI "flights" entry."""
+
+    __slots__ = ('airline', 'flight_number', 'departure_code', 'departure_name', 'departure_time',
+                 'arrival_code', 'arrival_name', 'arrival_time', 'duration', 'travel_class', 'legroom',
+                 'extensions', 'often_delayed', 'overnight')
+
+    def __init__(self, raw):
+        """
+        :param raw: SerpAPI segment dictionary.
+        :raises KeyError: If a required field is missing.
+        """
+        departure, arrival = raw['departure_airport'], raw['arrival_airport']
+        self.airline = raw['airline']
+        self.flight_number = raw['flight_number']
+        self.departure_code = departure['id']
+        self.departure_name = departure['name']
+        self.departure_time = datetime.strptime(departure['time'], _TIME_FORMAT)
+        self.arrival_code = arrival['id']
+        self.arrival_name = arrival['name']
+        self.arrival_time = datetime.strptime(arrival['time'], _TIME_FORMAT)
+        self.duration = raw['duration']
+        self.travel_class = raw['travel_class']
+        self.legroom = raw.get('legroom', 'N/A')
+        self.extensions = tuple(raw.get('extensions', ()))
+        self.often_delayed = bool(raw.get('often_delayed_by_over_30_min'))
+        self.overnight = bool(raw.get('overnight'))
+
+
+@register_state_type
+class Layover:
+    """A stop between two segments."""
+
+    __slots__ = ('code', 'name', 'duration', 'overnight')
+
+    def __init__(self, raw):
+        """
+        :param raw: SerpAPI layover dictionary.
+        :raises KeyError: If a required field is missing.
+        """
+        self.code = raw['id']
+        self.name = raw['name']
+        self.duration = raw['duration']
+        self.overnight = bool(raw.get('overnight'))
+
+
+@register_state_type
+class Flight:
+    """
+    A flight option with only the fields the bot shows or needs for the next search step.
+    Parsed once when fetched, so sessions keep a fraction of the raw SerpAPI payload.
+    """
+
+    __slots__ = ('price', 'total_duration', 'segments', 'layovers', 'departure_token', 'booking_token', 'token',
+                 'route')
+
+    def __init__(self, raw, is_one_way=False, route=None):
+        """
+        :param raw: SerpAPI "best_flights" or "other_flights" entry.
+        :param is_one_way: Boolean indicating if the flight is one-way, one-way flights are booked directly.
+        :param route: (departure_id, arrival_id) of the search that found the flight. Its departure and booking
+            tokens are only valid in searches with the same airports.
+        :raises KeyError: If a required field is missing.
+        """
+        self.price = raw['price']
+        self.total_duration = raw['total_duration']
+        self.segments = tuple(Segment(segment) for segment in raw['flights'])
+        self.layovers = tuple(Layover(layover) for layover in raw.get('layovers', ()))
+        self.departure_token = raw.get('departure_token')
+        self.booking_token = raw.get('booking_token')
+        # Token of the next step: return flights for round trips, booking options for one-way flights
+        self.token = self.booking_token if is_one_way else self.departure_token
+        self.route = route
+
+    @property
+    def departure(self) -> Segment:
+        return self.segments[0]
+
+    @property
+    def arrival(self) -> Segment:
+        return self.segments[-1]
+
+    @property
+    def stops(self) -> int:
+        return len(self.segments) - 1
+
+    @property
+    def itinerary(self) -> tuple:
+        """Flight numbers and departure times, the same for a flight found by different searches."""
+        return tuple((segment.flight_number, segment.departure_time) for segment in self.segments)
+
+
+def _normalize_airport_ids(airport_ids):
+    """Normalizes comma-separated IATA codes, e.g. "tlv, etm" -> "TLV,ETM"."""
+    return ",".join(code.strip().upper() for code in airport_ids.split(",") if code.strip())
+
+
+def search_google_flights(params):
+    """
+    Runs a Google Flights search through SerpAPI, served from the flights cache when the same search ran recently.
+    :param params: SerpAPI request parameters.
+    :return: The SerpAPI response as a dictionary.
+    """
+    key = tuple(params.get(name) for name in _CACHE_KEY_PARAMS)
+    result = flights_cache.get(key)
+    if result is not None:
+        logger.info("Flights cache hit for %s -> %s", params.get("departure_id"), params.get("arrival_id"))
+        return result
+
+    def fetch():
+        # Another caller may have filled the cache while this one waited to become the leader
+        cached = flights_cache.get(key)
+        if cached is not None:
+            return cached
+        fetched = GoogleSearch(params).get_dict()
+        if "error" not in fetched:
+            flights_cache.set(key, fetched)
+        return fetched
+
+    return _flights_singleflight.do(key, fetch)
+
+
 def return_flights(departure_id, arrival_id, departure_date, return_date=None, departure_token=None, is_one_way=False, lang="en"):
     """
     Fetches flight information from Google Flights API based on the provided parameters.
@@ -15,17 +179,17 @@ def return_flights(departure_id, arrival_id, departure_date, return_date=None, d
     :param return_date: The return date (optional).
     :param departure_token: The departure token (optional).
     :param is_one_way: Boolean indicating if the flight is one-way.
-    :return: A list of flights with their respective booking or departure tokens.
+    :return: A list of Flight objects, best flights first.
     """
     try:
         params = {
             "engine": "google_flights",
             "type": "2" if is_one_way else "1",
-            "hl": {lang},
+            "hl": lang,
             "gl": "il",
             "currency": "USD",
-            "departure_id": departure_id,
-            "arrival_id": arrival_id,
+            "departure_id": _normalize_airport_ids(departure_id),
+            "arrival_id": _normalize_airport_ids(arrival_id),
             "outbound_date": departure_date,
             "api_key": config.GOOGLE_FLIGHTS_API
         }
@@ -36,26 +200,15 @@ def return_flights(departure_id, arrival_id, departure_date, return_date=None, d
         if departure_token:
             params["departure_token"] = departure_token
 
-        search = GoogleSearch(params)
-        result = search.get_dict()
+        result = search_google_flights(params)
 
+        route = (params["departure_id"], params["arrival_id"])
         flights = []
-        best_flights = result.get("best_flights", [])
-        other_flights = result.get("other_flights", [])
-
-        for flight in best_flights:
-            flight_info = {
-                'flight': flight,
-                'token': flight.get('departure_token', None) if not is_one_way else flight.get('booking_token', None)
-            }
-            flights.append(flight_info)
-
-        for flight in other_flights:
-            flight_info = {
-                'flight': flight,
-                'token': flight.get('departure_token', None) if not is_one_way else flight.get('booking_token', None)
-            }
-            flights.append(flight_info)
+        for raw in result.get("best_flights", []) + result.get("other_flights", []):
+            try:
+                flights.append(Flight(raw, is_one_way, route))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping malformed flight for departure_id: {departure_id}: {e!r}")
 
         logger.info(f"Fetched {len(flights)} flights for departure_id: {departure_id}, arrival_id: {arrival_id}")
         return flights
@@ -64,6 +217,79 @@ def return_flights(departure_id, arrival_id, departure_date, return_date=None, d
         logger.exception(f"Error fetching flights for departure_id: {departure_id}, arrival_id: {arrival_id}: {e}")
         return None
 
+def airport_routes(departure_id, arrival_id, max_routes=MULTI_AIRPORT_MAX_PAIRS):
+    """
+    Splits a search between comma-separated airports into separate searches.
+    :param departure_id: Comma-separated IDs of the departure airports.
+    :param arrival_id: Comma-separated IDs of the arrival airports.
+    :param max_routes: Maximum number of searches.
+    :return: List of (departure_id, arrival_id) searches: every airport pair if there are at most max_routes pairs,
+        otherwise one search per airport of one side with all airports of the other side, otherwise one search.
+    """
+    departures = _normalize_airport_ids(departure_id).split(",")
+    arrivals = _normalize_airport_ids(arrival_id).split(",")
+    if len(departures) * len(arrivals) <= max_routes:
+        return [(departure, arrival) for departure in departures for arrival in arrivals]
+    if min(len(departures), len(arrivals)) > 1 and max(len(departures), len(arrivals)) <= max_routes:
+        if len(departures) >= len(arrivals):
+            return [(departure, ",".join(arrivals)) for departure in departures]
+        return [(",".join(departures), arrival) for arrival in arrivals]
+    return [(",".join(departures), ",".join(arrivals))]
+
+
+def search_airport_pairs(departure_id, arrival_id, departure_date, return_date=None, is_one_way=False, lang="en",
+                         routes=None, timeout=MULTI_AIRPORT_TIMEOUT):
+    """
+    Searches every airport pair between two places at once and merges the results. Each search is a regular cached
+    search, flights found by several searches are kept once at their lowest price.
+    :param departure_id: Comma-separated IDs of the departure airports.
+    :param arrival_id: Comma-separated IDs of the arrival airports.
+    :param departure_date: The departure date.
+    :param return_date: The return date (optional).
+    :param is_one_way: Boolean indicating if the flight is one-way.
+    :param routes: List of (departure_id, arrival_id) searches, defaults to airport_routes().
+    :param timeout: Seconds each search may run, and may wait for a worker. Slower searches count as failed.
+    :return: A list of Flight objects, cheapest first, or None if all searches failed.
+    """
+    t0 = time.perf_counter()
+    routes = routes or airport_routes(departure_id, arrival_id)
+    results = flight_searches.run_all([(f"{departure} - {arrival}", partial(
+        return_flights, departure, arrival, departure_date, return_date, is_one_way=is_one_way, lang=lang))
+        for departure, arrival in routes], timeout)
+
+    merged = {}
+    failed = 0
+    for flights in results:
+        if flights is None:
+            failed += 1
+            continue
+        for flight in flights:
+            known = merged.get(flight.itinerary)
+            if known is None or flight.price < known.price:
+                merged[flight.itinerary] = flight
+
+    logger.info(f"Searched {len(routes)} airport pairs for departure_id: {departure_id}, arrival_id: {arrival_id} "
+                f"in {time.perf_counter() - t0:.2f} s, {failed} failed, {len(merged)} distinct flights")
+    if failed == len(routes):
+        return None
+    return sorted(merged.values(), key=lambda flight: (flight.price, flight.total_duration))
+
+
+def prefetch_return_flights(flights, departure_date, return_date, lang="en"):
+    """
+    Starts the return flight searches of outbound flights in the background. The results land in the flights cache,
+    choosing one of the flights then gets its return flights from the cache, or waits for the running search.
+    :param flights: Outbound Flight objects of a round-trip search.
+    :param departure_date: The departure date.
+    :param return_date: The return date.
+    :return: Dict of departure token to Future, cancelling a future drops the search if it has not started yet.
+    """
+    return {flight.departure_token: return_prefetches.submit(return_flights, *flight.route, departure_date,
+                                                             return_date, departure_token=flight.departure_token,
+                                                             lang=lang)
+            for flight in flights if flight.departure_token and flight.route}
+
+
 def get_flight_with_booking_token(departure_id, arrival_id, departure_date, return_date, booking_token, is_one_way=False):
     """
     Fetches flight information from Google Flights API based on the provided booking token.
@@ -83,8 +309,8 @@ def get_flight_with_booking_token(departure_id, arrival_id, departure_date, retu
             "hl": "en",
             "gl": "il",
             "currency": "USD",
-            "departure_id": departure_id,
-            "arrival_id": arrival_id,
+            "departure_id": _normalize_airport_ids(departure_id),
+            "arrival_id": _normalize_airport_ids(arrival_id),
             "outbound_date": departure_date,
             "booking_token": booking_token,
             "api_key": config.GOOGLE_FLIGHTS_API
@@ -93,12 +319,84 @@ def get_flight_with_booking_token(departure_id, arrival_id, departure_date, retu
         if not is_one_way and return_date:
             params["return_date"] = return_date
 
-        search = GoogleSearch(params)
-        result = search.get_dict()
+        result = search_google_flights(params)
 
         logger.info(f"Fetched flight details for booking_token: {booking_token}")
         return result
 
     except Exception as e:
         logger.exception(f"Error fetching flight details for booking_token: {booking_token}: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def flex_date_pairs(departure_date, return_date=None, days=MAX_FLEX_DAYS):
+    """
+    Shifts a trip by up to days days in both directions, keeping its length.
+    :param departure_date: The departure date, "YYYY-MM-DD".
+    :param return_date: The return date, "YYYY-MM-DD" (optional).
+    :param days: Maximum shift in days.
+    :return: List of (departure date, return date or None) pairs in date order, without past departure dates.
+    """
+    departure = datetime.strptime(departure_date, '%Y-%m-%d').date()
+    trip_length = datetime.strptime(return_date, '%Y-%m-%d').date() - departure if return_date else None
+    today = date.today()
+    pairs = []
+    for shift in range(-days, days + 1):
+        shifted = departure + timedelta(days=shift)
+        if shifted < today:
+            continue
+        pairs.append((shifted.isoformat(), (shifted + trip_length).isoformat() if trip_length is not None else None))
+    return pairs
+
+
+def flex_routes(departure_id, arrival_id, days=MAX_FLEX_DAYS):
+    """
+    Splits a flexible-date search between comma-separated airports into airport searches, fewer the more dates
+    are searched, so a flexible-date search makes at most FLEX_MAX_SEARCHES searches.
+    :param departure_id: Comma-separated IDs of the departure airports.
+    :param arrival_id: Comma-separated IDs of the arrival airports.
+    :param days: Maximum shift of the dates in days.
+    :return: List of (departure_id, arrival_id) searches, see airport_routes().
+    """
+    return airport_routes(departure_id, arrival_id, max(1, FLEX_MAX_SEARCHES // (2 * days + 1)))
+
+
+def search_flexible_dates(departure_id, arrival_id, departure_date, return_date=None, days=MAX_FLEX_DAYS,
+                          is_one_way=False, lang="en", routes=None, timeout=FLEX_SEARCH_TIMEOUT):
+    """
+    Searches the dates around a trip at once, so the total wait is the slowest search instead of the sum.
+    Each date pair is searched like search_airport_pairs() with the same routes, so choosing a date afterwards and
+    searching it with these routes is answered from the flights cache.
+    :param departure_id: Comma-separated IDs of the departure airports.
+    :param arrival_id: Comma-separated IDs of the arrival airports.
+    :param departure_date: The departure date.
+    :param return_date: The return date (optional), the trip length is kept for every date pair.
+    :param days: Maximum shift of the dates in days.
+    :param is_one_way: Boolean indicating if the flight is one-way.
+    :param routes: List of (departure_id, arrival_id) searches of each date, defaults to flex_routes().
+    :param timeout: Seconds each search may run, and may wait for a worker. Slower searches count as failed.
+    :return: List of (departure date, return date, cheapest Flight or None) in date order, or None if all failed.
+    """
+    t0 = time.perf_counter()
+    pairs = flex_date_pairs(departure_date, return_date, days)
+    routes = routes or flex_routes(departure_id, arrival_id, days)
+    searches = [(outbound, inbound, departure, arrival) for outbound, inbound in pairs for departure, arrival in routes]
+    results = flight_searches.run_all([(f"{departure} - {arrival} on {outbound} - {inbound}", partial(
+        return_flights, departure, arrival, outbound, inbound, is_one_way=is_one_way, lang=lang))
+        for outbound, inbound, departure, arrival in searches], timeout)
+
+    cheapest = {}
+    for (outbound, inbound, _, _), flights in zip(searches, results):
+        if flights is None:
+            continue
+        best = cheapest.get((outbound, inbound))
+        for flight in flights:
+            if best is None or flight.price < best.price:
+                best = flight
+        cheapest[(outbound, inbound)] = best
+
+    logger.info(f"Searched {len(pairs)} date pairs on {len(routes)} airport pairs for departure_id: {departure_id}, "
+                f"arrival_id: {arrival_id} in {time.perf_counter() - t0:.2f} s")
+    if not cheapest:
+        return None
+    return [(outbound, inbound, cheapest.get((outbound, inbound))) for outbound, inbound in pairs]
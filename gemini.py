@@ -1,13 +1,50 @@
 # gemini.py
 
 import logging
+import threading
+import time
+from collections import Counter
+from functools import partial
 
 import google.generativeai as genai
+import config
 from config import GEMINI_API_KEY
+from airports import lookup_airports
+from cache import TTLCache, SingleFlight
+from database import (
+    get_cached_airport_codes, save_airport_codes, get_cached_recommendation, record_recommendation_request,
+    save_recommendation, get_top_destinations
+)
 from translations import translations
+from utils import normalize_place
+from workers import FanOutPool, submit_db
 
 logger = logging.getLogger(__name__)
 
+# Airport lookups are cached in memory and in MongoDB, "NO_RESULT" answers only for a short time
+AIRPORT_CACHE_SIZE = getattr(config, "AIRPORT_CACHE_SIZE", 5000)
+AIRPORT_CACHE_TTL = getattr(config, "AIRPORT_CACHE_TTL", 30 * 24 * 3600)
+AIRPORT_NEGATIVE_CACHE_TTL = getattr(config, "AIRPORT_NEGATIVE_CACHE_TTL", 600)
+airport_cache = TTLCache(max_size=AIRPORT_CACHE_SIZE, ttl=AIRPORT_CACHE_TTL, name="airports")
+airport_lookup_stats = {"offline_hits": 0, "memory_hits": 0, "persistent_hits": 0, "model_calls": 0}
+# Lookups run on several threads at once, the counters are updated under this lock
+_airport_lookup_stats_lock = threading.Lock()
+
+# Departure and arrival airports are resolved in parallel on this pool
+AIRPORT_LOOKUP_WORKERS = getattr(config, "AIRPORT_LOOKUP_WORKERS", 8)
+AIRPORT_LOOKUP_TIMEOUT = getattr(config, "AIRPORT_LOOKUP_TIMEOUT", 20)
+airport_lookups = FanOutPool("airport lookups", AIRPORT_LOOKUP_WORKERS)
+
+# Recommendations are cached in memory and in MongoDB for days, concurrent requests share one generation
+RECOMMENDATION_CACHE_SIZE = getattr(config, "RECOMMENDATION_CACHE_SIZE", 1000)
+RECOMMENDATION_CACHE_TTL = getattr(config, "RECOMMENDATION_CACHE_TTL", 7 * 24 * 3600)
+recommendation_cache = TTLCache(max_size=RECOMMENDATION_CACHE_SIZE, ttl=RECOMMENDATION_CACHE_TTL,
+                                name="recommendations")
+_recommendation_singleflight = SingleFlight()
+# Requests served from memory are counted in the background, the counts of one destination are written together
+_pending_recommendation_requests = Counter()
+_pending_recommendation_requests_lock = threading.Lock()
+
 # Configure the SDK with your API key
 genai.configure(api_key=GEMINI_API_KEY)
 model_name = 'gemini-1.5-flash'
@@ -24,6 +61,24 @@ def generate_content(prompt):
         return None
 
 
+def generate_content_stream(prompt, on_chunk):
+    """
+    Generate content using the Gemini Flash 1.5 model, streaming the answer.
+    :param prompt: The prompt.
+    :param on_chunk: Called with the text generated so far every time a chunk arrives.
+    :return: The full text, or None on error.
+    """
+    try:
+        text = ""
+        for chunk in model.generate_content(prompt, stream=True):
+            text += chunk.text
+            on_chunk(text)
+        return text
+    except Exception as e:
+        logger.error(f"Error streaming content: {e}")
+        return None
+
+
 def suggest_items_for_destination(destination, lang='en'):
     """Generate suggested items for a travel checklist based on destination."""
     if lang == 'he':
@@ -39,26 +94,214 @@ def suggest_items_for_destination(destination, lang='en'):
     return []
 
 
-def recommend_attractions_and_tips(destination, lang='en'):
-    """Generate travel recommendations and tips for a destination."""
-    prompt = (f"Provide top attractions and travel tips for {destination}. Please, use this language (locale) - {lang}."
-              f"Format the response in HTML suitable for Telegram. AVOID USING MARKDOWN"
-              f"Use only the following HTML tags: <b>, <i>, <a>. "
-              f"AVOID USING NEXT TAGS: br, html, head, title, body, div, span, img, table, ul, ol, li, p."
-              f"The output should be a Telegram message, not a full HTML page. Please, use emoji")
+def _recommendation_prompt(destination, lang):
+    return (f"Provide top attractions and travel tips for {destination}. Please, use this language (locale) - {lang}."
+            f"Format the response in HTML suitable for Telegram. AVOID USING MARKDOWN"
+            f"Use only the following HTML tags: <b>, <i>, <a>. "
+            f"AVOID USING NEXT TAGS: br, html, head, title, body, div, span, img, table, ul, ol, li, p."
+            f"The output should be a Telegram message, not a full HTML page. Please, use emoji")
 
-    response_text = generate_content(prompt)
+
+def _generate_recommendation(key, destination, lang, on_chunk=None):
+    """Generates a recommendation and stores it in both cache tiers. Returns None if generation failed."""
+    # A concurrent request may have finished generating while this one waited
+    response_text = recommendation_cache.get((key, lang))
+    if response_text:
+        return response_text
+
+    if on_chunk:
+        response_text = generate_content_stream(_recommendation_prompt(destination, lang), on_chunk)
+    else:
+        response_text = generate_content(_recommendation_prompt(destination, lang))
+    if not response_text:
+        return None
+    recommendation_cache.set((key, lang), response_text)
+    try:
+        save_recommendation(key, lang, destination, response_text, RECOMMENDATION_CACHE_TTL)
+    except Exception as e:
+        logger.error(f"Could not save recommendation for {key!r}: {e}")
+    return response_text
+
+
+def _count_recommendation_request(key, lang):
+    """
+    Counts a recommendation request served from memory without waiting for MongoDB.
+    Requests counted while a write is queued are written with it.
+    """
+    with _pending_recommendation_requests_lock:
+        flush_queued = bool(_pending_recommendation_requests)
+        _pending_recommendation_requests[(key, lang)] += 1
+    if flush_queued:
+        return
+    try:
+        submit_db(_flush_recommendation_requests)
+    except RuntimeError as e:
+        # The database pool is shut down
+        logger.error(f"Could not count recommendation request for {key!r}: {e}")
+
+
+def _flush_recommendation_requests():
+    """Writes the recommendation requests counted since the last write."""
+    with _pending_recommendation_requests_lock:
+        pending = dict(_pending_recommendation_requests)
+        _pending_recommendation_requests.clear()
+    for (key, lang), count in pending.items():
+        try:
+            record_recommendation_request(key, lang, count)
+        except Exception as e:
+            logger.error(f"Could not count {count} recommendation requests for {key!r}: {e}")
+
+
+def recommend_attractions_and_tips(destination, lang='en', on_chunk=None):
+    """
+    Generate travel recommendations and tips for a destination.
+    Answers are cached by normalized destination and language in memory and in MongoDB.
+    :param destination: Destination as typed by the user.
+    :param lang: Language of the answer.
+    :param on_chunk: Optional callback streaming the partial answer while it is generated. It is not called for
+        cached answers or when another request is already generating the same recommendation.
+    :return: The recommendation HTML.
+    """
+    key = normalize_place(destination) or destination
+    response_text = recommendation_cache.get((key, lang))
+    if response_text:
+        _count_recommendation_request(key, lang)
+    else:
+        try:
+            response_text = get_cached_recommendation(key, lang)
+            if response_text:
+                recommendation_cache.set((key, lang), response_text)
+        except Exception as e:
+            logger.error(f"Could not read cached recommendation for {key!r}: {e}")
+
+    if not response_text:
+        response_text = _recommendation_singleflight.do((key, lang), _generate_recommendation, key, destination, lang,
+                                                        on_chunk)
     if response_text:
         return response_text
     return translations[lang].get('no_recommendations', "No recommendations available at the moment.")
 
 
+def warm_recommendations(top_n=50) -> int:
+    """
+    Generates recommendations for the most requested destinations that have no fresh cached answer.
+    :param top_n: Number of most requested destinations to check.
+    :return: Number of generated recommendations.
+    """
+    warmed = 0
+    for entry in get_top_destinations(top_n):
+        if entry["fresh"]:
+            continue
+        key, lang = entry["key"], entry["lang"]
+        # Drop a stale in-memory copy so the recommendation is really regenerated
+        recommendation_cache.delete((key, lang))
+        if _recommendation_singleflight.do((key, lang), _generate_recommendation, key, entry["destination"], lang):
+            warmed += 1
+    logger.info(f"Warmed {warmed} recommendations for the top {top_n} destinations")
+    return warmed
+
+
 def get_airports(city: str) -> str:
     """
     This function returns IATA code of airports in the city. You can use name of country or IATA code as well.
+    The offline airport index is consulted first. Model answers are cached by normalized name in memory and in
+    MongoDB, so repeated places cost no model call.
     :param city: City for search
     :return: IATA codes separated by comma or NO_RESULT if no results are found.
     """
+    key = normalize_place(city)
+    if not key:
+        return "NO_RESULT"
+
+    codes = lookup_airports(city)
+    if codes:
+        _count_airport_lookup("offline_hits")
+        return codes
+
+    codes = airport_cache.get(key)
+    if codes is not None:
+        _count_airport_lookup("memory_hits")
+        return codes
+
+    try:
+        codes = get_cached_airport_codes(key)
+    except Exception as e:
+        logger.error(f"Could not read cached airports for {key!r}: {e}")
+    if codes is not None:
+        _count_airport_lookup("persistent_hits")
+        airport_cache.set(key, codes, ttl=AIRPORT_NEGATIVE_CACHE_TTL if codes == "NO_RESULT" else None)
+        return codes
+
+    _count_airport_lookup("model_calls")
+    codes = _ask_airports(city).strip()
+    if not codes:
+        # Errors and empty answers are not cached
+        return codes
+
+    ttl = AIRPORT_NEGATIVE_CACHE_TTL if codes == "NO_RESULT" else AIRPORT_CACHE_TTL
+    airport_cache.set(key, codes, ttl=ttl)
+    try:
+        save_airport_codes(key, codes, ttl)
+    except Exception as e:
+        logger.error(f"Could not save cached airports for {key!r}: {e}")
+    return codes
+
+
+def _count_airport_lookup(tier: str):
+    with _airport_lookup_stats_lock:
+        airport_lookup_stats[tier] += 1
+
+
+def _timed_get_airports(city: str):
+    t0 = time.perf_counter()
+    codes = get_airports(city)
+    return codes, time.perf_counter() - t0
+
+
+def get_airports_concurrently(*cities: str, timeout: float = AIRPORT_LOOKUP_TIMEOUT) -> list:
+    """
+    This function resolves several places at once, so the total wait is the slowest lookup instead of the sum.
+    :param cities: Places for search, e.g. departure and arrival city.
+    :param timeout: Seconds each lookup may run, and may wait for a worker. Slower lookups count as failed.
+    :return: List of get_airports results in the order of cities, empty string for failed or timed out lookups.
+    """
+    t0 = time.perf_counter()
+    lookups = airport_lookups.run_all([(repr(city), partial(_timed_get_airports, city)) for city in cities], timeout)
+
+    results = []
+    for city, lookup in zip(cities, lookups):
+        if lookup is None:
+            results.append("")
+        else:
+            codes, t = lookup
+            logger.info(f"Resolved {city!r} to {codes!r} in {t:.2f} s")
+            results.append(codes)
+    logger.info(f"Resolved {len(cities)} airport lookups in {time.perf_counter() - t0:.2f} s")
+    return results
+
+
+def get_airport_cache_stats() -> dict:
+    """
+    Returns the airport lookup counters.
+    :return: Dict with memory cache stats, per-tier hit counts and the overall hit ratio.
+    """
+    with _airport_lookup_stats_lock:
+        counts = dict(airport_lookup_stats)
+    lookups = sum(counts.values())
+    hits = lookups - counts["model_calls"]
+    return {
+        **counts,
+        "memory": airport_cache.stats(),
+        "hit_ratio": hits / lookups if lookups else 0.0,
+    }
+
+
+def _ask_airports(city: str) -> str:
+    """
+    Asks the model for the IATA codes of airports in the city.
+    :param city: City for search
+    :return: IATA codes separated by comma, NO_RESULT if no results are found or empty string on error.
+    """
     try:
         response = model.generate_content(
             f"Provide a comma-separated list of 3-letter IATA codes for the top airports in {city}. "
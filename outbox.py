@@ -0,0 +1,259 @@
+# outbox.py
+
+import asyncio
+import inspect
+import logging
+import time
+import weakref
+from collections import deque
+
+from telebot.asyncio_helper import ApiTelegramException
+
+import config
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and about 1 per second in one chat, with short bursts
+OUTBOX_GLOBAL_RATE = getattr(config, "OUTBOX_GLOBAL_RATE", 30)
+OUTBOX_CHAT_RATE = getattr(config, "OUTBOX_CHAT_RATE", 1)
+OUTBOX_CHAT_BURST = getattr(config, "OUTBOX_CHAT_BURST", 3)
+# Retries of a call answered with 429 Too Many Requests, after the retry_after delay Telegram asks for
+OUTBOX_MAX_RETRIES = getattr(config, "OUTBOX_MAX_RETRIES", 3)
+# Merge consecutive queued plain text messages to one chat, whose results nobody waits for, into a single message
+OUTBOX_COALESCE = getattr(config, "OUTBOX_COALESCE", True)
+
+MAX_MESSAGE_LENGTH = 4096
+QUEUED_METHODS = ("send_message", "send_photo", "edit_message_text", "edit_message_reply_markup")
+_MERGEABLE_ARGS = {"chat_id", "text", "parse_mode", "reply_markup"}
+_METRICS_WINDOW = 60  # seconds
+
+
+class TokenBucket:
+    """Asyncio token bucket: rate tokens per second, up to capacity saved for bursts."""
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Tokens added per second.
+        :param capacity: Maximum number of tokens.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Waits for a token and takes it."""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _Send:
+    __slots__ = ("method", "chat_id", "kwargs", "futures", "enqueued_at")
+
+    def __init__(self, method, chat_id, kwargs, future):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        # Weak references only: a future the caller did not keep belongs to a fire-and-forget call
+        self.futures = [weakref.ref(future)]
+        self.enqueued_at = time.monotonic()
+
+    def waiting_futures(self) -> list:
+        """Returns the futures of the call that someone still holds and that are not done."""
+        return [future for future in (ref() for ref in self.futures) if future is not None and not future.done()]
+
+    def mergeable(self) -> bool:
+        """
+        Whether the call is a plain text message nobody waits for. Its message id is not used, and it has no
+        keyboard a callback could edit, so it can be sent as part of another message.
+        """
+        return (self.method == "send_message" and set(self.kwargs) <= _MERGEABLE_ARGS
+                and self.kwargs.get("reply_markup") is None and not self.waiting_futures())
+
+
+def _retrieve_exception(future):
+    # Failures are logged by the outbox, callers that do not await their send must not get "never retrieved" warnings
+    if not future.cancelled():
+        future.exception()
+
+
+class Outbox:
+    """
+    Outbound queue for Telegram calls that count against the flood limits.
+    Calls are queued per chat and sent in order, within a global and a per-chat token bucket. Calls answered with
+    429 are retried after retry_after. Consecutive plain text messages waiting for the same chat are merged into one
+    while nobody holds their futures. Failed calls are logged.
+
+    install() replaces the bot's sending methods with queued versions returning a future: awaiting it waits for the
+    call and returns its result, not keeping it queues the message and moves on.
+    """
+
+    def __init__(self, bot, global_rate=OUTBOX_GLOBAL_RATE, chat_rate=OUTBOX_CHAT_RATE, chat_burst=OUTBOX_CHAT_BURST,
+                 max_retries=OUTBOX_MAX_RETRIES, coalesce=OUTBOX_COALESCE):
+        """
+        :param bot: The async Telegram bot instance.
+        :param global_rate: Calls per second over all chats.
+        :param chat_rate: Calls per second in one chat.
+        :param chat_burst: Calls one chat can make at once after being idle.
+        :param max_retries: Retries of a call answered with 429.
+        :param coalesce: Whether to merge consecutive fire-and-forget text messages to the same chat.
+        """
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.coalesce = coalesce
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        # An idle bucket is full again after chat_burst / chat_rate seconds, so it can be dropped and recreated
+        self._chat_buckets = TTLCache(max_size=100000, ttl=chat_burst / chat_rate + 1, name="chat buckets")
+        self._methods = {}
+        self._signatures = {}
+        self._pending = {}
+        self._senders = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.failed = 0
+        self._sent_at = deque()
+        self._latencies = deque(maxlen=1000)
+
+    def install(self):
+        """Replaces the bot's sending methods with queued versions."""
+        for name in QUEUED_METHODS:
+            method = getattr(self.bot, name)
+            self._methods[name] = method
+            self._signatures[name] = inspect.signature(method)
+            setattr(self.bot, name, self._queued(name))
+
+    def _queued(self, name):
+        def queued(*args, **kwargs):
+            return self.enqueue(name, *args, **kwargs)
+
+        queued.__name__ = name
+        queued.__doc__ = self._methods[name].__doc__
+        return queued
+
+    def enqueue(self, method, *args, **kwargs) -> asyncio.Future:
+        """
+        Queues a call of one of the bot's sending methods.
+        :param method: Method name, e.g. "send_message".
+        :return: Future with the result of the call.
+        """
+        bound = self._signatures[method].bind(*args, **kwargs)
+        call_kwargs = dict(bound.arguments)
+        chat_id = call_kwargs.get("chat_id")
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve_exception)
+        self._pending.setdefault(chat_id, deque()).append(_Send(method, chat_id, call_kwargs, future))
+        if chat_id not in self._senders:
+            self._senders[chat_id] = asyncio.create_task(self._run_chat(chat_id))
+        return future
+
+    def _merge(self, send, queue):
+        # Merges the plain text messages following send. An awaited or kept send, e.g. a message that is edited
+        # later, and a message with a keyboard are never merged into or out of.
+        if not self.coalesce or not send.mergeable():
+            return
+        while queue and queue[0].mergeable() and queue[0].kwargs.get("parse_mode") == send.kwargs.get("parse_mode"):
+            text = f"{send.kwargs['text']}\n\n{queue[0].kwargs['text']}"
+            if len(text) > MAX_MESSAGE_LENGTH:
+                return
+            send.futures.extend(queue.popleft().futures)
+            send.kwargs["text"] = text
+            self.coalesced += 1
+
+    async def _run_chat(self, chat_id):
+        queue = self._pending[chat_id]
+        send = None
+        try:
+            while queue:
+                send = queue.popleft()
+                bucket = self._chat_buckets.get(chat_id)
+                if bucket is None:
+                    bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                await bucket.acquire()
+                self._chat_buckets.set(chat_id, bucket)
+                await self._global_bucket.acquire()
+                # Messages queued while waiting for the buckets can still join this one
+                self._merge(send, queue)
+                self._latencies.append(time.monotonic() - send.enqueued_at)
+                await self._send(send)
+                send = None
+        except asyncio.CancelledError:
+            # The bot is stopping, the calls still queued are lost
+            for dropped in ([send] if send is not None else []) + list(queue):
+                self._fail(dropped, asyncio.CancelledError("the outbox was stopped"))
+            raise
+        finally:
+            del self._pending[chat_id]
+            del self._senders[chat_id]
+
+    async def _send(self, send):
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await self._methods[send.method](**send.kwargs)
+            except ApiTelegramException as e:
+                retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after")
+                if e.error_code == 429 and retry_after and attempt < self.max_retries:
+                    self.retried += 1
+                    logger.warning("Rate limited on %s in chat #%s, retrying in %s s", send.method, send.chat_id,
+                                   retry_after)
+                    await asyncio.sleep(retry_after)
+                    continue
+                self._fail(send, e)
+                return
+            except Exception as e:
+                self._fail(send, e)
+                return
+            self.sent += 1
+            self._sent_at.append(time.monotonic())
+            for future in send.waiting_futures():
+                future.set_result(result)
+            return
+
+    def _fail(self, send, error):
+        self.failed += 1
+        futures = send.waiting_futures()
+        if futures:
+            logger.warning("Could not %s in chat #%s: %s", send.method, send.chat_id, error)
+        else:
+            # Nobody gets the error, the log is the only trace of the lost message
+            logger.error("Could not %s in chat #%s, nobody waits for it: %s", send.method, send.chat_id, error)
+        for future in futures:
+            if isinstance(error, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(error)
+
+    def stats(self) -> dict:
+        """
+        Returns the outbox counters.
+        :return: Dict with queue sizes, call counts, throughput over the last minute and queue latencies.
+        """
+        cutoff = time.monotonic() - _METRICS_WINDOW
+        while self._sent_at and self._sent_at[0] < cutoff:
+            self._sent_at.popleft()
+        latencies = sorted(self._latencies)
+        return {
+            "pending": sum(len(queue) for queue in self._pending.values()),
+            "chats": len(self._pending),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "failed": self.failed,
+            "sent_per_second": len(self._sent_at) / _METRICS_WINDOW,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
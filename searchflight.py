@@ -1,65 +1,81 @@
 # searchflights.py
 
 import logging
-from datetime import datetime
 
+import config
+from state import StateNamespace, CONVERSATION_STATE_TTL, preload_state
 from utils import is_nested_empty, get_language, translate
-from flights import return_flights, get_flight_with_booking_token
+from cache import TTLCache
+from flights import (
+    Flight, FLIGHTS_CACHE_TTL, return_flights, get_flight_with_booking_token, search_flexible_dates,
+    search_airport_pairs, prefetch_return_flights, flex_routes
+)
+from flight_query import FlightQuery, FlightResults, SORT_NAMES, STOP_FILTERS, DEPARTURE_WINDOWS
+from datetime import datetime
 from telebot import types
+from telebot.asyncio_helper import ApiTelegramException
+from workers import run_api
 
 logger = logging.getLogger(__name__)
 
-airport_codes = {}
-flight_results = {}
-search_details = {}
+FLIGHT_RESULTS_TTL = getattr(config, "FLIGHT_RESULTS_TTL", 6 * 3600)
+AIRPORT_NAMES_TTL = getattr(config, "AIRPORT_NAMES_TTL", 30 * 24 * 3600)
 
-def format_flight_details(flight, chat_id):
-    try:
-        segments = flight['flights']
-        price = flight['price']
-        total_duration = flight['total_duration']
-        layovers = flight.get('layovers', [])
-        stops_info = ""
-
-        if layovers:
-            stops_info = f"<b>{translate(chat_id, "layovers")}:</b>\n"
-            for layover in layovers:
-                stops_info += (f"• {layover['name']} ({layover['id']}), Duration: {layover['duration']} mins "
-                               f"{f'({translate(chat_id, "overnight")})' if layover.get('overnight') else ''}\n")
-
-        details = (f"<b>{translate(chat_id, "airline")}:</b> {segments[0]['airline']}\n"
-                   f"<b>{translate(chat_id, "total_duration")}:</b> {total_duration} mins\n"
-                   f"<b>{translate(chat_id, price)}:</b> ${price}\n"
-                   f"{stops_info}\n"
-                   f"<b>{translate(chat_id, "flights")}:</b>\n")
-
-        for segment in segments:
-            details += (f"\n<b>{segment['airline']} {segment['flight_number']}</b>\n"
-                        f"{translate(chat_id, "from")}: {segment['departure_airport']['name']} ({segment['departure_airport']['id']})\n"
-                        f"{translate(chat_id, "to")}: {segment['arrival_airport']['name']} ({segment['arrival_airport']['id']})\n"
-                        f"{translate(chat_id, "departure")}: {datetime.strptime(segment['departure_airport']['time'], '%Y-%m-%d %H:%M').strftime('%d.%m.%Y %H:%M')}\n"
-                        f"{translate(chat_id, "arrival")}: {datetime.strptime(segment['arrival_airport']['time'], '%Y-%m-%d %H:%M').strftime('%d.%m.%Y %H:%M')}\n"
-                        f"{translate(chat_id, "duration")}: {segment['duration']} {translate(chat_id, "mins")}\n"
-                        f"{translate(chat_id, "travel_class")}: {segment['travel_class']}\n"
-                        f"{translate(chat_id, "legroom")}: {segment.get('legroom', 'N/A')}\n"
-                        f"{translate(chat_id, "extensions")}: {', '.join(segment.get('extensions', []))}\n"
-                        f"{f'({translate(chat_id, "often_delayed_by_over_30_min")})' if segment.get('often_delayed_by_over_30_min') else ''}\n"
-                        f"{f'({translate(chat_id, "overnight")})' if segment.get('overnight') else ''}\n")
-
-        return details
-
-    except KeyError as e:
-        logger.error("KeyError in format_flight_details: %s", e)
-        return "Error in fetching flight details"
-
-
-
-def handle_flight_search(bot, chat_id, departure_id, arrival_id, departure_date, return_date=None,
+# Flight results are shown FLIGHTS_PAGE_SIZE at a time
+FLIGHTS_PAGE_SIZE = getattr(config, "FLIGHTS_PAGE_SIZE", 5)
+
+# Return flights of the RETURN_PREFETCH_COUNT cheapest outbound flights are searched while the user chooses
+RETURN_PREFETCH_COUNT = getattr(config, "RETURN_PREFETCH_COUNT", 3)
+# Prefetch futures of each chat, a prefetched result is only useful while it is in the flights cache
+_return_prefetches = TTLCache(max_size=10000, ttl=FLIGHTS_CACHE_TTL, name="return prefetches")
+
+airport_codes = StateNamespace("airport_codes", ttl=AIRPORT_NAMES_TTL)
+flight_results = StateNamespace("flight_results", ttl=FLIGHT_RESULTS_TTL)
+search_details = StateNamespace("search_details", ttl=CONVERSATION_STATE_TTL)
+
+def format_flight_details(flight: Flight, chat_id):
+    """
+    Formats the details of a flight as HTML.
+
+    :param flight: The flight to format.
+    :param chat_id: The chat ID, used for the language of the labels.
+    :return: The flight details.
+    """
+    stops_info = ""
+    if flight.layovers:
+        stops_info = f"<b>{translate(chat_id, "layovers")}:</b>\n"
+        for layover in flight.layovers:
+            stops_info += (f"• {layover.name} ({layover.code}), Duration: {layover.duration} mins "
+                           f"{f'({translate(chat_id, "overnight")})' if layover.overnight else ''}\n")
+
+    details = (f"<b>{translate(chat_id, "airline")}:</b> {flight.departure.airline}\n"
+               f"<b>{translate(chat_id, "total_duration")}:</b> {flight.total_duration} mins\n"
+               f"<b>{translate(chat_id, "price")}:</b> ${flight.price}\n"
+               f"{stops_info}\n"
+               f"<b>{translate(chat_id, "flights")}:</b>\n")
+
+    for segment in flight.segments:
+        details += (f"\n<b>{segment.airline} {segment.flight_number}</b>\n"
+                    f"{translate(chat_id, "from")}: {segment.departure_name} ({segment.departure_code})\n"
+                    f"{translate(chat_id, "to")}: {segment.arrival_name} ({segment.arrival_code})\n"
+                    f"{translate(chat_id, "departure")}: {segment.departure_time:%d.%m.%Y %H:%M}\n"
+                    f"{translate(chat_id, "arrival")}: {segment.arrival_time:%d.%m.%Y %H:%M}\n"
+                    f"{translate(chat_id, "duration")}: {segment.duration} {translate(chat_id, "mins")}\n"
+                    f"{translate(chat_id, "travel_class")}: {segment.travel_class}\n"
+                    f"{translate(chat_id, "legroom")}: {segment.legroom}\n"
+                    f"{translate(chat_id, "extensions")}: {', '.join(segment.extensions)}\n"
+                    f"{f'({translate(chat_id, "often_delayed_by_over_30_min")})' if segment.often_delayed else ''}\n"
+                    f"{f'({translate(chat_id, "overnight")})' if segment.overnight else ''}\n")
+
+    return details
+
+
+async def handle_flight_search(bot, chat_id, departure_id, arrival_id, departure_date, return_date=None,
                          departure_token=None):
     """
     Handles the flight search process and sends the results to the user.
 
-    :param bot: The Telegram bot instance.
+    :param bot: The async Telegram bot instance.
     :param chat_id: The chat ID to send the messages to.
     :param departure_id: The ID of the departure airport.
     :param arrival_id: The ID of the arrival airport.
@@ -70,7 +86,7 @@ def handle_flight_search(bot, chat_id, departure_id, arrival_id, departure_date,
     try:
         search_detail = search_details.get(chat_id)
         if not search_detail:
-            bot.send_message(chat_id, {translate(chat_id, "no_search_details")})
+            bot.send_message(chat_id, translate(chat_id, "no_search_details"))
             logger.error("Search details not found for chat_id: %s", chat_id)
             return
 
@@ -85,93 +101,251 @@ def handle_flight_search(bot, chat_id, departure_id, arrival_id, departure_date,
 
         bot.send_message(chat_id, search_message)
         logger.info("Started flight search: %s", search_message)
-        flights = return_flights(departure_id, arrival_id, departure_date, return_date, departure_token=departure_token,
-                                 is_one_way=is_one_way, lang=get_language(chat_id))
+        if departure_token or ("," not in departure_id and "," not in arrival_id):
+            flights = await run_api(return_flights, departure_id, arrival_id, departure_date, return_date,
+                                    departure_token=departure_token, is_one_way=is_one_way,
+                                    lang=get_language(chat_id))
+        else:
+            # Places with several airports, e.g. a metro area or a country. A date chosen in a price calendar is
+            # searched on the airport pairs of the calendar, which are cached already
+            routes = search_detail.get("routes")
+            flights = await run_api(search_airport_pairs, departure_id, arrival_id, departure_date, return_date,
+                                    is_one_way=is_one_way, lang=get_language(chat_id),
+                                    routes=[tuple(route) for route in routes] if routes else None)
         if flights is None:
             bot.send_message(chat_id, translate(chat_id, "error_fetching_flights"))
             logger.error("Error occurred while fetching flights for chat_id: %s", chat_id)
             return
 
-        send_flight_results(bot, chat_id, flights)
+        results = await send_flight_results(bot, chat_id, flights)
+        if results is not None and not departure_token and not is_one_way and return_date:
+            start_return_prefetch(chat_id, results, departure_date, return_date)
     except Exception as e:
         bot.send_message(chat_id, translate(chat_id, "unexpected_error_flights"))
         logger.exception("Unexpected error in handle_flight_search: %s", e)
 
 
-def get_airport_name_from_flight(flight, is_departure=True):
+def start_return_prefetch(chat_id, results, departure_date, return_date):
     """
-    Retrieves the airport name from a flight segment and caches it.
+    Searches the return flights of the cheapest outbound flights in the background, replacing the prefetches of an
+    earlier search of the chat.
 
-    :param flight: The flight segment information.
-    :param is_departure: Boolean indicating if the airport is the departure airport.
-    :return: The airport name.
+    :param chat_id: The chat ID.
+    :param results: FlightResults of a round-trip outbound search.
+    :param departure_date: The departure date.
+    :param return_date: The return date.
     """
-    try:
-        segment = flight['flights'][0]
-        airport_code = segment['departure_airport']['id'] if is_departure else segment['arrival_airport']['id']
-        airport_name = segment['departure_airport']['name'] if is_departure else segment['arrival_airport']['name']
+    cancel_return_prefetch(chat_id)
+    if RETURN_PREFETCH_COUNT <= 0:
+        return
+    flights = [results.flights[i] for i in results.orders["price"][:RETURN_PREFETCH_COUNT]]
+    prefetches = prefetch_return_flights(flights, departure_date, return_date, lang=get_language(chat_id))
+    if prefetches:
+        _return_prefetches.set(chat_id, prefetches)
+        logger.info("Prefetching return flights of %s outbound flights for chat_id: %s", len(prefetches), chat_id)
+
 
-        if airport_code not in airport_codes:
-            airport_codes[airport_code] = airport_name
+def cancel_return_prefetch(chat_id, keep_token=None):
+    """
+    Drops the return flight prefetches of the chat that have not started yet.
 
-        return airport_codes[airport_code]
-    except KeyError as e:
-        logger.error("KeyError in get_airport_name_from_flight: %s", e)
-        return "Unknown"
+    :param chat_id: The chat ID.
+    :param keep_token: Departure token of the chosen outbound flight, its prefetch is kept.
+    """
+    prefetches = _return_prefetches.get(chat_id)
+    if not prefetches:
+        return
+    _return_prefetches.delete(chat_id)
+    cancelled = sum(future.cancel() for token, future in prefetches.items() if token != keep_token)
+    if cancelled:
+        logger.info("Cancelled %s return flight prefetches for chat_id: %s", cancelled, chat_id)
+
+
+def _flex_calendar_keyboard(calendar):
+    keyboard = types.InlineKeyboardMarkup()
+    prices = [flight.price for _, _, flight in calendar if flight is not None]
+    cheapest = min(prices) if prices else None
+    for outbound, inbound, flight in calendar:
+        dates = f"{datetime.strptime(outbound, '%Y-%m-%d'):%a %d.%m}"
+        if inbound:
+            dates += f" → {datetime.strptime(inbound, '%Y-%m-%d'):%d.%m}"
+        if flight is None:
+            text = f"{dates} | —"
+        else:
+            text = f"{'⭐ ' if flight.price == cheapest else ''}{dates} | ${flight.price}"
+        keyboard.add(types.InlineKeyboardButton(text=text, callback_data=f"flex:{outbound}:{inbound or ''}"))
+    return keyboard
 
 
-def send_flight_results(bot, chat_id, flights):
+async def handle_flex_search(bot, chat_id, departure_id, arrival_id, departure_date, return_date=None, days=3):
     """
-    Sends the flight search results to the user.
+    Searches the dates around the requested trip in parallel and sends a price calendar with the cheapest fare of
+    each date pair. Choosing a date pair shows its flights.
 
-    :param bot: The Telegram bot instance.
+    :param bot: The async Telegram bot instance.
     :param chat_id: The chat ID to send the messages to.
-    :param flights: The flight search results.
+    :param departure_id: Comma-separated IDs of the departure airports.
+    :param arrival_id: Comma-separated IDs of the arrival airports.
+    :param departure_date: The departure date.
+    :param return_date: The return date (optional).
+    :param days: Number of days searched before and after the dates.
     """
     try:
-        if not is_nested_empty(flights):
-            flight_results[chat_id] = flights
+        search_detail = search_details.get(chat_id)
+        if not search_detail:
+            bot.send_message(chat_id, translate(chat_id, "no_search_details"))
+            logger.error("Search details not found for chat_id: %s", chat_id)
+            return
+
+        is_one_way = search_detail.get("is_one_way", False)
+        routes = flex_routes(departure_id, arrival_id, days)
+        search_detail["routes"] = routes
+        search_details[chat_id] = search_detail
+        bot.send_message(chat_id, translate(chat_id, "flex_searching").format(
+            departure_city=search_detail.get("departure_city"), arrival_city=search_detail.get("arrival_city"),
+            date=departure_date, days=days))
+        calendar = await run_api(search_flexible_dates, departure_id, arrival_id, departure_date, return_date, days,
+                                 is_one_way=is_one_way, lang=get_language(chat_id), routes=routes)
+        if calendar is None:
+            bot.send_message(chat_id, translate(chat_id, "error_fetching_flights"))
+            logger.error("Error occurred while fetching flexible-date flights for chat_id: %s", chat_id)
+            return
+        if all(flight is None for _, _, flight in calendar):
+            bot.send_message(chat_id, translate(chat_id, "flights_didnt_find"), parse_mode='HTML')
+            return
 
-            keyboard = types.InlineKeyboardMarkup()
-            main_airports = set()
+        bot.send_message(chat_id, f"📅 <b>{translate(chat_id, 'flex_calendar')}</b>", parse_mode='HTML',
+                         reply_markup=_flex_calendar_keyboard(calendar))
+        logger.info("Sent price calendar to chat_id: %s", chat_id)
+    except Exception as e:
+        bot.send_message(chat_id, translate(chat_id, "unexpected_error_flights"))
+        logger.exception("Unexpected error in handle_flex_search: %s", e)
 
-            for i, flight_info in enumerate(flight_results[chat_id]):
-                flight = flight_info['flight']
-                segments = flight['flights']
-                price = flight['price']
 
-                departure_airport_code = segments[0]['departure_airport']['id']
-                arrival_airport_code = segments[-1]['arrival_airport']['id']
-                departure_time = segments[0]['departure_airport']['time']
-                arrival_time = segments[-1]['arrival_airport']['time']
+def get_airport_name(airport_code, airport_name):
+    """
+    Returns the cached name of an airport, caching the given name on first use.
 
-                get_airport_name_from_flight({'flights': [segments[0]]}, is_departure=True)
-                get_airport_name_from_flight({'flights': [segments[-1]]}, is_departure=False)
-                main_airports.add(departure_airport_code)
-                main_airports.add(arrival_airport_code)
+    :param airport_code: The IATA code of the airport.
+    :param airport_name: The airport name from the flight results.
+    :return: The airport name.
+    """
+    cached_name = airport_codes.get(airport_code)
+    if cached_name is None:
+        airport_codes[airport_code] = airport_name
+        return airport_name
+
+    return cached_name
+
+
+def _flight_button(index, flight):
+    departure, arrival = flight.departure, flight.arrival
+    stops_indicator = f" ({flight.stops})" if flight.stops > 0 else ""
+
+    button_text = (
+        f"🗓️ {departure.departure_code} - {arrival.arrival_code}{stops_indicator}"
+        f" 🛫 {departure.departure_time:%H:%M}"
+        f" | ${flight.price}"
+    )
+
+    callback_data = f"flight_{index}_depart" if flight.token and flight.token.startswith(
+        "WyJ") else f"flight_{index}_return"
+    return types.InlineKeyboardButton(text=button_text, callback_data=callback_data)
+
+
+def _query_button(results, query, text):
+    return types.InlineKeyboardButton(text=text, callback_data=f"fq:{results.search_id}:{query.encode()}:0")
+
+
+def _cycle_button(results, query, field, text):
+    # Each tap moves the field to its next option
+    value = (getattr(query, field) + 1) % results.options(field)
+    return _query_button(results, query.with_option(field, value), text)
+
+
+def _results_keyboard(chat_id, results, query, page):
+    keyboard = types.InlineKeyboardMarkup()
+    indexes = results.query(query)
+    pages = max(1, -(-len(indexes) // FLIGHTS_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    start = page * FLIGHTS_PAGE_SIZE
+    for index in indexes[start:start + FLIGHTS_PAGE_SIZE]:
+        keyboard.add(_flight_button(index, results.flights[index]))
+    if not indexes:
+        keyboard.add(_query_button(results, FlightQuery(sort=query.sort), translate(chat_id, "no_flights_match")))
+
+    max_stops = STOP_FILTERS[query.stops]
+    window = DEPARTURE_WINDOWS[query.hours]
+    keyboard.row(
+        _cycle_button(results, query, "sort", f"↕️ {translate(chat_id, f'sort_{SORT_NAMES[query.sort]}')}"),
+        _cycle_button(results, query, "stops", translate(chat_id, "filter_any_stops") if max_stops is None else
+                      translate(chat_id, "filter_nonstop") if max_stops == 0 else
+                      translate(chat_id, "filter_max_one_stop")),
+        _cycle_button(results, query, "price", f"💲 ≤ ${results.price_ceilings[query.price - 1]}" if query.price
+                      else translate(chat_id, "filter_any_price")),
+    )
+    filter_row = [
+        _cycle_button(results, query, "hours", f"🕘 {translate(chat_id, f'filter_{window[0]}')}" if window
+                      else translate(chat_id, "filter_any_time")),
+        _cycle_button(results, query, "airline", f"✈️ {results.airlines[query.airline - 1]}" if query.airline
+                      else translate(chat_id, "filter_any_airline")),
+    ]
+    if query.duration:
+        max_duration = results.duration_ceilings[query.duration - 1]
+        filter_row.append(_cycle_button(results, query, "duration", f"⏱ ≤ {max_duration // 60}:{max_duration % 60:02d}"))
+    else:
+        filter_row.append(_cycle_button(results, query, "duration", translate(chat_id, "filter_any_duration")))
+    keyboard.row(*filter_row)
+    if query.filtered:
+        keyboard.row(_query_button(results, FlightQuery(sort=query.sort), translate(chat_id, "filter_reset")))
+
+    if pages > 1:
+        callback_prefix = f"fq:{results.search_id}:{query.encode()}"
+        navigation = []
+        if page > 0:
+            navigation.append(types.InlineKeyboardButton(text="◀️", callback_data=f"{callback_prefix}:{page - 1}"))
+        navigation.append(types.InlineKeyboardButton(text=f"{page + 1}/{pages}",
+                                                     callback_data=f"{callback_prefix}:{page}"))
+        if page < pages - 1:
+            navigation.append(types.InlineKeyboardButton(text="▶️", callback_data=f"{callback_prefix}:{page + 1}"))
+        keyboard.row(*navigation)
+    return keyboard
+
+
+async def send_flight_results(bot, chat_id, flights):
+    """
+    Sends the first page of the flight search results, cheapest first, with sort and filter buttons.
 
-                num_of_stops = len(segments) - 1
-                stops_indicator = f" ({num_of_stops})" if num_of_stops > 0 else ""
+    :param bot: The async Telegram bot instance.
+    :param chat_id: The chat ID to send the messages to.
+    :param flights: The flight search results, a list of Flight objects.
+    :return: The stored FlightResults, or None if no flights were found.
+    """
+    try:
+        if not is_nested_empty(flights):
+            results = FlightResults(flights)
+            flight_results[chat_id] = results
 
-                button_text = (
-                    f"🗓️ {departure_airport_code} - {arrival_airport_code}"
-                    f" 🛫 {datetime.strptime(departure_time, '%Y-%m-%d %H:%M').strftime('%H:%M')}"
-                    # f"🛬 {datetime.strptime(arrival_time, '%Y-%m-%d %H:%M').strftime('%d.%m.%y %H:%M')}\n"
-                    f" | ${price}"
-                )
+            await preload_state(*{code for flight in flights
+                                   for code in (flight.departure.departure_code, flight.arrival.arrival_code)})
+            main_airports = {}
+            for flight in flights:
+                departure, arrival = flight.departure, flight.arrival
 
-                callback_data = f"flight_{i}_depart" if flight_info['token'] and flight_info['token'].startswith(
-                    "WyJ") else f"flight_{i}_return"
-                button = types.InlineKeyboardButton(text=button_text, callback_data=callback_data)
-                keyboard.add(button)
+                # One state store lookup per distinct airport
+                if departure.departure_code not in main_airports:
+                    main_airports[departure.departure_code] = get_airport_name(departure.departure_code,
+                                                                               departure.departure_name)
+                if arrival.arrival_code not in main_airports:
+                    main_airports[arrival.arrival_code] = get_airport_name(arrival.arrival_code, arrival.arrival_name)
 
-            airport_info = "\n".join(
-                [f"• {code} - {name}" for code, name in airport_codes.items() if code in main_airports])
+            airport_info = "\n".join([f"• {code} - {name}" for code, name in main_airports.items()])
 
             bot.send_message(chat_id,
                              f"✈️ <b>{translate(chat_id, "available_flights")}:</b>\n\n{airport_info}\n\n(1), (2), {translate(chat_id, "etc")}. - {translate(chat_id, "number_of_stops")}",
-                             parse_mode='HTML', reply_markup=keyboard)
+                             parse_mode='HTML', reply_markup=_results_keyboard(chat_id, results, FlightQuery(), 0))
             logger.info("Sent flight results to chat_id: %s", chat_id)
+            return results
         else:
             bot.send_message(chat_id,
                              translate(chat_id, "flights_didnt_find"),
@@ -182,14 +356,43 @@ def send_flight_results(bot, chat_id, flights):
         logger.exception("Unexpected error in send_flight_results: %s", e)
 
 
-def handle_booking_search(bot, chat_id, booking_token, is_one_way=False):
+async def handle_flight_query_callback(bot, call):
+    """
+    Filters, sorts or pages the flight results of the chat by editing the keyboard of the results message.
+    Answered from the stored results, without a new search.
+
+    :param bot: The async Telegram bot instance.
+    :param call: Callback query with data "fq:<search id>:<encoded FlightQuery>:<page>".
+    """
+    chat_id = call.message.chat.id
+    _, search_id, code, page = call.data.split(":")
+    results = flight_results.get(chat_id)
+    try:
+        query = FlightQuery.decode(code)
+    except ValueError:
+        query = None
+    if results is None or results.search_id != search_id or query is None or not results.is_valid(query):
+        await bot.answer_callback_query(call.id, translate(chat_id, "flight_results_expired"))
+        return
+    await bot.answer_callback_query(call.id)
+    try:
+        await bot.edit_message_reply_markup(chat_id=chat_id, message_id=call.message.message_id,
+                                            reply_markup=_results_keyboard(chat_id, results, query, int(page)))
+    except ApiTelegramException as e:
+        # Tapping the current page changes nothing
+        if "message is not modified" not in str(e):
+            raise
+
+
+async def handle_booking_search(bot, chat_id, booking_token, is_one_way=False, route=None):
     """
     Handles the booking search process and sends the booking details to the user.
 
-    :param bot: The Telegram bot instance.
+    :param bot: The async Telegram bot instance.
     :param chat_id: The chat ID to send the messages to.
     :param booking_token: The booking token to search for.
     :param is_one_way: Boolean indicating if the booking is for a one-way flight.
+    :param route: (departure_id, arrival_id) of the search that found the flight, defaults to the searched airports.
     """
     try:
         search_detail = search_details.get(chat_id)
@@ -198,18 +401,17 @@ def handle_booking_search(bot, chat_id, booking_token, is_one_way=False):
             logger.error("Search details not found for chat_id: %s", chat_id)
             return
 
-        departure_id = search_detail.get("departure_id")
-        arrival_id = search_detail.get("arrival_id")
+        departure_id, arrival_id = route or (search_detail.get("departure_id"), search_detail.get("arrival_id"))
         departure_date = search_detail.get("departure_date")
         return_date = search_detail.get("return_date")
 
         bot.send_message(chat_id, translate(chat_id, "searching_booking"))
         logger.info("Started booking search for chat_id: %s", chat_id)
 
-        flights = get_flight_with_booking_token(departure_id, arrival_id, departure_date, return_date, booking_token,
-                                                is_one_way)
+        flights = await run_api(get_flight_with_booking_token, departure_id, arrival_id, departure_date, return_date,
+                                booking_token, is_one_way)
         if flights is None:
-            bot.send_message(chat_id, {translate(chat_id, "error_fetching_booking")})
+            bot.send_message(chat_id, translate(chat_id, "error_fetching_booking"))
             logger.error("Error occurred while fetching booking details for chat_id: %s", chat_id)
             return
 
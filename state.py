@@ -0,0 +1,573 @@
+# state.py
+
+import asyncio
+import logging
+import shelve
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import config
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Backend for conversation state: "memory" (single process), "file" (survives restarts) or "mongo" (shared by
+# several bot processes)
+STATE_BACKEND = getattr(config, "STATE_BACKEND", "memory")
+STATE_FILE_PATH = getattr(config, "STATE_FILE_PATH", "state.db")
+# Default time to live of per-chat conversation state
+CONVERSATION_STATE_TTL = getattr(config, "CONVERSATION_STATE_TTL", 24 * 3600)
+# Bounds of the memory backend: expiring keys kept across all namespaces, and seconds between sweeps of expired keys.
+# Keys without a time to live (user preferences such as the language) are never evicted.
+STATE_MAX_ENTRIES = getattr(config, "STATE_MAX_ENTRIES", 50000)
+STATE_SWEEP_INTERVAL = getattr(config, "STATE_SWEEP_INTERVAL", 60)
+# The mongo backend keeps a process-local copy of the state in front of MongoDB: keys read at most
+# STATE_LOCAL_TTL seconds ago, and the state of each chat loaded before its updates are handled
+STATE_LOCAL_CACHE_SIZE = getattr(config, "STATE_LOCAL_CACHE_SIZE", 50000)
+STATE_LOCAL_TTL = getattr(config, "STATE_LOCAL_TTL", 60)
+STATE_IO_THREADS = getattr(config, "STATE_IO_THREADS", 8)
+
+_MISSING = object()
+# Cached in the mongo backend for keys that are not stored
+_ABSENT = object()
+# Names of all StateNamespaces, the mongo backend loads every namespace of a key at once
+_namespaces = set()
+# Classes the mongo backend can store, by name, see register_state_type()
+_state_types = {}
+_TYPE_TAG = "__type__"
+
+
+def register_state_type(cls):
+    """
+    Class decorator allowing instances of a __slots__ class in state shared through MongoDB. The slots are stored
+    as plain values, loading creates the instance without calling __init__.
+    :param cls: Class with __slots__ holding values that can be stored themselves.
+    :return: The class.
+    """
+    if _state_types.setdefault(cls.__name__, cls) is not cls:
+        raise ValueError(f"Another state type is named {cls.__name__!r}")
+    return cls
+
+
+def encode_state_value(value):
+    """
+    Converts a state value into JSON and BSON compatible data: None, bools, numbers, strings, lists and dicts with
+    string keys. Tuples, datetimes and registered classes are tagged, so decode_state_value() restores them.
+    :param value: The value.
+    :return: The encoded value.
+    :raises TypeError: If the value holds anything else.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [encode_state_value(item) for item in value]
+    if isinstance(value, tuple):
+        return {_TYPE_TAG: "tuple", "items": [encode_state_value(item) for item in value]}
+    if isinstance(value, datetime):
+        return {_TYPE_TAG: "datetime", "value": value.isoformat()}
+    if isinstance(value, dict):
+        if not all(isinstance(k, str) for k in value) or _TYPE_TAG in value:
+            raise TypeError(f"State dicts need string keys other than {_TYPE_TAG!r}: {list(value)!r}")
+        return {k: encode_state_value(v) for k, v in value.items()}
+    if _state_types.get(type(value).__name__) is type(value):
+        return {_TYPE_TAG: type(value).__name__, "slots": {
+            name: encode_state_value(getattr(value, name)) for name in type(value).__slots__ if hasattr(value, name)}}
+    raise TypeError(f"Cannot store {type(value).__name__} in state, see register_state_type()")
+
+
+def decode_state_value(data):
+    """
+    Restores a value converted by encode_state_value().
+    :param data: The encoded value.
+    :return: The value.
+    :raises ValueError: If the data was not written by encode_state_value().
+    """
+    if data is None or isinstance(data, (bool, int, float, str)):
+        return data
+    if isinstance(data, list):
+        return [decode_state_value(item) for item in data]
+    if not isinstance(data, dict):
+        raise ValueError(f"Unexpected {type(data).__name__} in stored state")
+    tag = data.get(_TYPE_TAG)
+    if tag is None:
+        return {k: decode_state_value(v) for k, v in data.items()}
+    if tag == "tuple":
+        return tuple(decode_state_value(item) for item in data["items"])
+    if tag == "datetime":
+        return datetime.fromisoformat(data["value"])
+    cls = _state_types.get(tag)
+    if cls is None:
+        raise ValueError(f"Unknown state type {tag!r}")
+    value = cls.__new__(cls)
+    for name, item in data["slots"].items():
+        if name not in cls.__slots__:
+            raise ValueError(f"{tag} has no slot {name!r}")
+        setattr(value, name, decode_state_value(item))
+    return value
+
+
+def _approx_size(obj, seen=None) -> int:
+    """
+    Approximates the memory used by a value and the containers and strings it holds.
+    :param obj: The value.
+    :return: Size in bytes.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_approx_size(k, seen) + _approx_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_approx_size(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(_approx_size(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    elif hasattr(obj, "__dict__"):
+        size += _approx_size(vars(obj), seen)
+    return size
+
+
+class StateStore:
+    """
+    Key-value store for conversation state. Keys live in namespaces (e.g. "search_details") and can expire.
+    """
+
+    def get(self, namespace, key, default=None):
+        """
+        :param namespace: Namespace of the key.
+        :param key: The key, usually a chat ID.
+        :param default: Value returned if the key is missing or expired.
+        :return: The stored value or default.
+        """
+        raise NotImplementedError
+
+    def set(self, namespace, key, value, ttl=None):
+        """
+        :param namespace: Namespace of the key.
+        :param key: The key, usually a chat ID.
+        :param value: Value to store.
+        :param ttl: Time to live in seconds, None keeps the value until it is deleted.
+        """
+        raise NotImplementedError
+
+    def delete(self, namespace, key):
+        """Removes the key if present."""
+        raise NotImplementedError
+
+    def preload(self, key):
+        """
+        Starts loading the values of a key in all namespaces into the process, for backends with remote storage.
+        :param key: The key, usually a chat ID.
+        :return: concurrent.futures.Future done when the values are loaded, or None if there is nothing to load.
+        """
+        return None
+
+    def stats(self) -> dict:
+        """
+        Returns the store counters.
+        :return: Dict with the backend name, and sizes where the backend can report them cheaply.
+        """
+        return {"backend": type(self).__name__}
+
+    def close(self):
+        """Releases the resources held by the store."""
+
+
+class MemoryStateStore(StateStore):
+    """
+    State kept in this process only. Fast, but lost on restart and not shared between processes.
+    Bounded: the least recently used expiring keys are evicted above max_entries, and a background thread sweeps
+    expired keys so abandoned sessions do not pile up. Keys stored without a time to live are preferences, not
+    sessions, and are kept until deleted.
+    """
+
+    def __init__(self, max_entries=STATE_MAX_ENTRIES, sweep_interval=STATE_SWEEP_INTERVAL):
+        """
+        :param max_entries: Maximum number of expiring keys kept across all namespaces.
+        :param sweep_interval: Seconds between sweeps of expired keys, None disables the sweeper.
+        """
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._durable = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+        self._stop = threading.Event()
+        self._sweeper = None
+        if sweep_interval:
+            self._sweeper = threading.Thread(target=self._sweep_loop, args=(sweep_interval,),
+                                             name="state-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            value = self._durable.get((namespace, key), _MISSING)
+            if value is not _MISSING:
+                return value
+            entry = self._data.get((namespace, key))
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[(namespace, key)]
+                self.expirations += 1
+                return default
+            self._data.move_to_end((namespace, key))
+            return value
+
+    def set(self, namespace, key, value, ttl=None):
+        with self._lock:
+            if ttl is None:
+                self._data.pop((namespace, key), None)
+                self._durable[(namespace, key)] = value
+                return
+            self._durable.pop((namespace, key), None)
+            self._data[(namespace, key)] = (value, time.monotonic() + ttl)
+            self._data.move_to_end((namespace, key))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+            self._durable.pop((namespace, key), None)
+
+    def sweep(self) -> int:
+        """
+        Removes the expired keys.
+        :return: Number of keys removed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, (_, expires_at) in self._data.items() if expires_at <= now]
+            for k in expired:
+                del self._data[k]
+            self.expirations += len(expired)
+        return len(expired)
+
+    def _sweep_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.debug("Swept %s expired state keys", removed)
+            except Exception as e:
+                logger.exception("State sweep failed: %s", e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = [(k, value) for k, (value, _) in self._data.items()] + list(self._durable.items())
+            stats = {"backend": "memory", "entries": len(entries), "expiring": len(self._data),
+                     "max_entries": self.max_entries, "evictions": self.evictions, "expirations": self.expirations}
+        namespaces = defaultdict(lambda: {"entries": 0, "bytes": 0})
+        for (namespace, _), value in entries:
+            namespaces[namespace]["entries"] += 1
+            namespaces[namespace]["bytes"] += _approx_size(value)
+        stats["namespaces"] = dict(namespaces)
+        stats["bytes"] = sum(n["bytes"] for n in namespaces.values())
+        return stats
+
+    def close(self):
+        self._stop.set()
+
+
+class FileStateStore(StateStore):
+    """State kept in a local shelve file, so it survives restarts of a single bot process."""
+
+    def __init__(self, path=STATE_FILE_PATH):
+        """
+        :param path: Path of the shelve file.
+        """
+        self._shelf = shelve.open(path)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(namespace, key):
+        return f"{namespace}:{key!r}"
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            entry = self._shelf.get(self._key(namespace, key))
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._shelf[self._key(namespace, key)]
+                return default
+            return value
+
+    def set(self, namespace, key, value, ttl=None):
+        # Wall clock time, the file outlives the process
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._shelf[self._key(namespace, key)] = (value, expires_at)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._shelf.pop(self._key(namespace, key), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "file", "entries": len(self._shelf)}
+
+    def close(self):
+        with self._lock:
+            self._shelf.close()
+
+
+class MongoStateStore(StateStore):
+    """
+    State kept in a MongoDB collection and shared by all bot processes. Expired keys are removed by a TTL index.
+    Values are stored as plain data by encode_state_value(), never pickled: the collection is shared, and loading
+    it must not run code.
+
+    Handlers read state synchronously from the event loop, so the store keeps a process-local copy in front of
+    MongoDB: preload() loads all namespaces of a chat before its update is handled, reads are then served from the
+    process, and writes update the local copy at once and reach MongoDB in the background. Reads and writes of a key
+    run in order on one of io_threads threads, so a load never overwrites a newer local write.
+    Only keys that were not loaded are read with a blocking round-trip.
+    """
+
+    def __init__(self, collection=None, cache_size=STATE_LOCAL_CACHE_SIZE, cache_ttl=STATE_LOCAL_TTL,
+                 io_threads=STATE_IO_THREADS):
+        """
+        :param collection: Collection to use, defaults to the "state" collection of the bot database.
+            Tests can pass a collection of a local MongoDB or an in-memory stand-in.
+        :param cache_size: Maximum number of keys kept in the process.
+        :param cache_ttl: Seconds a key is served from the process before it is read again. Keys changed by other
+            processes are seen after at most this time, or on the next update of the chat.
+        :param io_threads: Threads talking to MongoDB, each key always uses the same thread.
+        """
+        if collection is None:
+            from database import get_state_collection
+            collection = get_state_collection()
+        self._collection = collection
+        self._cache = TTLCache(max_size=cache_size, ttl=cache_ttl, name="state")
+        self._io = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"state-io-{i}") for i in range(io_threads)]
+        self._pending = defaultdict(int)
+        self._lock = threading.Lock()
+        self.blocking_reads = 0
+        self.read_errors = 0
+        self.write_errors = 0
+
+    def _thread(self, key):
+        return self._io[hash(key) % len(self._io)]
+
+    def _remember(self, namespace, key, entry):
+        # Runs on the key's thread: writes queued after this load are still pending and newer than the entry
+        with self._lock:
+            if self._pending.get((namespace, key)):
+                return
+            if entry is None:
+                self._cache.set((namespace, key), _ABSENT)
+                return
+            ttl = self._cache.ttl
+            expires_at = entry.get("expires_at")
+            if expires_at is not None:
+                ttl = min(ttl, (expires_at.replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds())
+            if ttl > 0:
+                try:
+                    value = decode_state_value(entry.get("value"))
+                except (ValueError, TypeError, KeyError) as e:
+                    # E.g. a value pickled by an older version, see database.migrate_pickled_state()
+                    logger.error("Ignoring unreadable state %s:%r: %s", namespace, key, e)
+                    value = _ABSENT
+                self._cache.set((namespace, key), value, ttl)
+            else:
+                # The TTL monitor runs about once a minute, expired entries may still be there
+                self._cache.set((namespace, key), _ABSENT)
+
+    def _load(self, namespace, key):
+        self._remember(namespace, key, self._collection.find_one({"namespace": namespace, "key": key},
+                                                                 {"value": 1, "expires_at": 1}))
+
+    def _load_all(self, key):
+        namespaces = list(_namespaces)
+        entries = {entry["namespace"]: entry for entry in self._collection.find(
+            {"namespace": {"$in": namespaces}, "key": key}, {"namespace": 1, "value": 1, "expires_at": 1})}
+        for namespace in namespaces:
+            self._remember(namespace, key, entries.get(namespace))
+
+    def preload(self, key):
+        return self._thread(key).submit(self._load_all, key)
+
+    def get(self, namespace, key, default=None):
+        value = self._cache.get((namespace, key), _MISSING)
+        if value is _MISSING:
+            self.blocking_reads += 1
+            try:
+                self._thread(key).submit(self._load, namespace, key).result()
+            except Exception as e:
+                self.read_errors += 1
+                logger.error("Could not load state %s:%r, using the default: %s", namespace, key, e)
+                return default
+            value = self._cache.get((namespace, key), _ABSENT)
+        return default if value is _ABSENT else value
+
+    def _write(self, namespace, key, update):
+        try:
+            update()
+        except Exception as e:
+            self.write_errors += 1
+            logger.exception("Could not save state %s:%r: %s", namespace, key, e)
+        finally:
+            with self._lock:
+                self._pending[(namespace, key)] -= 1
+                if not self._pending[(namespace, key)]:
+                    del self._pending[(namespace, key)]
+
+    def _submit_write(self, namespace, key, value, ttl, update):
+        with self._lock:
+            self._pending[(namespace, key)] += 1
+            if ttl is None or ttl > 0:
+                self._cache.set((namespace, key), value, ttl if ttl is not None and ttl < self._cache.ttl else None)
+        self._thread(key).submit(self._write, namespace, key, update)
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl) if ttl is not None else None
+        # Encoded right away, so values that cannot be stored fail in the caller
+        document = {"value": encode_state_value(value), "expires_at": expires_at}
+        self._submit_write(namespace, key, value, ttl, lambda: self._collection.update_one(
+            {"namespace": namespace, "key": key}, {"$set": document}, upsert=True))
+
+    def delete(self, namespace, key):
+        self._submit_write(namespace, key, _ABSENT, None, lambda: self._collection.delete_one(
+            {"namespace": namespace, "key": key}))
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = sum(self._pending.values())
+        return {"backend": "mongo", "entries": self._collection.estimated_document_count(),
+                "local": self._cache.stats(), "pending_writes": pending, "blocking_reads": self.blocking_reads,
+                "read_errors": self.read_errors, "write_errors": self.write_errors}
+
+    def close(self):
+        # Waits for the queued writes
+        for executor in self._io:
+            executor.shutdown(wait=True)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_state_store(backend=STATE_BACKEND) -> StateStore:
+    """
+    Creates a state store.
+    :param backend: "memory", "file" or "mongo".
+    :return: StateStore
+    """
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "file":
+        return FileStateStore()
+    if backend == "mongo":
+        return MongoStateStore()
+    raise ValueError(f"Unknown state backend: {backend!r}")
+
+
+def get_state_store() -> StateStore:
+    """
+    Returns the process-wide state store, creating it from config on first use.
+    :return: StateStore
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_state_store()
+                logger.info("Using %s state store", type(_store).__name__)
+    return _store
+
+
+def set_state_store(store: StateStore):
+    """Replaces the process-wide state store, e.g. with a store for tests."""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+async def preload_state(*keys):
+    """
+    Loads the state of keys (usually the chat of an update) into the process without blocking the event loop,
+    so the handlers that follow read it synchronously. Does nothing for backends without remote storage.
+    A key that cannot be loaded is logged and read again when it is used.
+    :param keys: The keys, usually chat IDs.
+    """
+    store = get_state_store()
+    futures = [(key, future) for key, future in zip(keys, map(store.preload, keys)) if future is not None]
+    if futures:
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for _, future in futures),
+                                       return_exceptions=True)
+        for (key, _), result in zip(futures, results):
+            if isinstance(result, Exception):
+                logger.error("Could not preload state of %r: %s", key, result)
+
+
+def get_state_stats() -> dict:
+    """
+    Returns the counters of the process-wide state store.
+    :return: Dict with the backend name, and for the memory backend entry counts, evictions and approximate bytes.
+    """
+    return get_state_store().stats()
+
+
+def close_state_store():
+    """Closes the process-wide state store. The next access creates a new one."""
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+
+
+class StateNamespace:
+    """
+    Dict-like view of one namespace of the process-wide state store, used in place of module-level dicts.
+    Values are replaced as a whole: changing a stored dict in place is not saved by file and mongo backends.
+    """
+
+    def __init__(self, name, ttl=None):
+        """
+        :param name: Namespace name.
+        :param ttl: Default time to live in seconds of the keys, None keeps them until deleted.
+        """
+        self.name = name
+        self.ttl = ttl
+        _namespaces.add(name)
+
+    def get(self, key, default=None):
+        return get_state_store().get(self.name, key, default)
+
+    def set(self, key, value, ttl=None):
+        get_state_store().set(self.name, key, value, self.ttl if ttl is None else ttl)
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        get_state_store().delete(self.name, key)
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        get_state_store().delete(self.name, key)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __repr__(self):
+        return f"StateNamespace({self.name!r})"
+
@@ -0,0 +1,14 @@
+# tests/__init__.py
+
+import importlib.util
+import os
+import sys
+
+# Modules read their settings from config.py, which is not committed. The example settings are enough offline.
+try:
+    import config  # noqa: F401
+except ImportError:
+    _spec = importlib.util.spec_from_file_location(
+        "config", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config-example.py"))
+    sys.modules["config"] = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(sys.modules["config"])
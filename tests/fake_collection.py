@@ -0,0 +1,80 @@
+# tests/fake_collection.py
+
+import copy
+import itertools
+import json
+import threading
+from datetime import datetime
+
+
+def _plain(value):
+    # Dates are stored natively by MongoDB, anything else that JSON cannot hold is not plain data
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not plain data")
+
+
+class FakeCollection:
+    """
+    Dict-backed stand-in for the few pymongo Collection methods the state store uses, so the mongo backend runs
+    without a server. Documents must hold plain data, as in a collection other programs can read.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.fail = None
+
+    def _call(self):
+        self.calls += 1
+        if self.fail is not None:
+            raise self.fail
+
+    @staticmethod
+    def _matches(document, query):
+        for field, condition in query.items():
+            if isinstance(condition, dict) and "$in" in condition:
+                if document.get(field) not in condition["$in"]:
+                    return False
+            elif document.get(field) != condition:
+                return False
+        return True
+
+    @staticmethod
+    def _project(document, projection):
+        if projection is None:
+            return copy.deepcopy(document)
+        return copy.deepcopy({k: v for k, v in document.items() if k == "_id" or projection.get(k)})
+
+    def find(self, query, projection=None):
+        with self._lock:
+            self._call()
+            return [self._project(document, projection) for document in self.documents.values()
+                    if self._matches(document, query)]
+
+    def find_one(self, query, projection=None):
+        return next(iter(self.find(query, projection)), None)
+
+    def update_one(self, query, update, upsert=False):
+        json.dumps(update, default=_plain)
+        with self._lock:
+            self._call()
+            document = next((d for d in self.documents.values() if self._matches(d, query)), None)
+            if document is None:
+                if not upsert:
+                    return
+                document = {"_id": next(self._ids), **query}
+                self.documents[document["_id"]] = document
+            document.update(copy.deepcopy(update["$set"]))
+
+    def delete_one(self, query):
+        with self._lock:
+            self._call()
+            document = next((d for d in self.documents.values() if self._matches(d, query)), None)
+            if document is not None:
+                del self.documents[document["_id"]]
+
+    def estimated_document_count(self):
+        return len(self.documents)
@@ -0,0 +1,90 @@
+# tests/test_airports.py
+
+import unittest
+
+from airports import AirportIndex, get_airport_index
+
+AIRPORTS = [
+    ["BER", "Berlin", "DE", ["Berlin Brandenburg"], ["Berlin Brandenburg Airport"]],
+    ["LIN", "Milan", "IT", ["Milano"], ["Milan Linate Airport"]],
+    ["MXP", "Milan", "IT", ["Milano"], ["Milan Malpensa Airport"]],
+    ["BAH", "Manama", "BH", [], ["Bahrain International Airport"]],
+    ["WAW", "Warsaw", "PL", ["Warszawa"], ["Warsaw Chopin Airport"]],
+    ["KRK", "Krakow", "PL", ["Cracow"], ["Krakow John Paul II Airport"]],
+    ["LHR", "London", "GB", [], ["Heathrow Airport"]],
+    ["LGW", "London", "GB", [], ["Gatwick Airport"]],
+    ["FRA", "Frankfurt", "DE", [], ["Frankfurt Airport"]],
+    ["FKB", "Karlsruhe", "DE", [], ["Karlsruhe Baden-Baden Airport"]],
+]
+COUNTRIES = {"DE": ["Germany"], "IT": ["Italy"], "BH": ["Bahrain"], "PL": ["Poland"], "GB": ["United Kingdom"]}
+
+
+class AirportIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = AirportIndex(AIRPORTS, COUNTRIES)
+
+    def test_exact_names(self):
+        self.assertEqual(self.index.lookup("London"), "LHR,LGW")
+        self.assertEqual(self.index.lookup("milano"), "LIN,MXP")
+        self.assertEqual(self.index.lookup("Heathrow Airport"), "LHR")
+        self.assertEqual(self.index.lookup("Poland"), "WAW,KRK")
+
+    def test_iata_codes_match_exactly(self):
+        self.assertEqual(self.index.lookup("LHR"), "LHR")
+        self.assertEqual(self.index.lookup("lin"), "LIN")
+
+    def test_prefix(self):
+        self.assertEqual(self.index.lookup("Frankf"), "FRA")
+        self.assertIsNone(self.index.lookup("Kra"))
+
+    def test_typos(self):
+        self.assertEqual(self.index.lookup("Frankfrt"), "FRA")
+        self.assertEqual(self.index.lookup("Warsaww"), "WAW")
+        self.assertEqual(self.index.lookup("Karlsrhue"), "FKB")
+
+    def test_no_prefix_or_typo_match_on_iata_codes(self):
+        for place in ("Bern", "Linz", "Lion", "Bath", "Lhrr"):
+            with self.subTest(place=place):
+                self.assertIsNone(self.index.lookup(place))
+
+    def test_distant_names_are_misses(self):
+        self.assertIsNone(self.index.lookup("Portland"))
+        self.assertIsNone(self.index.lookup("Milas"))
+        self.assertIsNone(self.index.lookup("Paris"))
+        self.assertIsNone(self.index.lookup("Londn"))
+        # Two edits from a name of up to eight letters
+        self.assertIsNone(self.index.lookup("Bergen"))
+        self.assertIsNone(self.index.lookup("Manila"))
+        # Three edits from a longer name
+        self.assertIsNone(self.index.lookup("Frankfield"))
+
+    def test_empty(self):
+        self.assertIsNone(self.index.lookup(" - "))
+
+
+class BundledAirportIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = get_airport_index()
+
+    def test_known_places(self):
+        self.assertEqual(self.index.lookup("Tel-Aviv"), "TLV")
+        self.assertEqual(self.index.lookup("Nwe York"), "JFK,EWR,LGA")
+        self.assertEqual(self.index.lookup("BER"), "BER")
+
+    def test_typos(self):
+        self.assertEqual(self.index.lookup("Frankfrt"), "FRA")
+        self.assertEqual(self.index.lookup("Barcelnoa"), "BCN")
+        self.assertEqual(self.index.lookup("Istanbull"), "IST,SAW")
+
+    def test_false_positives_are_misses(self):
+        for place in ("Bern", "Linz", "Lion", "Bath", "Portland",
+                      # Two edits from Dulles, Austria, Manama, Berlin and Almanya
+                      "Dallas", "Austin", "Manila", "Malaga", "Bergen", "Almaty"):
+            with self.subTest(place=place):
+                self.assertIsNone(self.index.lookup(place))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+# tests/test_cache.py
+
+import threading
+import time
+import unittest
+
+from cache import SingleFlight, TTLCache
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(max_size=2, ttl=None)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        cache = TTLCache(ttl=0.05)
+        cache.set("short", 1)
+        cache.set("long", 2, ttl=10)
+        time.sleep(0.06)
+        self.assertNotIn("short", cache)
+        self.assertEqual(cache.get("short", "default"), "default")
+        self.assertEqual(cache.get("long"), 2)
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_stats(self):
+        cache = TTLCache(name="test")
+        cache.set("a", None)
+        cache.get("a", "default")
+        cache.get("missing")
+        cache.delete("a")
+        stats = cache.stats()
+        self.assertEqual((stats["name"], stats["size"], stats["hits"], stats["misses"]), ("test", 0, 1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight, release, calls = SingleFlight(), threading.Event(), []
+
+        def slow(value):
+            calls.append(value)
+            release.wait(5)
+            return value * 2
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("key", slow, 21))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [21])
+        self.assertEqual(results, [42] * 5)
+        # The key is free again once the call is done
+        self.assertEqual(flight.do("key", lambda: "again"), "again")
+
+    def test_waiting_callers_get_the_exception(self):
+        flight, release, errors = SingleFlight(), threading.Event(), []
+
+        def fail():
+            release.wait(5)
+            raise ValueError("boom")
+
+        def call():
+            try:
+                flight.do("key", fail)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual({str(e) for e in errors}, {"boom"})
+
+
+if __name__ == "__main__":
+    unittest.main()
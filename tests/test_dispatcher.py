@@ -0,0 +1,89 @@
+# tests/test_dispatcher.py
+
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from dispatcher import UpdateDispatcher, update_chat_id
+
+_UPDATE_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post", "callback_query",
+                  "inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query")
+
+
+def update(update_id, chat_id, text=""):
+    fields = dict.fromkeys(_UPDATE_FIELDS)
+    fields["message"] = SimpleNamespace(chat=SimpleNamespace(id=chat_id), text=text)
+    return SimpleNamespace(update_id=update_id, **fields)
+
+
+class FakeBot:
+    """Handles an update by sleeping, recording when each update starts and ends."""
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.events = []
+
+    async def process_new_updates(self, updates):
+        for item in updates:
+            self.events.append(("start", item.update_id))
+            if item.message.text == "fail":
+                raise RuntimeError("handler failed")
+            await asyncio.sleep(self.delay)
+            self.events.append(("end", item.update_id))
+
+
+class UpdateDispatcherTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.bot = FakeBot()
+        self.dispatcher = UpdateDispatcher(self.bot, workers=4, max_queued=100)
+
+    async def asyncTearDown(self):
+        await self.dispatcher.stop()
+
+    async def drain(self):
+        await asyncio.gather(*(lane.join() for lane in self.dispatcher._lanes))
+
+    def test_chat_of_a_callback_without_message(self):
+        fields = dict.fromkeys(_UPDATE_FIELDS)
+        fields["callback_query"] = SimpleNamespace(message=None, from_user=SimpleNamespace(id=42))
+        self.assertEqual(update_chat_id(SimpleNamespace(**fields)), 42)
+        self.assertIsNone(update_chat_id(SimpleNamespace(**dict.fromkeys(_UPDATE_FIELDS))))
+
+    async def test_updates_of_a_chat_run_one_at_a_time_in_order(self):
+        await self.dispatcher.put_many([update(i, chat_id=7) for i in range(5)])
+        await self.drain()
+        self.assertEqual(self.bot.events, [(event, i) for i in range(5) for event in ("start", "end")])
+
+    async def test_chats_run_in_parallel(self):
+        # Integers hash to themselves, chats 0 and 1 are on different lanes
+        chats = (0, 1)
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        await self.dispatcher.put_many([update(i, chat_id=chats[i % 2]) for i in range(4)])
+        await self.drain()
+        # Two lanes of two updates each
+        self.assertLess(loop.time() - t0, 4 * self.bot.delay)
+        self.assertEqual([i for event, i in self.bot.events if event == "end" and i % 2 == 0], [0, 2])
+
+    async def test_full_queue(self):
+        self.dispatcher = UpdateDispatcher(self.bot, workers=1, max_queued=2)
+        self.assertTrue(self.dispatcher.submit(update(1, chat_id=1)))
+        self.assertTrue(self.dispatcher.submit(update(2, chat_id=1)))
+        self.assertFalse(self.dispatcher.submit(update(3, chat_id=1)))
+        # put_many waits for a free slot instead of dropping
+        await self.dispatcher.put_many([update(4, chat_id=1)])
+        await self.drain()
+        self.assertEqual([i for event, i in self.bot.events if event == "end"], [1, 2, 4])
+        self.assertEqual(self.dispatcher.stats()["rejected"], 1)
+
+    async def test_failed_update_does_not_stop_the_lane(self):
+        with self.assertLogs("dispatcher", "ERROR"):
+            await self.dispatcher.put_many([update(1, chat_id=1, text="fail"), update(2, chat_id=1)])
+            await self.drain()
+        self.assertEqual(self.bot.events[-1], ("end", 2))
+        self.assertEqual((self.dispatcher.handled, self.dispatcher.failed), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
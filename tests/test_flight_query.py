@@ -0,0 +1,75 @@
+# tests/test_flight_query.py
+
+import unittest
+
+from flight_query import MAX_AIRLINES, SORT_NAMES, FlightQuery, FlightResults
+from flights import Flight
+
+
+def flight(price, duration, hour, airline, segments=1):
+    legs = [{
+        "departure_airport": {"id": "TLV", "name": "Ben Gurion", "time": f"2030-01-05 {hour:02d}:00"},
+        "arrival_airport": {"id": "LHR", "name": "Heathrow", "time": f"2030-01-05 {hour:02d}:30"},
+        "airline": airline, "flight_number": f"{airline[:2].upper()}{price}", "duration": duration,
+        "travel_class": "Economy",
+    } for _ in range(segments)]
+    return Flight({"price": price, "total_duration": duration, "flights": legs})
+
+
+class FlightQueryTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for query in (FlightQuery(), FlightQuery(4, 2, 3, 4, MAX_AIRLINES, 3), FlightQuery(airline=10)):
+            with self.subTest(code=query.encode()):
+                code = query.encode()
+                self.assertEqual(len(code), 6)
+                decoded = FlightQuery.decode(code)
+                self.assertEqual([getattr(decoded, f) for f in FlightQuery.__slots__],
+                                 [getattr(query, f) for f in FlightQuery.__slots__])
+        self.assertEqual(FlightQuery().encode(), "000000")
+        self.assertEqual(FlightQuery(airline=10).encode(), "0000a0")
+        self.assertEqual(FlightQuery.decode("0000z0").airline, 35)
+
+    def test_malformed_codes(self):
+        for code in ("", "00000", "0000000", "00000!"):
+            with self.subTest(code=code), self.assertRaises(ValueError):
+                FlightQuery.decode(code)
+
+    def test_with_option_copies(self):
+        query = FlightQuery(sort=1)
+        changed = query.with_option("stops", 2)
+        self.assertEqual((query.stops, changed.stops, changed.sort), (0, 2, 1))
+        self.assertFalse(query.filtered)
+        self.assertTrue(changed.filtered)
+
+
+class FlightResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.results = FlightResults([
+            flight(500, 300, 8, "El Al"),
+            flight(200, 600, 14, "Wizz Air", segments=2),
+            flight(350, 400, 20, "British Airways"),
+            flight(300, 350, 3, "El Al"),
+        ])
+
+    def test_sort_orders(self):
+        self.assertEqual(self.results.query(FlightQuery()), [1, 3, 2, 0])
+        self.assertEqual(self.results.query(FlightQuery(sort=SORT_NAMES.index("duration"))), [0, 3, 2, 1])
+        self.assertEqual(self.results.query(FlightQuery(sort=SORT_NAMES.index("departure"))), [3, 0, 1, 2])
+
+    def test_filters(self):
+        self.assertEqual(self.results.query(FlightQuery(stops=1)), [3, 2, 0])
+        self.assertEqual(self.results.query(FlightQuery(hours=1)), [0])
+        el_al = self.results.airlines.index("El Al") + 1
+        self.assertEqual(self.results.query(FlightQuery(airline=el_al)), [3, 0])
+        self.assertEqual(self.results.query(FlightQuery(price=1)), [1, 3])
+
+    def test_validity(self):
+        self.assertTrue(self.results.is_valid(FlightQuery(airline=len(self.results.airlines))))
+        self.assertFalse(self.results.is_valid(FlightQuery(airline=len(self.results.airlines) + 1)))
+        self.assertFalse(self.results.is_valid(FlightQuery(sort=len(SORT_NAMES))))
+
+
+if __name__ == "__main__":
+    unittest.main()
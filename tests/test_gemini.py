@@ -0,0 +1,56 @@
+# tests/test_gemini.py
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+import gemini
+
+
+class RecommendationCounterTest(unittest.TestCase):
+
+    def setUp(self):
+        gemini.recommendation_cache.set(("paris", "en"), "<b>Paris</b>")
+        gemini.recommendation_cache.set(("rome", "en"), "<b>Rome</b>")
+
+    def tearDown(self):
+        gemini.recommendation_cache.delete(("paris", "en"))
+        gemini.recommendation_cache.delete(("rome", "en"))
+
+    def test_memory_hits_do_not_wait_for_mongodb(self):
+        release, written = threading.Event(), []
+
+        def slow_write(key, lang, count):
+            release.wait(5)
+            written.append((key, lang, count))
+
+        with mock.patch.object(gemini, "record_recommendation_request", side_effect=slow_write):
+            t0 = time.monotonic()
+            for destination in ("Paris", "Paris", "Rome", "Paris"):
+                self.assertIn("<b>", gemini.recommend_attractions_and_tips(destination))
+            self.assertLess(time.monotonic() - t0, 0.5)
+            release.set()
+            deadline = time.monotonic() + 2
+            while sum(count for _, _, count in written) < 4 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        # Hits counted while a write is queued are written with it
+        totals = {}
+        for key, lang, count in written:
+            totals[key] = totals.get(key, 0) + count
+        self.assertEqual(totals, {"paris": 3, "rome": 1})
+        self.assertLess(len(written), 4)
+
+    def test_failed_count_is_not_a_failed_read(self):
+        with mock.patch.object(gemini, "record_recommendation_request", side_effect=ConnectionError("down")), \
+                self.assertLogs("gemini", "ERROR") as logs:
+            self.assertEqual(gemini.recommend_attractions_and_tips("Paris"), "<b>Paris</b>")
+            deadline = time.monotonic() + 2
+            while not logs.output and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertIn("Could not count 1 recommendation requests", logs.output[0])
+        self.assertNotIn("Could not read", "".join(logs.output))
+
+
+if __name__ == "__main__":
+    unittest.main()
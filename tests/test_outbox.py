@@ -0,0 +1,151 @@
+# tests/test_outbox.py
+
+import asyncio
+import time
+import unittest
+
+from outbox import Outbox, TokenBucket
+
+
+class FakeBot:
+    """Records the Telegram calls the outbox makes. Sending fails while fail is set."""
+
+    def __init__(self):
+        self.calls = []
+        self.fail = None
+
+    async def _call(self, method, **kwargs):
+        await asyncio.sleep(0)
+        if self.fail is not None:
+            raise self.fail
+        self.calls.append((method, kwargs))
+        return len(self.calls)
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None, disable_notification=None):
+        return await self._call("send_message", chat_id=chat_id, text=text, parse_mode=parse_mode,
+                                reply_markup=reply_markup)
+
+    async def send_photo(self, chat_id, photo, caption=None, reply_markup=None):
+        return await self._call("send_photo", chat_id=chat_id, photo=photo)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, parse_mode=None, reply_markup=None):
+        return await self._call("edit_message_text", chat_id=chat_id, message_id=message_id, text=text)
+
+    async def edit_message_reply_markup(self, chat_id=None, message_id=None, reply_markup=None):
+        return await self._call("edit_message_reply_markup", chat_id=chat_id, message_id=message_id)
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.install(chat_rate=1000, chat_burst=1000)
+
+    def install(self, chat_rate, chat_burst):
+        self.bot = FakeBot()
+        self.outbox = Outbox(self.bot, global_rate=1000, chat_rate=chat_rate, chat_burst=chat_burst)
+        self.outbox.install()
+
+    async def drain(self):
+        while self.outbox._senders:
+            await asyncio.gather(*self.outbox._senders.values())
+
+    def texts(self):
+        return [kwargs["text"] for _, kwargs in self.bot.calls]
+
+    async def test_fire_and_forget_texts_are_merged(self):
+        self.bot.send_message(1, "one")
+        self.bot.send_message(1, "two")
+        self.bot.send_message(2, "other chat")
+        self.bot.send_message(1, "three")
+        await self.drain()
+        self.assertEqual(sorted(self.texts()), ["one\n\ntwo\n\nthree", "other chat"])
+        self.assertEqual(self.outbox.stats()["coalesced"], 2)
+
+    async def test_kept_sends_are_not_merged(self):
+        self.bot.send_message(1, "before")
+        loading = self.bot.send_message(1, "loading")
+        self.bot.send_message(1, "after")
+        message_id = await loading
+        await self.drain()
+        self.assertEqual(self.texts(), ["before", "loading", "after"])
+        self.assertEqual(message_id, 2)
+
+    async def test_awaited_send_is_not_merged(self):
+        self.bot.send_message(1, "before")
+        self.assertEqual(await self.bot.send_message(1, "checklist"), 2)
+        await self.drain()
+        self.assertEqual(self.texts(), ["before", "checklist"])
+
+    async def test_keyboards_and_other_arguments_are_not_merged(self):
+        self.bot.send_message(1, "plain")
+        self.bot.send_message(1, "menu", reply_markup={"inline_keyboard": []})
+        self.bot.send_message(1, "<b>html</b>", parse_mode="HTML")
+        self.bot.send_message(1, "quiet", disable_notification=True)
+        self.bot.send_message(1, "plain again")
+        await self.drain()
+        self.assertEqual(self.texts(), ["plain", "menu", "<b>html</b>", "quiet", "plain again"])
+
+    async def test_long_texts_are_not_merged(self):
+        self.bot.send_message(1, "a" * 3000)
+        self.bot.send_message(1, "b" * 3000)
+        await self.drain()
+        self.assertEqual(len(self.bot.calls), 2)
+
+    async def test_failed_sends_are_logged(self):
+        self.bot.fail = ConnectionError("network is down")
+        with self.assertLogs("outbox", "WARNING") as logs:
+            self.bot.send_message(7, "lost")
+            await self.drain()
+            with self.assertRaises(ConnectionError):
+                await self.bot.edit_message_text("edited", chat_id=8, message_id=1)
+        self.assertEqual(logs.records[0].levelname, "ERROR")
+        self.assertIn("Could not send_message in chat #7, nobody waits for it", logs.output[0])
+        self.assertEqual(logs.records[1].levelname, "WARNING")
+        self.assertIn("Could not edit_message_text in chat #8", logs.output[1])
+        self.assertEqual(self.outbox.stats()["failed"], 2)
+
+    async def test_stopped_outbox_logs_dropped_sends(self):
+        self.install(chat_rate=1, chat_burst=1)
+        self.bot.send_message(1, "first")
+        self.bot.send_message(1, "queued", reply_markup={"inline_keyboard": []})
+        await asyncio.sleep(0.05)
+        with self.assertLogs("outbox", "ERROR") as logs:
+            for task in list(self.outbox._senders.values()):
+                task.cancel()
+            await asyncio.gather(*self.outbox._senders.values(), return_exceptions=True)
+        self.assertEqual(self.texts(), ["first"])
+        self.assertIn("Could not send_message in chat #1, nobody waits for it: the outbox was stopped",
+                      logs.output[0])
+
+    async def test_chat_rate_limit(self):
+        self.install(chat_rate=20, chat_burst=2)
+        t0 = time.monotonic()
+        await asyncio.gather(*[self.bot.send_message(1, str(i)) for i in range(4)])
+        # Two messages of the burst at once, then one every 1/20 s
+        self.assertGreaterEqual(time.monotonic() - t0, 0.09)
+        self.assertEqual(self.texts(), ["0", "1", "2", "3"])
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=20, capacity=3)
+        t0 = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        self.assertLess(time.monotonic() - t0, 0.02)
+        for _ in range(2):
+            await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - t0, 0.09)
+
+    async def test_refills_up_to_capacity(self):
+        bucket = TokenBucket(rate=100, capacity=2)
+        await bucket.acquire()
+        await bucket.acquire()
+        await asyncio.sleep(0.1)
+        bucket._refill()
+        self.assertEqual(bucket.tokens, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+# tests/test_state.py
+
+import asyncio
+import pickle
+import unittest
+from datetime import datetime
+
+from flight_query import FlightResults
+from flights import Flight
+from state import (
+    MongoStateStore, StateNamespace, decode_state_value, encode_state_value, get_state_store, preload_state,
+    set_state_store
+)
+from tests.fake_collection import FakeCollection
+
+StateNamespace("test_session")
+StateNamespace("test_language")
+
+
+def raw_flight(price, hour, flight_number="LY315"):
+    segment = {
+        "departure_airport": {"id": "TLV", "name": "Ben Gurion", "time": f"2030-01-05 {hour:02d}:00"},
+        "arrival_airport": {"id": "LHR", "name": "Heathrow", "time": f"2030-01-05 {hour + 5:02d}:30"},
+        "airline": "El Al", "flight_number": flight_number, "duration": 330, "travel_class": "Economy",
+        "extensions": ["Wi-Fi"],
+    }
+    return {"price": price, "total_duration": 330, "flights": [segment], "departure_token": f"token-{price}"}
+
+
+class StateCodecTest(unittest.TestCase):
+
+    def test_plain_values(self):
+        for value in (None, True, 3, 1.5, "en", [1, "a"], {"step": "waiting", "items": [None]},
+                      ("TLV", "LHR"), [("TLV", "LHR")], datetime(2030, 1, 5, 8, 30)):
+            with self.subTest(value=value):
+                self.assertEqual(decode_state_value(encode_state_value(value)), value)
+
+    def test_flight_results(self):
+        results = FlightResults([Flight(raw_flight(300, 8)),
+                                 Flight(raw_flight(200, 14, "BA164"), route=("TLV", "LHR"))])
+        loaded = decode_state_value(encode_state_value(results))
+        self.assertIsInstance(loaded, FlightResults)
+        self.assertEqual(loaded.search_id, results.search_id)
+        self.assertEqual(loaded.orders, results.orders)
+        self.assertEqual(loaded.airlines, results.airlines)
+        self.assertEqual([flight.itinerary for flight in loaded.flights],
+                         [flight.itinerary for flight in results.flights])
+        self.assertEqual(loaded.flights[1].route, ("TLV", "LHR"))
+        self.assertEqual(loaded.flights[0].departure.extensions, ("Wi-Fi",))
+
+    def test_unregistered_classes_are_refused(self):
+        with self.assertRaises(TypeError):
+            encode_state_value(object())
+        with self.assertRaises(TypeError):
+            encode_state_value({1: "not a string key"})
+        with self.assertRaises(ValueError):
+            decode_state_value({"__type__": "os.system", "slots": {}})
+        with self.assertRaises(ValueError):
+            decode_state_value(pickle.dumps("pickled"))
+
+
+class MongoStateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = FakeCollection()
+        self.stores = []
+        self.previous_store = get_state_store()
+
+    def tearDown(self):
+        set_state_store(self.previous_store)
+        for store in self.stores:
+            store.close()
+
+    def store(self):
+        store = MongoStateStore(self.collection, io_threads=2)
+        self.stores.append(store)
+        return store
+
+    def test_values_are_shared_as_plain_data(self):
+        writer, reader = self.store(), self.store()
+        results = FlightResults([Flight(raw_flight(300, 8))])
+        writer.set("test_session", 1, results, ttl=60)
+        writer.set("test_language", 1, "he")
+        writer.close()
+
+        self.assertFalse(any(isinstance(document["value"], bytes) for document in self.collection.documents.values()))
+        reader.preload(1).result()
+        calls = self.collection.calls
+        self.assertEqual(reader.get("test_language", 1), "he")
+        self.assertEqual(reader.get("test_session", 1).search_id, results.search_id)
+        self.assertEqual(self.collection.calls, calls, "preloaded keys are read from the process")
+
+    def test_unreadable_documents_are_ignored(self):
+        self.collection.update_one({"namespace": "test_language", "key": 2}, {"$set": {"value": "he"}}, upsert=True)
+        self.collection.documents[1]["value"] = pickle.dumps("he")
+        store = self.store()
+        with self.assertLogs("state", "ERROR"):
+            store.preload(2).result()
+        self.assertEqual(store.get("test_language", 2, "en"), "en")
+
+    def test_failed_preload_falls_back_to_defaults(self):
+        store = self.store()
+        set_state_store(store)
+        self.collection.fail = ConnectionError("MongoDB is down")
+        with self.assertLogs("state", "ERROR") as logs:
+            asyncio.run(preload_state(3))
+            self.assertEqual(store.get("test_language", 3, "en"), "en")
+        self.assertIn("Could not preload state", logs.output[0])
+
+        # The key is read again once MongoDB is back
+        self.collection.fail = None
+        self.collection.update_one({"namespace": "test_language", "key": 3}, {"$set": {"value": "ru"}}, upsert=True)
+        self.assertEqual(store.get("test_language", 3, "en"), "ru")
+
+
+if __name__ == "__main__":
+    unittest.main()
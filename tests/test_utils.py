@@ -0,0 +1,40 @@
+# tests/test_utils.py
+
+import unittest
+
+from utils import html_safe_prefix
+
+
+class HtmlSafePrefixTest(unittest.TestCase):
+
+    def test_complete_text_is_kept(self):
+        for text in ("", "plain text", "<b>Paris</b> &amp; <i>Lyon</i>", "<b>nested <i>tags</i></b> after"):
+            with self.subTest(text=text):
+                self.assertEqual(html_safe_prefix(text), text)
+
+    def test_unclosed_tags_are_cut(self):
+        self.assertEqual(html_safe_prefix("Intro <b>Eiffel"), "Intro ")
+        self.assertEqual(html_safe_prefix("<b>one</b> <i>two <b>three</b>"), "<b>one</b> ")
+        self.assertEqual(html_safe_prefix("<B>Louvre</b> open"), "<B>Louvre</b> open")
+
+    def test_unfinished_tags_and_entities_are_cut(self):
+        self.assertEqual(html_safe_prefix("<b>Paris</b> and <i"), "<b>Paris</b> and ")
+        self.assertEqual(html_safe_prefix("<b>Paris</b> &am"), "<b>Paris</b> ")
+        self.assertEqual(html_safe_prefix("Tom &amp; Jerry &"), "Tom &amp; Jerry ")
+        self.assertEqual(html_safe_prefix('<a href="https://exa'), "")
+
+    def test_every_prefix_is_renderable(self):
+        text = '<b>Rome</b>: see the <a href="https://example.com/?a=1&amp;b=2">Colosseum</a> &amp; <i>Forum</i>.'
+        for end in range(len(text) + 1):
+            prefix = html_safe_prefix(text[:end])
+            with self.subTest(end=end):
+                self.assertTrue(text.startswith(prefix))
+                self.assertEqual(prefix.count("<b>"), prefix.count("</b>"))
+                self.assertEqual(prefix.count("<a "), prefix.count("</a>"))
+                self.assertEqual(prefix.count("<i>"), prefix.count("</i>"))
+                self.assertEqual(prefix.count("<"), prefix.count(">"))
+                self.assertEqual(prefix.count("&"), prefix.count(";"))
+
+
+if __name__ == "__main__":
+    unittest.main()
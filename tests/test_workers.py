@@ -0,0 +1,75 @@
+# tests/test_workers.py
+
+import threading
+import time
+import unittest
+
+from workers import FanOutPool
+
+
+class FanOutPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.shutdown()
+
+    def pool(self, workers, per_run=None):
+        pool = FanOutPool("test", workers, per_run=per_run)
+        self.pools.append(pool)
+        return pool
+
+    def test_results_in_call_order(self):
+        def fail():
+            raise ValueError("boom")
+
+        results = self.pool(4).run_all([("slow", lambda: time.sleep(0.05) or "slow"), ("fail", fail),
+                                        ("fast", lambda: "fast")], timeout=1)
+        self.assertEqual(results, ["slow", None, "fast"])
+
+    def test_per_run_limits_parallel_calls(self):
+        lock = threading.Lock()
+        running = {"now": 0, "max": 0}
+
+        def call():
+            with lock:
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+            time.sleep(0.02)
+            with lock:
+                running["now"] -= 1
+            return True
+
+        results = self.pool(8, per_run=3).run_all([(str(i), call) for i in range(10)], timeout=1)
+        self.assertEqual(results, [True] * 10)
+        self.assertEqual(running["max"], 3)
+
+    def test_timeout_starts_when_a_call_runs(self):
+        # Three calls of 0.2 s one after another take 0.6 s, each is within its 0.3 s
+        results = self.pool(1).run_all([(str(i), lambda: time.sleep(0.2) or "done") for i in range(3)],
+                                       timeout=0.3)
+        self.assertEqual(results, ["done"] * 3)
+
+    def test_slow_call_times_out(self):
+        release = threading.Event()
+        t0 = time.monotonic()
+        results = self.pool(2).run_all([("slow", lambda: release.wait(5)), ("fast", lambda: "fast")], timeout=0.1)
+        release.set()
+        self.assertEqual(results, [None, "fast"])
+        self.assertLess(time.monotonic() - t0, 1)
+
+    def test_call_waiting_for_a_busy_pool_times_out(self):
+        pool = self.pool(1)
+        release = threading.Event()
+        pool.submit(release.wait, 5)
+        with self.assertLogs("workers", "ERROR") as logs:
+            results = pool.run_all([("queued", lambda: "queued")], timeout=0.1)
+        release.set()
+        self.assertEqual(results, [None])
+        self.assertIn("waited for a worker", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,6 +18,8 @@ translations = {
         'send_item_add': "Please send me the item you want to add.",
         'send_item_delete': "Please send me the item you want to delete.",
         'checklist_unchanged': "Your checklist remains unchanged. If you need anything else, just let me know.",
+        'checklist_changed': "The checklist has changed, please try again.",
+        'tap_to_toggle': "Tap an item to mark it as done or not done.",
         'item_added': "Item added to your checklist:",
         'specify_item_add': "Please specify an item to add.",
         'item_removed': "Item removed from your checklist:",
@@ -30,7 +32,8 @@ translations = {
         'change_item_status': "Do you want to mark '{item_name}' as done or not done?",
         'flight_search_details': "Please enter your flight search details in the following format: \n"
                                  "Departure City, Destination City, Departure Date, Arrival Date\n"
-                                 "Example: Tel-Aviv, Dubai, 01.08.2024, 08.08.2024 (optional)\n",
+                                 "Example: Tel-Aviv, Dubai, 01.08.2024, 08.08.2024 (optional)\n"
+                                 "Add ±N to the departure date to compare prices N days around it: 01.08.2024 ±3\n",
         'provide_all_details_warning': "Please provide all details in the correct format: Departure City, Destination City, "
                                        "Departure Date, Return Date (optional)",
         'arrival_date_warning': "Arrival date should be after departure date.",
@@ -77,12 +80,36 @@ translations = {
         "available_flights": "Available flights",
         "etc": "etc",
         "number_of_stops": "Number of stops",
+        "sort_price": "💲 Price",
+        "sort_duration": "⏱ Duration",
+        "sort_stops": "🔁 Stops",
+        "sort_departure": "🛫 Departure",
+        "sort_airline": "✈️ Airline",
+        "filter_any_stops": "🔁 Any stops",
+        "filter_nonstop": "🔁 Nonstop",
+        "filter_max_one_stop": "🔁 Up to 1 stop",
+        "filter_any_price": "💲 Any price",
+        "filter_any_time": "🕘 Any time",
+        "filter_morning": "Morning",
+        "filter_afternoon": "Afternoon",
+        "filter_evening": "Evening",
+        "filter_night": "Night",
+        "filter_any_airline": "✈️ Any airline",
+        "filter_any_duration": "⏱ Any duration",
+        "filter_reset": "✖️ Reset filters",
+        "no_flights_match": "No flights match these filters, tap to reset",
+        "flight_results_expired": "These results are out of date, please search again.",
+        "flex_searching": "Comparing flights from {departure_city} to {arrival_city} {days} days around {date}...",
+        "flex_calendar": "Cheapest price per date, tap a date to see its flights:",
         "flights_didnt_find": "Unfortunately, we didn't find any flights for your request. Please try with other parameters.",
         "searching_booking": "Searching for booking details...",
         "error_fetching_booking": "Error occurred while fetching booking details. Please try again.",
         "booking_details": "Booking details",
         "checklist_prompt": "What would you like to do with your checklist?",
-        'language_selection_prompt': "Please choose your language:"
+        'language_selection_prompt': "Please choose your language:",
+        "busy_queued": "We are busy right now. Your request is queued at position {position}.",
+        "busy_try_later": "We are very busy right now. Please try again in a few minutes.",
+        "request_in_progress": "Your previous request is still in progress, please wait for it to finish."
     },
     'he': {
         'welcome_message': "ברוך הבא לבוט הנסיעות שלנו! 🛄\nבחר אחת מהאפשרויות הבאות כדי להתחיל:",
@@ -101,6 +128,8 @@ translations = {
         'send_item_add': "אנא שלח לי את הפריט שתרצה להוסיף.",
         'send_item_delete': "אנא שלח לי את הפריט שתרצה למחוק.",
         'checklist_unchanged': "הרשימה שלך נשארה ללא שינוי. אם אתה צריך משהו נוסף, פשוט תן לי לדעת.",
+        'checklist_changed': "הרשימה השתנתה, נסה שוב.",
+        'tap_to_toggle': "הקש על פריט כדי לסמן אותו כבוצע או כלא בוצע.",
         'item_added': "פריט נוסף לרשימת הבדיקה שלך:",
         'specify_item_add': "אנא ציין פריט להוספה.",
         'item_removed': "פריט הוסר מרשימת הבדיקה שלך:",
@@ -113,7 +142,8 @@ translations = {
         'change_item_status': "האם תרצה לסמן '{item_name}' כהושלם או לא הושלם?",
         'flight_search_details': "אנא הזן את פרטי חיפוש הטיסה שלך בפורמט הבא: \n"
                                  "עיר יציאה, עיר יעד, תאריך יציאה, תאריך הגעה\n"
-                                 "לדוגמה: תל אביב, דובאי, 01.08.2024, 08.08.2024 (בחירה)\n",
+                                 "לדוגמה: תל אביב, דובאי, 01.08.2024, 08.08.2024 (בחירה)\n"
+                                 "הוסף ±N לתאריך היציאה כדי להשוות מחירים N ימים סביבו: 01.08.2024 ±3\n",
         'provide_all_details_warning': "נא לספק את כל הפרטים בפורמט הנכון: עיר יציאה, עיר יעד, "
                                        "תאריך יציאה, תאריך חזרה (אופציונלי)",
         'arrival_date_warning': "תאריך ההגעה צריך להיות לאחר תאריך העזיבה.",
@@ -160,12 +190,36 @@ translations = {
         "available_flights": "טיסות זמינות",
         "etc": "וכו",
         "number_of_stops": "מספר עצירות",
+        "sort_price": "💲 מחיר",
+        "sort_duration": "⏱ משך",
+        "sort_stops": "🔁 עצירות",
+        "sort_departure": "🛫 המראה",
+        "sort_airline": "✈️ חברת תעופה",
+        "filter_any_stops": "🔁 כל מספר עצירות",
+        "filter_nonstop": "🔁 ישירה",
+        "filter_max_one_stop": "🔁 עד עצירה אחת",
+        "filter_any_price": "💲 כל מחיר",
+        "filter_any_time": "🕘 כל שעה",
+        "filter_morning": "בוקר",
+        "filter_afternoon": "צהריים",
+        "filter_evening": "ערב",
+        "filter_night": "לילה",
+        "filter_any_airline": "✈️ כל חברת תעופה",
+        "filter_any_duration": "⏱ כל משך",
+        "filter_reset": "✖️ איפוס מסננים",
+        "no_flights_match": "אין טיסות שמתאימות למסננים, הקש לאיפוס",
+        "flight_results_expired": "התוצאות האלה כבר לא עדכניות, חפש שוב.",
+        "flex_searching": "משווה טיסות מ{departure_city} ל{arrival_city} {days} ימים סביב {date}...",
+        "flex_calendar": "המחיר הזול ביותר לכל תאריך, הקש על תאריך כדי לראות את הטיסות:",
         "flights_didnt_find": "לצערי, לא מצאנו טיסות לבקשה שלך. בבקשה נסה שוב עם פרמטרים אחרים.",
         "searching_booking": "מחפש פרטי הזמנה...",
         "error_fetching_booking": "אירעה שגיאה בעת הבאת פרטי ההזמנה. בבקשה נסה שוב.",
         "booking_details": "פרטי הזמנה",
         "checklist_prompt": "מה ברצונך לעשות עם רשימת הבדיקה שלך?",
-        'language_selection_prompt': "אנא בחר את שפתך: "
+        'language_selection_prompt': "אנא בחר את שפתך: ",
+        "busy_queued": "אנחנו עמוסים כרגע. הבקשה שלך ממתינה בתור במקום {position}.",
+        "busy_try_later": "אנחנו עמוסים מאוד כרגע. אנא נסה שוב בעוד כמה דקות.",
+        "request_in_progress": "הבקשה הקודמת שלך עדיין בטיפול, אנא המתן לסיומה."
     },
     'ru': {
         'welcome_message': "Добро пожаловать в наш TravelBot! 🛄\nПожалуйста, выберите один из вариантов ниже, чтобы начать:",
@@ -184,6 +238,8 @@ translations = {
         'send_item_add': "Пожалуйста, отправьте мне предмет, который вы хотите добавить.",
         'send_item_delete': "Пожалуйста, отправьте мне предмет, который вы хотите удалить.",
         'checklist_unchanged': "Ваш контрольный список остался без изменений. Если вам нужно что-то еще, дайте мне знать.",
+        'checklist_changed': "Список изменился, попробуйте еще раз.",
+        'tap_to_toggle': "Нажмите на пункт, чтобы отметить его выполненным или невыполненным.",
         'item_added': "Предмет добавлен в ваш контрольный список:",
         'specify_item_add': "Пожалуйста, укажите предмет для добавления.",
         'item_removed': "Предмет удален из вашего контрольного списка:",
@@ -196,7 +252,8 @@ translations = {
         'change_item_status': "Вы хотите отметить '{item_name}' как выполненное или невыполненное?",
         'flight_search_details': "Пожалуйста, введите данные для поиска рейса в следующем формате: \n"
                                  "Город отправления, Город назначения, Дата отправления, Дата прибытия\n"
-                                 "Пример: Тель-Авив, Дубай, 01.08.2024, 08.08.2024 (необязательно)\n",
+                                 "Пример: Тель-Авив, Дубай, 01.08.2024, 08.08.2024 (необязательно)\n"
+                                 "Добавьте ±N к дате отправления, чтобы сравнить цены на N дней вокруг нее: 01.08.2024 ±3\n",
         'provide_all_details_warning': "Пожалуйста, укажите все данные в правильном формате: Город отправления, Город назначения, "
                                        "Дата отправления, Дата возврата (необязательно)",
         'arrival_date_warning': "Дата прибытия должна быть позже даты отправления.",
@@ -243,12 +300,36 @@ translations = {
         "available_flights": "Доступные рейсы",
         "etc": "и т.д.",
         "number_of_stops": "Количество остановок",
+        "sort_price": "💲 Цена",
+        "sort_duration": "⏱ Время",
+        "sort_stops": "🔁 Пересадки",
+        "sort_departure": "🛫 Вылет",
+        "sort_airline": "✈️ Авиакомпания",
+        "filter_any_stops": "🔁 Любые пересадки",
+        "filter_nonstop": "🔁 Без пересадок",
+        "filter_max_one_stop": "🔁 До 1 пересадки",
+        "filter_any_price": "💲 Любая цена",
+        "filter_any_time": "🕘 Любое время",
+        "filter_morning": "Утро",
+        "filter_afternoon": "День",
+        "filter_evening": "Вечер",
+        "filter_night": "Ночь",
+        "filter_any_airline": "✈️ Любая авиакомпания",
+        "filter_any_duration": "⏱ Любая длительность",
+        "filter_reset": "✖️ Сбросить фильтры",
+        "no_flights_match": "Нет рейсов по этим фильтрам, нажмите для сброса",
+        "flight_results_expired": "Эти результаты устарели, выполните поиск еще раз.",
+        "flex_searching": "Сравниваем рейсы из {departure_city} в {arrival_city} на {days} дн. вокруг {date}...",
+        "flex_calendar": "Самая низкая цена на каждую дату, нажмите на дату, чтобы увидеть рейсы:",
         "flights_didnt_find": "К сожалению, мы не нашли рейсов по вашему запросу. Пожалуйста, попробуйте другие параметры.",
         "searching_booking": "Поиск данных бронирования...",
         "error_fetching_booking": "Произошла ошибка при получении данных бронирования. Пожалуйста, попробуйте снова.",
         "booking_details": "Данные бронирования",
         "checklist_prompt": "Что вы хотите сделать с вашим контрольным списком?",
-        'language_selection_prompt': " :Пожалуйста, выберите язык"
+        'language_selection_prompt': " :Пожалуйста, выберите язык",
+        "busy_queued": "Сейчас мы очень заняты. Ваш запрос в очереди на позиции {position}.",
+        "busy_try_later": "Сейчас мы очень заняты. Пожалуйста, попробуйте снова через несколько минут.",
+        "request_in_progress": "Ваш предыдущий запрос ещё выполняется, пожалуйста, дождитесь его завершения."
     },
     'ar': {
         'welcome_message': "مرحبًا بك في TravelBot! 🛄\nيرجى اختيار أحد الخيارات أدناه للبدء:",
@@ -267,6 +348,8 @@ translations = {
         'send_item_add': "يرجى إرسال العنصر الذي تريد إضافته.",
         'send_item_delete': "يرجى إرسال العنصر الذي تريد حذفه.",
         'checklist_unchanged': "قائمة التحقق الخاصة بك لم تتغير. إذا كنت بحاجة إلى أي شيء آخر، فقط أعلمنا.",
+        'checklist_changed': "تغيرت القائمة، يرجى المحاولة مرة أخرى.",
+        'tap_to_toggle': "اضغط على عنصر لتحديده كمنجز أو غير منجز.",
         'item_added': "تمت إضافة العنصر إلى قائمة التحقق الخاصة بك:",
         'specify_item_add': "يرجى تحديد عنصر لإضافته.",
         'item_removed': "تمت إزالة العنصر من قائمة التحقق الخاصة بك:",
@@ -279,7 +362,8 @@ translations = {
         'change_item_status': "هل تريد وضع علامة على '{item_name}' كمكتمل أو غير مكتمل؟",
         'flight_search_details': "يرجى إدخال تفاصيل البحث عن الرحلة بالتنسيق التالي: \n"
                                  "مدينة المغادرة، مدينة الوجهة، تاريخ المغادرة، تاريخ الوصول\n"
-                                 "مثال: تل أبيب، دبي، 01.08.2024، 08.08.2024 (اختياري)\n",
+                                 "مثال: تل أبيب، دبي، 01.08.2024، 08.08.2024 (اختياري)\n"
+                                 "أضف ±N إلى تاريخ المغادرة لمقارنة الأسعار لمدة N أيام حوله: 01.08.2024 ±3\n",
         'provide_all_details_warning': "يرجى تقديم جميع التفاصيل بالتنسيق الصحيح: مدينة المغادرة، مدينة الوجهة، "
                                        "تاريخ المغادرة، تاريخ العودة (اختياري)",
         'arrival_date_warning': "يجب أن يكون تاريخ الوصول بعد تاريخ المغادرة.",
@@ -326,11 +410,35 @@ translations = {
         "available_flights": "الرحلات المتاحة",
         "etc": "وغيرها",
         "number_of_stops": "عدد التوقفات",
+        "sort_price": "💲 السعر",
+        "sort_duration": "⏱ المدة",
+        "sort_stops": "🔁 التوقفات",
+        "sort_departure": "🛫 المغادرة",
+        "sort_airline": "✈️ شركة الطيران",
+        "filter_any_stops": "🔁 أي عدد توقفات",
+        "filter_nonstop": "🔁 مباشرة",
+        "filter_max_one_stop": "🔁 حتى توقف واحد",
+        "filter_any_price": "💲 أي سعر",
+        "filter_any_time": "🕘 أي وقت",
+        "filter_morning": "الصباح",
+        "filter_afternoon": "الظهيرة",
+        "filter_evening": "المساء",
+        "filter_night": "الليل",
+        "filter_any_airline": "✈️ أي شركة طيران",
+        "filter_any_duration": "⏱ أي مدة",
+        "filter_reset": "✖️ إعادة ضبط المرشحات",
+        "no_flights_match": "لا توجد رحلات تطابق هذه المرشحات، اضغط لإعادة الضبط",
+        "flight_results_expired": "هذه النتائج قديمة، يرجى البحث مرة أخرى.",
+        "flex_searching": "جارٍ مقارنة الرحلات من {departure_city} إلى {arrival_city} لمدة {days} أيام حول {date}...",
+        "flex_calendar": "أرخص سعر لكل تاريخ، اضغط على تاريخ لرؤية رحلاته:",
         "flights_didnt_find": "للأسف، لم نعثر على أي رحلات لطلبك. يرجى المحاولة مرة أخرى باستخدام معايير مختلفة.",
         "searching_booking": "جارٍ البحث عن تفاصيل الحجز...",
         "error_fetching_booking": "حدث خطأ أثناء جلب تفاصيل الحجز. يرجى المحاولة مرة أخرى.",
         "booking_details": "تفاصيل الحجز",
         "checklist_prompt": "ماذا تريد أن تفعل بقائمة التحقق الخاصة بك؟",
-        'language_selection_prompt': "لرجاء اختيار لغة "
+        'language_selection_prompt': "لرجاء اختيار لغة ",
+        "busy_queued": "نحن مشغولون الآن. طلبك في قائمة الانتظار في المركز {position}.",
+        "busy_try_later": "نحن مشغولون جداً الآن. يرجى المحاولة مرة أخرى بعد بضع دقائق.",
+        "request_in_progress": "طلبك السابق لا يزال قيد التنفيذ، يرجى الانتظار حتى ينتهي."
     }
 }
\ No newline at end of file
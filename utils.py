@@ -1,9 +1,10 @@
 # utils.py
 
 from translations import translations
+from state import StateNamespace
 
 # Language state management
-user_languages = {}
+user_languages = StateNamespace("user_languages")
 
 def get_language(chat_id):
     return user_languages.get(chat_id, 'en')  # Default to English
@@ -16,8 +17,43 @@ def translate(chat_id, key):
     lang = get_language(chat_id)
     return translations.get(lang, translations['en']).get(key, '')
 
+import re
+import unicodedata
 from typing import List
 
+# Latin transliteration of Cyrillic, Hebrew and Arabic letters, used to build script-independent keys.
+# Letters with diacritics (й, ё, أ, ...) are decomposed to their base letter before this table is applied.
+_TRANSLITERATION = str.maketrans({
+    # Russian
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y',
+    'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    # Hebrew
+    'א': 'a', 'ב': 'v', 'ג': 'g', 'ד': 'd', 'ה': 'h', 'ו': 'v', 'ז': 'z', 'ח': 'kh', 'ט': 't', 'י': 'y',
+    'כ': 'k', 'ך': 'k', 'ל': 'l', 'מ': 'm', 'ם': 'm', 'נ': 'n', 'ן': 'n', 'ס': 's', 'ע': 'a', 'פ': 'p',
+    'ף': 'f', 'צ': 'ts', 'ץ': 'ts', 'ק': 'k', 'ר': 'r', 'ש': 'sh', 'ת': 't',
+    # Arabic
+    'ا': 'a', 'ء': '', 'ب': 'b', 'ت': 't', 'ث': 'th', 'ج': 'j', 'ح': 'h',
+    'خ': 'kh', 'د': 'd', 'ذ': 'dh', 'ر': 'r', 'ز': 'z', 'س': 's', 'ش': 'sh', 'ص': 's', 'ض': 'd', 'ط': 't',
+    'ظ': 'z', 'ع': 'a', 'غ': 'gh', 'ف': 'f', 'ق': 'q', 'ك': 'k', 'ل': 'l', 'م': 'm', 'ن': 'n', 'ه': 'h',
+    'ة': 'a', 'و': 'w', 'ي': 'y', 'ى': 'a',
+})
+
+
+def normalize_place(name: str) -> str:
+    """
+    This function builds a normalized key for a city, country or airport name.
+    It ignores case, accents, punctuation and extra whitespace and transliterates Hebrew, Russian and Arabic input.
+    :param name: Place name as typed by the user.
+    :return: str. Normalized key, e.g. "Tel-Aviv " -> "tel aviv".
+    """
+    text = unicodedata.normalize('NFKD', name.casefold())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = text.translate(_TRANSLITERATION)
+    text = re.sub(r'[\W_]+', ' ', text)
+    return ' '.join(text.split())
+
 
 def is_nested_empty(lst: List) -> bool:
     """
@@ -30,4 +66,41 @@ def is_nested_empty(lst: List) -> bool:
     for item in lst:
         if not isinstance(item, list) or not is_nested_empty(item):
             return False
-    return True
\ No newline at end of file
+    return True
+
+_HTML_TAG = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^<>]*>')
+
+
+def html_safe_prefix(text: str) -> str:
+    """
+    This function returns the longest prefix of a partial HTML text that Telegram can render.
+    The prefix never ends inside a tag or an entity and has no unclosed tags.
+    :param text: Partial HTML text, e.g. a streamed model answer.
+    :return: str. Renderable prefix, possibly empty.
+    """
+    open_tags = []
+    safe_end = 0
+    position = 0
+    for match in _HTML_TAG.finditer(text):
+        if not open_tags:
+            safe_end = match.start()
+        is_closing, tag = match.group(1), match.group(2).lower()
+        if is_closing:
+            if tag in open_tags:
+                del open_tags[len(open_tags) - 1 - open_tags[::-1].index(tag):]
+        else:
+            open_tags.append(tag)
+        position = match.end()
+        if not open_tags:
+            safe_end = position
+
+    if not open_tags:
+        # Plain text after the last tag is safe up to an unfinished tag or entity
+        tail = text[position:]
+        if '<' in tail:
+            tail = tail[:tail.rfind('<')]
+        entity_start = tail.rfind('&')
+        if entity_start != -1 and ';' not in tail[entity_start:]:
+            tail = tail[:entity_start]
+        safe_end = position + len(tail)
+    return text[:safe_end]
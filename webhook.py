@@ -0,0 +1,104 @@
+# webhook.py
+
+import asyncio
+import hmac
+import logging
+
+from aiohttp import web
+from telebot import types
+
+import config
+from database import ping
+from dispatcher import UpdateDispatcher
+from workers import run_db
+
+logger = logging.getLogger(__name__)
+
+# Address the webhook server listens on, usually behind a reverse proxy that terminates TLS
+WEBHOOK_HOST = getattr(config, "WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = getattr(config, "WEBHOOK_PORT", 8080)
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "/telegram/webhook")
+# Public HTTPS URL registered with Telegram on startup, None leaves the current webhook as it is
+WEBHOOK_URL = getattr(config, "WEBHOOK_URL", None)
+# Telegram sends it in the X-Telegram-Bot-Api-Secret-Token header, requests without it are rejected
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", None)
+WEBHOOK_MAX_CONNECTIONS = getattr(config, "WEBHOOK_MAX_CONNECTIONS", 40)
+READINESS_TIMEOUT = 2  # seconds
+
+_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+async def handle_update(request: web.Request) -> web.Response:
+    """Receives an update from Telegram and queues it. Answers 503 when full, so Telegram retries later."""
+    if WEBHOOK_SECRET and not hmac.compare_digest(request.headers.get(_SECRET_HEADER, ""), WEBHOOK_SECRET):
+        return web.Response(status=403)
+    try:
+        update = types.Update.de_json(await request.text())
+    except Exception as e:
+        logger.warning("Ignoring malformed webhook update: %s", e)
+        return web.Response(status=400)
+    if update is None:
+        return web.Response(status=400)
+    if not request.app["dispatcher"].submit(update):
+        return web.Response(status=503)
+    return web.Response()
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    """Liveness: the process and its event loop respond."""
+    return web.json_response({"status": "ok"})
+
+
+async def handle_ready(request: web.Request) -> web.Response:
+    """Readiness: the dispatcher runs, its queue has room and MongoDB answers."""
+    dispatcher = request.app["dispatcher"]
+    stats = dispatcher.stats()
+    try:
+        database_ok = await asyncio.wait_for(run_db(ping), READINESS_TIMEOUT)
+    except asyncio.TimeoutError:
+        database_ok = False
+    ready = dispatcher.running and stats["waiting"] < dispatcher.max_queued and database_ok
+    return web.json_response({"status": "ready" if ready else "not ready", "database": database_ok,
+                              "dispatcher": stats}, status=200 if ready else 503)
+
+
+def create_app(bot, dispatcher: UpdateDispatcher = None) -> web.Application:
+    """
+    Creates the webhook application.
+    :param bot: The async Telegram bot instance.
+    :param dispatcher: Dispatcher for the updates, defaults to a new UpdateDispatcher for the bot.
+    :return: aiohttp Application
+    """
+    app = web.Application()
+    app["bot"] = bot
+    app["dispatcher"] = dispatcher or UpdateDispatcher(bot)
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/readyz", handle_ready)
+    app.on_startup.append(_on_startup)
+    app.on_shutdown.append(_on_shutdown)
+    return app
+
+
+async def _on_startup(app):
+    app["dispatcher"].start()
+    if WEBHOOK_URL:
+        await app["bot"].set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                     max_connections=WEBHOOK_MAX_CONNECTIONS)
+        logger.info("Registered webhook %s", WEBHOOK_URL)
+
+
+async def _on_shutdown(app):
+    await app["dispatcher"].stop()
+    await app["bot"].close_session()
+
+
+def run_webhook(bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    """
+    Serves the webhook until interrupted.
+    :param bot: The async Telegram bot instance.
+    :param host: Address to listen on.
+    :param port: Port to listen on.
+    """
+    logger.info("Listening for webhook updates on %s:%s%s", host, port, WEBHOOK_PATH)
+    web.run_app(create_app(bot), host=host, port=port, print=None)
@@ -0,0 +1,240 @@
+# workers.py
+
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import config
+from state import preload_state
+
+logger = logging.getLogger(__name__)
+
+# Blocking SDK calls run on bounded thread pools so they never stall the asyncio event loop.
+# Database calls are short and get their own pool, so slow Gemini/SerpAPI calls cannot starve checklist taps.
+DB_WORKERS = getattr(config, "DB_WORKERS", 16)
+API_WORKERS = getattr(config, "API_WORKERS", 32)
+_db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+_api_executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="api")
+
+async def _run_in_executor(executor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Runs a blocking MongoDB call on the database pool.
+    :param func: Blocking function to run.
+    :return: The function result.
+    """
+    return await _run_in_executor(_db_executor, func, *args, **kwargs)
+
+
+def submit_db(func, *args, **kwargs):
+    """
+    Starts a blocking MongoDB call on the database pool without waiting for it, e.g. a counter update that must not
+    delay the answer. The call has to log its own errors.
+    :param func: Blocking function to run.
+    :return: concurrent.futures.Future of the result.
+    """
+    return _db_executor.submit(func, *args, **kwargs)
+
+
+async def run_api(func, *args, **kwargs):
+    """
+    Runs a blocking Gemini or SerpAPI call on the external API pool.
+    :param func: Blocking function to run.
+    :return: The function result.
+    """
+    return await _run_in_executor(_api_executor, func, *args, **kwargs)
+
+
+# Long-running handlers (recommendations, flight searches) share a fixed number of workers and a bounded queue
+LONG_JOB_WORKERS = getattr(config, "LONG_JOB_WORKERS", 8)
+LONG_JOB_MAX_QUEUED = getattr(config, "LONG_JOB_MAX_QUEUED", 100)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted to a JobQueue that has no free queue slots."""
+
+
+class JobQueue:
+    """
+    Runs long jobs on a fixed number of asyncio workers with a bounded queue in front of them.
+    A chat can only have one job of each kind queued or running at a time.
+    """
+
+    def __init__(self, workers=LONG_JOB_WORKERS, max_queued=LONG_JOB_MAX_QUEUED, name="jobs"):
+        """
+        :param workers: Number of jobs running at the same time.
+        :param max_queued: Number of jobs allowed to wait for a worker.
+        :param name: Name of the queue, used in logs.
+        """
+        self.workers = workers
+        self.max_queued = max_queued
+        self.name = name
+        self._queue = None
+        self._tasks = []
+        self._active = set()
+        self._idle = 0
+
+    def _start(self):
+        # Created lazily, the queue and worker tasks need the running event loop
+        self._queue = asyncio.Queue()
+        self._idle = self.workers
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def _worker(self, number):
+        while True:
+            key, job = await self._queue.get()
+            self._idle -= 1
+            try:
+                # The chat's state may have changed while the job was queued
+                await preload_state(key[0])
+                await job()
+            except Exception as e:
+                logger.exception("Job %s failed in %s worker %s: %s", key, self.name, number, e)
+            finally:
+                self._active.discard(key)
+                self._idle += 1
+                self._queue.task_done()
+
+    def submit(self, chat_id, kind, job):
+        """
+        Queues a job.
+        :param chat_id: The chat the job belongs to.
+        :param kind: Kind of the job, e.g. "recommendation". Used for per-chat deduplication.
+        :param job: Coroutine function without arguments.
+        :return: Position in the queue (0 if the job starts right away), or None if the same job is already queued.
+        :raises QueueFullError: If the queue has no free slots.
+        """
+        if self._queue is None:
+            self._start()
+        key = (chat_id, kind)
+        if key in self._active:
+            return None
+        waiting = self._queue.qsize()
+        if waiting >= self.max_queued:
+            raise QueueFullError(f"{self.name} queue is full ({waiting} jobs waiting)")
+        self._active.add(key)
+        self._queue.put_nowait((key, job))
+        return max(0, waiting + 1 - self._idle)
+
+    def stats(self) -> dict:
+        """
+        Returns the queue counters.
+        :return: Dict with running and waiting job counts.
+        """
+        return {
+            "name": self.name,
+            "workers": self.workers,
+            "running": self.workers - self._idle if self._queue else 0,
+            "waiting": self._queue.qsize() if self._queue else 0,
+        }
+
+    def stop(self):
+        """Cancels the worker tasks. Queued jobs are dropped."""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queue = None
+        self._active.clear()
+
+
+long_jobs = JobQueue(name="long jobs")
+
+
+class FanOutPool:
+    """
+    Bounded thread pool for blocking calls that are started together and awaited together, e.g. the searches of
+    several dates or airports. Pools are shut down by shutdown_workers().
+    """
+
+    def __init__(self, name, workers, per_run=None):
+        """
+        :param name: Name of the pool, used in thread names and logs.
+        :param workers: Number of calls running at the same time.
+        :param per_run: Number of calls of one run_all() running at the same time, so concurrent runs share the
+                        workers. Defaults to all workers.
+        """
+        self.name = name
+        self.workers = workers
+        self.per_run = min(per_run or workers, workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name.replace(" ", "-"))
+        _fan_out_pools.append(self)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Starts one call in the background.
+        :param func: Blocking function to run.
+        :return: concurrent.futures.Future of the result, cancelling it drops the call if it has not started yet.
+        """
+        return self._executor.submit(func, *args, **kwargs)
+
+    def run_all(self, calls, timeout) -> list:
+        """
+        Runs the calls at once, up to per_run at a time, so the total wait is about the slowest call instead of the
+        sum. Each call gets timeout seconds once it runs. A call waiting longer than timeout for a worker of a
+        pool busy with other runs also counts as failed.
+        :param calls: List of (label, function without arguments), the label names the call in logs.
+        :param timeout: Seconds a call may run, and may wait for a worker.
+        :return: List of results in the order of calls, None for calls that failed or timed out.
+        """
+        results = [None] * len(calls)
+        started = [None] * len(calls)
+
+        def run(index, func):
+            started[index] = time.monotonic()
+            return func()
+
+        pending = {}
+        next_call = 0
+        while next_call < len(calls) or pending:
+            while next_call < len(calls) and len(pending) < self.per_run:
+                pending[self._executor.submit(run, next_call, calls[next_call][1])] = (next_call, time.monotonic())
+                next_call += 1
+
+            now = time.monotonic()
+            deadlines = {}
+            for future, (index, submitted) in list(pending.items()):
+                deadline = (started[index] or submitted) + timeout
+                if deadline > now or future.done():
+                    deadlines[future] = deadline
+                    continue
+                del pending[future]
+                # Drops the call if it has not started yet, a running call finishes in the background
+                future.cancel()
+                if started[index] is None:
+                    logger.error("%s: %s waited for a worker for more than %s s", self.name, calls[index][0],
+                                 timeout)
+                else:
+                    logger.error("%s: %s timed out after %s s", self.name, calls[index][0], timeout)
+            if not pending:
+                continue
+
+            done, _ = wait(pending, timeout=max(0.0, min(deadlines.values()) - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                index, _ = pending.pop(future)
+                if future.exception():
+                    logger.error("%s: %s failed: %s", self.name, calls[index][0], future.exception())
+                else:
+                    results[index] = future.result()
+        return results
+
+    def shutdown(self):
+        """Stops the pool, dropping calls that have not started yet."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_fan_out_pools = []
+
+
+def shutdown_workers():
+    """Stops the worker pools, dropping calls that have not started yet."""
+    _db_executor.shutdown(wait=False, cancel_futures=True)
+    _api_executor.shutdown(wait=False, cancel_futures=True)
+    for pool in _fan_out_pools:
+        pool.shutdown()
+    logger.info("Stopped worker pools")